@@ -0,0 +1,45 @@
+"""
+Compares the vectorized NumPy icon renderer with the ellipse loop.
+
+    python benchmarks/bench_icon_renderer.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import icon_renderer
+
+COLORS = list(icon_renderer.STATE_COLORS.values()) + [(255, 165, 0), (128, 0, 255)]
+SIZES = icon_renderer.ICON_SIZES
+REPEAT = 20
+
+def bench(render):
+    def run():
+        for rgb in COLORS:
+            for size in SIZES:
+                render(rgb, icon_renderer.glow_color(rgb), size)
+    seconds = min(timeit.repeat(run, number=1, repeat=REPEAT))
+    return seconds * 1000 / (len(COLORS) * len(SIZES))
+
+def max_channel_difference():
+    """Largest per-channel difference between the two renderers, over every color and size."""
+    import numpy as np
+    worst = 0
+    for rgb in COLORS:
+        for size in SIZES:
+            a = np.asarray(icon_renderer.render_gradient_ellipses(rgb, icon_renderer.glow_color(rgb), size), dtype=int)
+            b = np.asarray(icon_renderer.render_gradient_numpy(rgb, icon_renderer.glow_color(rgb), size), dtype=int)
+            # Only compare color where both are opaque enough for it to be visible
+            visible = (a[..., 3] > 128) & (b[..., 3] > 128)
+            worst = max(worst, int(np.abs(a[visible][:, :3] - b[visible][:, :3]).max()))
+    return worst
+
+if __name__ == "__main__":
+    if icon_renderer.np is None:
+        sys.exit("NumPy is not installed; nothing to compare.")
+    ellipses = bench(icon_renderer.render_gradient_ellipses)
+    vectorized = bench(icon_renderer.render_gradient_numpy)
+    print(f"ellipse loop: {ellipses:.3f} ms/icon")
+    print(f"numpy:        {vectorized:.3f} ms/icon ({ellipses / vectorized:.1f}x faster)")
+    print(f"max RGB difference on opaque pixels: {max_channel_difference()}")
@@ -0,0 +1,257 @@
+"""
+Microbenchmarks for the schedule engine, config store, HID write path and
+tray icons. Results are microseconds per operation (best of several runs).
+
+    python benchmarks/run_benchmarks.py                  # table + compare to baseline.json
+    python benchmarks/run_benchmarks.py --json           # results as JSON on stdout
+    python benchmarks/run_benchmarks.py --update-baseline
+
+Exits with status 1 when a benchmark is more than --threshold times slower
+than the stored baseline. Baselines are machine-specific: regenerate
+baseline.json on the machine that runs the comparison.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+RULE_COUNTS = (1, 10, 100, 1000, 10000, 100000)
+QUICK_RULE_COUNTS = (1, 100, 10000)
+DEFAULT_THRESHOLD = 1.5
+# Slowdowns smaller than this (in us/op) are timer noise, whatever the ratio
+MIN_DELTA_US = 1.0
+REPEAT = 5
+
+def measure(fn, number=None, repeat=REPEAT):
+    """Best-of-`repeat` time per call of fn, in microseconds."""
+    timer = timeit.Timer(fn)
+    if number is None:
+        # Enough calls per run to take roughly 0.05-0.1s
+        number, _ = timer.autorange()
+        number = max(1, number // 4)
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+class StaticConfig:
+    """Minimal in-memory config store for engine benchmarks."""
+    def __init__(self, config):
+        self.config = config
+        self.version = 0
+
+    def reload(self):
+        pass
+
+def make_rules(count, seed=0):
+    rng = random.Random(seed)
+    days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+    states = ["open", "focused", "away", "off"]
+    rules = []
+    for _ in range(count):
+        start, end = rng.randrange(1440), rng.randrange(1440)
+        rules.append({
+            "days": rng.sample(days, rng.randint(1, 7)),
+            "start": f"{start // 60:02d}:{start % 60:02d}",
+            "end": f"{end // 60:02d}:{end % 60:02d}",
+            "state": rng.choice(states),
+            "enabled": True
+        })
+    return rules
+
+def bench_engine(results, rule_counts):
+    from schedule_engine import ScheduleEngine
+
+    week = [datetime(2024, 1, 1) + timedelta(minutes=7 * m) for m in range(1440)]
+    for count in rule_counts:
+        store = StaticConfig({"default_state": "away", "rules": make_rules(count), "manual_override": None})
+        engine = ScheduleEngine(store)
+
+        # Hot: the compiled table is reused
+        engine.get_desired_status(week[0])
+        moments = itertools.cycle(week)
+        results[f"engine.get_desired_status.hot[rules={count}]"] = measure(lambda: engine.get_desired_status(next(moments)))
+
+        # Cold: every call follows a schedule change and recompiles
+        def cold():
+            store.config["default_state"] = "off" if store.config["default_state"] == "away" else "away"
+            store.version += 1
+            engine.get_desired_status(week[0])
+        results[f"engine.get_desired_status.cold[rules={count}]"] = measure(cold, number=1 if count >= 10000 else None, repeat=3)
+
+        # Override: a config write that leaves the schedule alone (force, resume, expiry)
+        def override_write():
+            store.version += 1
+            engine.get_desired_status(week[0])
+        results[f"engine.get_desired_status.override[rules={count}]"] = measure(override_write, number=1 if count >= 10000 else None, repeat=3)
+
+def bench_batch(results):
+    """Every minute of a quarter in one call, per timestamp."""
+    from schedule_engine import ScheduleEngine
+
+    engine = ScheduleEngine(StaticConfig({"default_state": "away", "rules": make_rules(100), "manual_override": None}))
+    start = datetime(2024, 1, 1)
+    minutes = 91 * 24 * 60
+    timestamps = [start + timedelta(minutes=m) for m in range(minutes)]
+    results["engine.get_desired_status_many[quarter,list]"] = measure(lambda: engine.get_desired_status_many(timestamps), number=1, repeat=3) / minutes
+
+    try:
+        import numpy as np
+    except ImportError:
+        return
+    array = np.arange(np.datetime64(start), np.datetime64(start) + np.timedelta64(minutes, "m"), np.timedelta64(1, "m"))
+    results["engine.get_desired_status_many[quarter,numpy]"] = measure(lambda: engine.get_desired_status_many(array), number=1, repeat=3) / minutes
+
+def bench_config_store(results):
+    from config_store import ConfigStore
+
+    home = tempfile.mkdtemp(prefix="blync-bench-")
+    os.environ["HOME"] = os.environ["USERPROFILE"] = home
+
+    for mode in ("watcher", "polling"):
+        store = ConfigStore()
+        store.config["save_debounce_seconds"] = 0
+        if mode == "polling":
+            store.stop_watching()
+        store.set("default_state", "open")
+        store.flush()
+
+        # Hot: config.json unchanged since the last read
+        results[f"config_store.get.hot[{mode}]"] = measure(lambda: store.get("default_state"))
+        results[f"config_store.reload.hot[{mode}]"] = measure(store.reload)
+
+        # set() with a changed value: version bump, listeners and an atomic write
+        values = itertools.cycle(["open", "away"])
+        def set_changed():
+            store.set("default_state", next(values))
+            store.flush()
+        results[f"config_store.set.changed[{mode}]"] = measure(set_changed, repeat=3)
+        results[f"config_store.set.unchanged[{mode}]"] = measure(lambda: store.set("poll_seconds", 2))
+        store.stop_watching()
+
+    # Cold: a fresh store reads and parses config.json
+    def cold_load():
+        ConfigStore().stop_watching()
+    results["config_store.load.cold"] = measure(cold_load, number=50, repeat=3)
+
+class FakeHIDDevice:
+    def open_path(self, path):
+        pass
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+class FakeHID:
+    """Stands in for the hidapi module with one attached light."""
+    def enumerate(self, vid=0):
+        return [{"path": b"bench-light", "product_string": "Blynclight"}]
+
+    def device(self):
+        return FakeHIDDevice()
+
+def bench_hid(results):
+    import device_controller
+
+    device_controller.hid = FakeHID()
+    controller = device_controller.HIDFallbackController(b"bench-light")
+    controller.connect()
+
+    colors = itertools.cycle([(255, 0, 0), (0, 0, 255)])
+    results["hid.set_color.changed"] = measure(lambda: controller.set_color(*next(colors)))
+    results["hid.set_color.unchanged"] = measure(lambda: controller.set_color(0, 255, 0))
+
+def bench_tray_icon(results):
+    try:
+        import tray_app
+        import icon_renderer
+    except ImportError as e:
+        print(f"Skipping tray icon benchmarks: {e}", file=sys.stderr)
+        return
+    from config_store import ConfigStore
+    from device_controller import DeviceManager
+
+    config_store = ConfigStore()
+    app = tray_app.TrayApp(config_store, DeviceManager(config_store))
+    states = itertools.cycle(["open", "focused", "away", "off"])
+
+    results["tray.create_image.hot"] = measure(lambda: app.create_image(next(states)))
+
+    def cold():
+        icon_renderer.get_icon.cache_clear()
+        icon_renderer.load_atlas.cache_clear()
+        app.create_image(next(states))
+    results["tray.create_image.cold"] = measure(cold, repeat=3)
+    config_store.stop_watching()
+
+def run(quick=False):
+    results = {}
+    bench_engine(results, QUICK_RULE_COUNTS if quick else RULE_COUNTS)
+    bench_batch(results)
+    bench_config_store(results)
+    bench_hid(results)
+    bench_tray_icon(results)
+    return {
+        "unit": "us/op",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {name: round(value, 3) for name, value in results.items()}
+    }
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, min_delta=MIN_DELTA_US):
+    """Returns {name: ratio} for benchmarks more than `threshold` times slower than baseline."""
+    regressions = {}
+    for name, value in results.items():
+        previous = baseline.get(name)
+        if previous and value / previous > threshold and value - previous > min_delta:
+            regressions[name] = round(value / previous, 2)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="slowdown ratio that counts as a regression")
+    parser.add_argument("--quick", action="store_true", help="fewer rule counts")
+    args = parser.parse_args(argv)
+
+    report = run(quick=args.quick)
+    results = report["results"]
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    regressions = compare(results, baseline, args.threshold)
+    report["regressions"] = regressions
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for name, value in results.items():
+            previous = baseline.get(name)
+            change = f"{value / previous:6.2f}x" if previous else "     -"
+            flag = "  REGRESSION" if name in regressions else ""
+            print(f"{name:55} {value:12.3f} us  {change}{flag}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        return 0
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
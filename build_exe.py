@@ -2,45 +2,35 @@ import os
 import sys
 import subprocess
 from pathlib import Path
-from PIL import Image, ImageDraw
+import icon_renderer
 
 def create_ico():
     """Generates a professional .ico file from our dynamic icon logic."""
     print("Generating application icon...")
-    canvas_size = 256
     colors = {
         "primary": (99, 102, 241), # Indigo
         "glow": (165, 180, 252)    # Lighter Indigo
     }
     
-    image = Image.new('RGBA', (canvas_size, canvas_size), (0, 0, 0, 0))
-    dc = ImageDraw.Draw(image)
-    
-    center_xy = canvas_size // 2
-    max_radius = (canvas_size // 2) - 10
-    
-    # Draw radial gradient
-    for r in range(max_radius, 0, -2):
-        t = (r / max_radius) ** 1.8
-        curr_color = tuple(
-            int(colors["glow"][i] + (colors["primary"][i] - colors["glow"][i]) * t)
-            for i in range(3)
-        )
-        bbox = [center_xy - r, center_xy - r, center_xy + r, center_xy + r]
-        dc.ellipse(bbox, fill=curr_color)
-
-    dc.ellipse([center_xy - max_radius, center_xy - max_radius, 
-               center_xy + max_radius, center_xy + max_radius], 
-               outline=(0, 0, 0, 40), width=4)
+    image = icon_renderer.render_gradient_icon(colors["primary"], colors["glow"], margin=10)
 
     image.save('app_icon.ico', format='ICO', sizes=[(256, 256), (128, 128), (64, 64), (32, 32), (16, 16)])
     image.save('app_icon.png')
     print("Icon generated: app_icon.ico")
 
+def create_icon_atlas():
+    """Pre-renders every tray state icon into a sprite sheet bundled with the EXE."""
+    print("Generating tray icon atlas...")
+    icon_renderer.save_atlas(icon_renderer.ATLAS_NAME)
+    print(f"Icon atlas generated: {icon_renderer.ATLAS_NAME}")
+
 def build():
     # 1. Ensure icon exists
     if not os.path.exists('app_icon.ico'):
         create_ico()
+
+    # Always re-bake the atlas so it matches the current palette
+    create_icon_atlas()
         
     # 2. Prepare PyInstaller command
     # --noconsole: Hide terminal
@@ -56,6 +46,12 @@ def build():
         '--noconsole',
         '--onefile',
         f'--add-data=web_ui{sep}web_ui',
+        f'--add-data={icon_renderer.ATLAS_NAME}{sep}.',
+        # zoneinfo loads tzdata dynamically, so PyInstaller can't see it
+        '--hidden-import=tzdata',
+        '--collect-data=tzdata',
+        # icon_renderer imports numpy inside a try block; make sure it ships
+        '--hidden-import=numpy',
         '--icon=app_icon.ico',
         '--name=BlynclightScheduler',
         '--clean',
@@ -78,5 +74,7 @@ def build():
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "--icon-only":
         create_ico()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--atlas-only":
+        create_icon_atlas()
     else:
         build()
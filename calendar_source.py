@@ -0,0 +1,549 @@
+"""
+Local .ics calendars as an additional schedule source.
+
+Configured in config.json as, e.g.
+
+    "calendars": [
+        {"path": "C:/Users/me/work.ics", "state": "focused"},
+        {"path": "C:/Users/me/ooo.ics", "state": "away", "all_day_state": "away"}
+    ]
+
+While an event is in progress its calendar's state applies (later
+calendars win where events overlap). All-day events only count when the
+calendar sets "all_day_state"; cancelled and free ("TRANSP:TRANSPARENT")
+events never do.
+
+Recurring events (RRULE with FREQ DAILY/WEEKLY/MONTHLY/YEARLY, INTERVAL,
+COUNT, UNTIL, BYDAY, BYMONTHDAY, BYMONTH, BYSETPOS; EXDATE; RECURRENCE-ID
+overrides) are expanded only inside a rolling window around "now" and
+flattened into a sorted, non-overlapping segment index, so a lookup is a
+bisect. Times are converted to naive local time, like everything the
+schedule engine handles; TZIDs that zoneinfo doesn't know are treated as
+local time (with a warning in the log).
+"""
+import calendar
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+import metrics
+
+try:
+    import zoneinfo
+except ImportError:
+    zoneinfo = None
+
+CALENDAR_EXPANSIONS = metrics.counter("blynclight_calendar_expansions_total", "Calendar recurrence expansions (window moves and file changes)")
+CALENDAR_LOADS = metrics.counter("blynclight_calendar_loads_total", "Times an .ics file was read and parsed")
+
+WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+DURATION_RE = re.compile(r"([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+# Safety net against rules that never produce an occurrence in range
+MAX_PERIODS_PER_EXPANSION = 100000
+
+@lru_cache(maxsize=64)
+def get_zone(tzid):
+    """
+    Returns the tzinfo for an IANA TZID, or None (treat as local time) if
+    unknown. Windows has no system zone database: the tzdata package
+    (bundled into the EXE) provides it. Cached, so each unknown TZID is
+    reported once.
+    """
+    tzid = tzid.strip('"')
+    if zoneinfo is None:
+        logging.warning(f"No time zone support; calendar times in {tzid} are treated as local time")
+        return None
+    try:
+        return zoneinfo.ZoneInfo(tzid)
+    except Exception:
+        logging.warning(f"Unknown calendar time zone {tzid!r}; its times are treated as local time")
+        return None
+
+def to_local(wall, tz):
+    """Converts a naive wall time in tz (None = already local) to naive local time."""
+    if tz is None:
+        return wall
+    return wall.replace(tzinfo=tz).astimezone().replace(tzinfo=None)
+
+def unfold(text):
+    """Splits iCalendar text into logical lines, joining folded continuations."""
+    lines = []
+    for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        if line[:1] in (" ", "\t") and lines:
+            lines[-1] += line[1:]
+        elif line:
+            lines.append(line)
+    return lines
+
+def parse_property(line):
+    """Returns (NAME, {PARAM: value}, value) for one content line."""
+    # The value starts at the first colon outside a quoted parameter value
+    in_quotes = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quotes = not in_quotes
+        elif ch == ":" and not in_quotes:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return line.upper(), {}, ""
+    name, *params = head.split(";")
+    parsed = {}
+    for param in params:
+        key, _, val = param.partition("=")
+        parsed[key.upper()] = val.strip('"')
+    return name.upper(), parsed, value
+
+def parse_datetime(value, params):
+    """Returns (naive datetime, tzinfo or None, is_date) for a DATE or DATE-TIME value."""
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.strptime(value[:8], "%Y%m%d"), None, True
+    wall = datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        return wall, timezone.utc, False
+    if "TZID" in params:
+        return wall, get_zone(params["TZID"]), False
+    return wall, None, False
+
+def parse_duration(value):
+    match = DURATION_RE.match(value.strip())
+    if not match:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == "-" else duration
+
+def parse_rrule(value):
+    rule = {}
+    for part in value.split(";"):
+        key, _, val = part.partition("=")
+        rule[key.upper()] = val
+    parsed = {
+        "freq": rule.get("FREQ", "").upper(),
+        "interval": max(1, int(rule.get("INTERVAL", 1))),
+        "count": int(rule["COUNT"]) if "COUNT" in rule else None,
+        "until": rule.get("UNTIL"),
+        "byday": [],
+        "bymonthday": [int(d) for d in rule["BYMONTHDAY"].split(",")] if rule.get("BYMONTHDAY") else [],
+        "bymonth": [int(m) for m in rule["BYMONTH"].split(",")] if rule.get("BYMONTH") else [],
+        "bysetpos": [int(p) for p in rule["BYSETPOS"].split(",")] if rule.get("BYSETPOS") else [],
+    }
+    for day in filter(None, rule.get("BYDAY", "").split(",")):
+        ordinal, weekday = day[:-2], day[-2:].upper()
+        if weekday in WEEKDAYS:
+            parsed["byday"].append((int(ordinal) if ordinal not in ("", "+") else None, WEEKDAYS[weekday]))
+    return parsed
+
+class CalendarEvent:
+    """One VEVENT: a single occurrence, or a recurring series in the event's own wall time."""
+    def __init__(self, props):
+        self.uid = props.get("UID", [("", {})])[0][0]
+        self.summary = props.get("SUMMARY", [("", {})])[0][0]
+        self.cancelled = props.get("STATUS", [("", {})])[0][0].upper() == "CANCELLED"
+        self.transparent = props.get("TRANSP", [("", {})])[0][0].upper() == "TRANSPARENT"
+
+        value, params = props["DTSTART"][0]
+        self.start, self.tz, self.all_day = parse_datetime(value, params)
+        if "DTEND" in props:
+            end_value, end_params = props["DTEND"][0]
+            end, end_tz, _ = parse_datetime(end_value, end_params)
+            if end_tz is not self.tz and end_tz is not None and self.tz is not None:
+                end = end.replace(tzinfo=end_tz).astimezone(self.tz).replace(tzinfo=None)
+            self.duration = end - self.start
+        elif "DURATION" in props:
+            self.duration = parse_duration(props["DURATION"][0][0]) or timedelta(0)
+        else:
+            self.duration = timedelta(days=1) if self.all_day else timedelta(0)
+
+        self.rrule = parse_rrule(props["RRULE"][0][0]) if "RRULE" in props else None
+        self.until = None
+        if self.rrule and self.rrule["until"]:
+            until, until_tz, is_date = parse_datetime(self.rrule["until"], {})
+            if is_date:
+                until = until + timedelta(days=1) - timedelta(microseconds=1)
+            elif until_tz is not None:
+                until = until.replace(tzinfo=until_tz)
+                until = (until.astimezone(self.tz) if self.tz else until.astimezone()).replace(tzinfo=None)
+            self.until = until
+
+        self.exdates = set()
+        for value, params in props.get("EXDATE", []):
+            for item in value.split(","):
+                if item.strip():
+                    self.exdates.add(self._to_wall(*parse_datetime(item, params)[:2]))
+
+        self.recurrence_id = None
+        if "RECURRENCE-ID" in props:
+            value, params = props["RECURRENCE-ID"][0]
+            self.recurrence_id = self._to_wall(*parse_datetime(value, params)[:2])
+
+    def _to_wall(self, wall, tz):
+        """Expresses a parsed time in this event's wall time."""
+        if tz is None or tz is self.tz:
+            return wall
+        aware = wall.replace(tzinfo=tz)
+        return (aware.astimezone(self.tz) if self.tz else aware.astimezone()).replace(tzinfo=None)
+
+    def occurrences(self, range_start, range_end):
+        """Yields (start, end) in local time for occurrences overlapping [range_start, range_end)."""
+        # The event's wall time can differ from local time by up to a day
+        wall_start, wall_end = range_start - timedelta(days=1), range_end + timedelta(days=1)
+        for start in self._wall_starts(wall_start - self.duration, wall_end):
+            if start in self.exdates:
+                continue
+            local_start, local_end = to_local(start, self.tz), to_local(start + self.duration, self.tz)
+            if local_end > range_start and local_start < range_end:
+                yield local_start, local_end
+
+    def _wall_starts(self, range_start, range_end):
+        if self.rrule is None:
+            if range_start <= self.start < range_end:
+                yield self.start
+            return
+        if self.rrule["freq"] not in ("DAILY", "WEEKLY", "MONTHLY", "YEARLY"):
+            return
+
+        # COUNT needs every occurrence since DTSTART; otherwise jump straight to the range
+        count = self.rrule["count"]
+        period = 0 if count is not None else max(0, self._period_index(range_start) - 1)
+        seen = 0
+        for _ in range(MAX_PERIODS_PER_EXPANSION):
+            if self._period_start(period) >= range_end:
+                return
+            for start in self._period_candidates(period):
+                if start < self.start:
+                    continue
+                if self.until is not None and start > self.until:
+                    return
+                seen += 1
+                if count is not None and seen > count:
+                    return
+                if start >= range_end:
+                    return
+                if start >= range_start:
+                    yield start
+            period += 1
+
+    def _period_index(self, moment):
+        freq, interval, s = self.rrule["freq"], self.rrule["interval"], self.start
+        if freq == "DAILY":
+            return (moment.date() - s.date()).days // interval
+        if freq == "WEEKLY":
+            week0 = s.date() - timedelta(days=s.weekday())
+            return (moment.date() - week0).days // 7 // interval
+        if freq == "MONTHLY":
+            return ((moment.year - s.year) * 12 + moment.month - s.month) // interval
+        return (moment.year - s.year) // interval
+
+    def _period_start(self, period):
+        """Earliest moment period can produce an occurrence (ignoring the time of day)."""
+        freq, interval, s = self.rrule["freq"], self.rrule["interval"], self.start
+        if freq == "DAILY":
+            return datetime.combine(s.date() + timedelta(days=period * interval), datetime.min.time())
+        if freq == "WEEKLY":
+            week0 = s.date() - timedelta(days=s.weekday())
+            return datetime.combine(week0 + timedelta(weeks=period * interval), datetime.min.time())
+        if freq == "MONTHLY":
+            year, month = divmod(s.month - 1 + period * interval, 12)
+            return datetime(s.year + year, month + 1, 1)
+        return datetime(s.year + period * interval, 1, 1)
+
+    def _period_candidates(self, period):
+        """Sorted occurrence starts generated by one period of the rule."""
+        rule, s = self.rrule, self.start
+        freq, interval = rule["freq"], rule["interval"]
+        if freq == "DAILY":
+            candidates = [s + timedelta(days=period * interval)]
+            if rule["byday"]:
+                weekdays = {weekday for _, weekday in rule["byday"]}
+                candidates = [c for c in candidates if c.weekday() in weekdays]
+        elif freq == "WEEKLY":
+            week_start = s - timedelta(days=s.weekday()) + timedelta(weeks=period * interval)
+            weekdays = sorted({weekday for _, weekday in rule["byday"]}) or [s.weekday()]
+            candidates = [week_start + timedelta(days=weekday) for weekday in weekdays]
+        elif freq == "MONTHLY":
+            year, month = divmod(s.month - 1 + period * interval, 12)
+            candidates = self._month_days(s.year + year, month + 1)
+        else:
+            year = s.year + period * interval
+            candidates = [c for month in (rule["bymonth"] or [s.month]) for c in self._month_days(year, month)]
+
+        if rule["bymonth"] and freq != "YEARLY":
+            candidates = [c for c in candidates if c.month in rule["bymonth"]]
+        if rule["bymonthday"] and freq in ("DAILY", "WEEKLY"):
+            candidates = [c for c in candidates if c.day in rule["bymonthday"]]
+        candidates.sort()
+        if rule["bysetpos"]:
+            picked = []
+            for pos in rule["bysetpos"]:
+                index = pos - 1 if pos > 0 else len(candidates) + pos
+                if 0 <= index < len(candidates):
+                    picked.append(candidates[index])
+            candidates = sorted(set(picked))
+        return candidates
+
+    def _month_days(self, year, month):
+        rule, s = self.rrule, self.start
+        days_in_month = calendar.monthrange(year, month)[1]
+        monthdays = set()
+        for day in rule["bymonthday"]:
+            day = day if day > 0 else days_in_month + day + 1
+            if 1 <= day <= days_in_month:
+                monthdays.add(day)
+
+        weekdays = set()
+        for ordinal, weekday in rule["byday"]:
+            matching = [d for d in range(1, days_in_month + 1) if date(year, month, d).weekday() == weekday]
+            if ordinal is None:
+                weekdays.update(matching)
+            elif -len(matching) <= ordinal <= len(matching) and ordinal != 0:
+                weekdays.add(matching[ordinal - 1 if ordinal > 0 else ordinal])
+
+        if rule["bymonthday"] and rule["byday"]:
+            days = monthdays & weekdays
+        elif rule["bymonthday"] or rule["byday"]:
+            days = monthdays | weekdays
+        else:
+            # Months without DTSTART's day (e.g. the 31st) are skipped
+            days = {s.day} if s.day <= days_in_month else set()
+        return [datetime(year, month, d, s.hour, s.minute, s.second) for d in sorted(days)]
+
+def parse_ics(text):
+    """Returns the VEVENTs in an iCalendar document, with RECURRENCE-ID overrides folded in."""
+    events = []
+    props = None
+    depth = 0
+    for line in unfold(text):
+        name, params, value = parse_property(line)
+        if name == "BEGIN":
+            if value.upper() == "VEVENT" and depth == 0:
+                props = {}
+            elif props is not None:
+                # Nested components (VALARM) are not part of the event
+                depth += 1
+        elif name == "END":
+            if depth:
+                depth -= 1
+            elif value.upper() == "VEVENT" and props is not None:
+                if "DTSTART" in props:
+                    try:
+                        events.append(CalendarEvent(props))
+                    except (ValueError, KeyError) as e:
+                        logging.warning(f"Skipping unreadable calendar event: {e}")
+                props = None
+        elif props is not None and not depth:
+            props.setdefault(name, []).append((value, params))
+
+    # A modified instance replaces its series' occurrence at RECURRENCE-ID
+    masters = {event.uid: event for event in events if event.rrule is not None and event.recurrence_id is None}
+    for event in events:
+        if event.recurrence_id is not None and event.uid in masters:
+            masters[event.uid].exdates.add(event.recurrence_id)
+    return events
+
+class CalendarFile:
+    """One configured .ics file, re-parsed whenever its modification time changes."""
+    def __init__(self, path, state, all_day_state=None):
+        self.path = os.path.expanduser(str(path))
+        self.state = str(state).lower()
+        self.all_day_state = str(all_day_state).lower() if all_day_state else None
+        self.events = []
+        self.mtime = None
+
+    def refresh(self):
+        """Reloads the file if it changed; returns True when the events changed."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        self.events = []
+        if mtime is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8", errors="replace") as f:
+                    self.events = parse_ics(f.read())
+                CALENDAR_LOADS.inc()
+            except OSError as e:
+                logging.error(f"Failed to read calendar {self.path}: {e}")
+        return True
+
+    def expand(self, start, end):
+        """Returns (start, end, state) for every busy occurrence overlapping [start, end)."""
+        intervals = []
+        for event in self.events:
+            if event.cancelled or event.transparent:
+                continue
+            state = self.all_day_state if event.all_day else self.state
+            if state is None:
+                continue
+            for occurrence_start, occurrence_end in event.occurrences(start, end):
+                if occurrence_end > occurrence_start:
+                    intervals.append((occurrence_start, occurrence_end, state))
+        return intervals
+
+def flatten(intervals, start, end):
+    """
+    Resolves prioritized, possibly overlapping (start, end, state, priority)
+    intervals into disjoint (start, end, state) segments within [start, end),
+    the highest priority winning; gaps are left out.
+    """
+    points = []
+    for s, e, state, priority in intervals:
+        s, e = max(s, start), min(e, end)
+        if s < e:
+            points.append((s, 1, priority, state))
+            points.append((e, -1, priority, state))
+    points.sort(key=lambda p: p[0])
+
+    segments = []
+    active = {}
+    i = 0
+    while i < len(points):
+        moment = points[i][0]
+        while i < len(points) and points[i][0] == moment:
+            _, delta, priority, state = points[i]
+            key = (priority, state)
+            active[key] = active.get(key, 0) + delta
+            if not active[key]:
+                del active[key]
+            i += 1
+        if segments and segments[-1][1] is None:
+            segments[-1][1] = moment
+        if active:
+            state = max(active)[1]
+            if segments and segments[-1][1] == moment and segments[-1][2] == state:
+                segments[-1][1] = None
+            else:
+                segments.append([moment, None, state])
+    return [tuple(segment) for segment in segments]
+
+class CalendarIndex:
+    """
+    Busy segments from all configured calendars for a rolling window
+    around the times looked up. The window is extended incrementally as
+    time moves forward and fully re-expanded only when a file changes.
+    Safe to share between threads (the dashboard server's handlers do).
+    """
+    WINDOW_DAYS = 14
+    LOOKBEHIND = timedelta(days=1)
+    # How often lookups stat the .ics files for changes
+    CHECK_SECONDS = 5
+
+    def __init__(self, window_days=WINDOW_DAYS, check_seconds=CHECK_SECONDS):
+        self.window = timedelta(days=window_days)
+        self.check_seconds = check_seconds
+        self.files = []
+        # Reentrant: lookups call check_files() and _ensure_window() under it
+        self._lock = threading.RLock()
+        self._config = None
+        self._last_check = None
+        # Bumped whenever the resolved segments may have changed
+        self.generation = 0
+        self._reset()
+
+    def _reset(self):
+        self.window_start = self.window_end = None
+        self._intervals = []
+        self._segments = []
+        self._segment_starts = []
+
+    def configure(self, calendars):
+        """Applies the "calendars" config list; files whose settings didn't change keep their events."""
+        with self._lock:
+            config = [(c.get("path"), c.get("state", "focused"), c.get("all_day_state"))
+                      for c in calendars if isinstance(c, dict) and c.get("path") and c.get("enabled", True)]
+            if config == self._config:
+                return
+            existing = {(f.path, f.state, f.all_day_state): f for f in self.files}
+            files = []
+            for path, state, all_day_state in config:
+                candidate = CalendarFile(path, state, all_day_state)
+                files.append(existing.get((candidate.path, candidate.state, candidate.all_day_state), candidate))
+            self.files = files
+            self._config = config
+            self._last_check = None
+            self._reset()
+            self.generation += 1
+
+    def check_files(self):
+        """Re-reads changed .ics files (at most every check_seconds); returns the generation."""
+        with self._lock:
+            now = time.monotonic()
+            if self._last_check is not None and now - self._last_check < self.check_seconds:
+                return self.generation
+            self._last_check = now
+            if any([f.refresh() for f in self.files]):
+                self._reset()
+                self.generation += 1
+            return self.generation
+
+    def _expand(self, start, end):
+        CALENDAR_EXPANSIONS.inc()
+        intervals = []
+        for priority, calendar_file in enumerate(self.files):
+            intervals.extend((s, e, state, priority) for s, e, state in calendar_file.expand(start, end))
+        return intervals
+
+    def _ensure_window(self, moment):
+        with self._lock:
+            if self.window_start is not None and self.window_start <= moment < self.window_end - self.LOOKBEHIND:
+                return
+            if self.window_start is not None and self.window_start <= moment < self.window_end:
+                # Moving forward: expand only the new stretch and drop what fell behind
+                new_start, new_end = moment - self.LOOKBEHIND, moment + self.window
+                added = [i for i in self._expand(self.window_end, new_end) if i[0] >= self.window_end]
+                self._intervals = [i for i in self._intervals if i[1] > new_start] + added
+            else:
+                new_start, new_end = moment - self.LOOKBEHIND, moment + self.window
+                self._intervals = self._expand(new_start, new_end)
+            self.window_start, self.window_end = new_start, new_end
+            self._segments = flatten(self._intervals, new_start, new_end)
+            self._segment_starts = [segment[0] for segment in self._segments]
+
+    def state_at(self, moment):
+        """The calendar state at moment, or None when no event is in progress."""
+        with self._lock:
+            if not self.files:
+                return None
+            self.check_files()
+            self._ensure_window(moment)
+            idx = bisect_right(self._segment_starts, moment) - 1
+            if idx >= 0 and moment < self._segments[idx][1]:
+                return self._segments[idx][2]
+            return None
+
+    def next_change(self, moment):
+        """The next moment after `moment` where the calendar state changes, if within the window."""
+        with self._lock:
+            if not self.files:
+                return None
+            self.check_files()
+            self._ensure_window(moment)
+            idx = bisect_right(self._segment_starts, moment) - 1
+            if idx >= 0 and moment < self._segments[idx][1]:
+                return self._segments[idx][1]
+            if idx + 1 < len(self._segments):
+                return self._segments[idx + 1][0]
+            return None
+
+    def segments(self, start, end):
+        """Busy (start, end, state) segments within [start, end), for batch lookups and timelines."""
+        with self._lock:
+            if not self.files:
+                return []
+            self.check_files()
+            if self.window_start is not None and self.window_start <= start and end <= self.window_end:
+                segments = self._segments
+            else:
+                # Outside the rolling window: expand just this range, without caching it
+                segments = flatten(self._expand(start, end), start, end)
+            return [(max(s, start), min(e, end), state) for s, e, state in segments if e > start and s < end]
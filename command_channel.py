@@ -0,0 +1,138 @@
+import json
+import logging
+import socket
+import threading
+
+# Port used to ensure only one background engine runs. The engine also
+# accepts commands on it, so a second launch can hand off and exit.
+LOCK_PORT = 8988
+
+# Commands understood by the running engine, one per connection:
+#   open-settings | force <state> [minutes|next] | resume | status | metrics | trace-dump
+COMMANDS = ("open-settings", "force", "resume", "status", "metrics", "trace-dump")
+
+# Commands that can be acknowledged while the engine is still starting and
+# run once it is ready; the others need the engine to answer them
+QUEUEABLE_COMMANDS = ("open-settings", "force", "resume")
+
+MAX_COMMAND_BYTES = 1024
+
+def parse_command(line):
+    """Splits a command line into (name, args); raises ValueError if it isn't a known command."""
+    parts = line.strip().split()
+    if not parts or parts[0] not in COMMANDS:
+        raise ValueError(f"unknown command: {line.strip()!r}")
+    name, args = parts[0], parts[1:]
+    if name == "force" and len(args) not in (1, 2):
+        raise ValueError("usage: force <state> [minutes|next]")
+    if name != "force" and args:
+        raise ValueError(f"{name} takes no arguments")
+    return name, args
+
+def send_command(command, port=LOCK_PORT, timeout=2):
+    """
+    Sends one command to the running engine and returns its reply (a dict),
+    or None if no engine is listening or it didn't answer.
+    """
+    try:
+        with socket.create_connection(("localhost", port), timeout=timeout) as s:
+            s.sendall(command.encode() + b"\n")
+            s.shutdown(socket.SHUT_WR)
+            reply = b""
+            while True:
+                chunk = s.recv(4096)
+                if not chunk:
+                    break
+                reply += chunk
+        return json.loads(reply.decode()) if reply else None
+    except (OSError, ValueError):
+        return None
+
+class CommandServer:
+    """
+    Serves the command protocol on the already-bound lock socket: one
+    newline-terminated command per connection, answered with one JSON line.
+    handler(name, args) returns a dict that is merged into {"ok": true};
+    exceptions it raises are reported as {"ok": false, "error": ...}.
+
+    The server can start before the engine is ready (handler=None), so a
+    second launch is answered right away: queueable commands are
+    acknowledged with {"queued": true} and run by set_handler().
+    """
+    def __init__(self, sock, handler=None, timeout=2):
+        self.sock = sock
+        self.handler = handler
+        self.timeout = timeout
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def set_handler(self, handler):
+        """Makes the engine live: runs the commands queued so far, then serves new ones."""
+        with self.lock:
+            for name, args in self.pending:
+                try:
+                    handler(name, args)
+                except Exception as e:
+                    logging.error(f"Queued command {name} failed: {e}")
+            self.pending = []
+            self.handler = handler
+
+    def stop(self):
+        self.running = False
+        try:
+            # Unblocks accept()
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _run(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                if self.running:
+                    logging.error("Command channel stopped accepting connections")
+                return
+            with conn:
+                self._serve(conn)
+
+    def _serve(self, conn):
+        try:
+            conn.settimeout(self.timeout)
+            data = b""
+            while b"\n" not in data and len(data) < MAX_COMMAND_BYTES:
+                chunk = conn.recv(MAX_COMMAND_BYTES)
+                if not chunk:
+                    break
+                data += chunk
+            line = data.split(b"\n", 1)[0].decode(errors="replace")
+            if not line.strip():
+                # Bare connect: an older single-instance probe
+                return
+            reply = self.handle(line)
+            conn.sendall(json.dumps(reply).encode() + b"\n")
+        except OSError as e:
+            logging.debug(f"Command connection dropped: {e}")
+
+    def handle(self, line):
+        try:
+            name, args = parse_command(line)
+            logging.info(f"Command received: {line.strip()}")
+            with self.lock:
+                handler = self.handler
+                if handler is None:
+                    if name not in QUEUEABLE_COMMANDS:
+                        raise ValueError("engine is still starting; try again")
+                    self.pending.append((name, args))
+                    return {"ok": True, "queued": True}
+            result = handler(name, args) or {}
+            return dict({"ok": True}, **result)
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
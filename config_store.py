@@ -1,7 +1,35 @@
+import atexit
+import copy
 import json
 import logging
 import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 from pathlib import Path
+import config_watcher
+import log_pipeline
+import metrics
+import status_channel
+
+# Every live store, flushed once at exit (weakly held, so stores can be collected)
+_stores = weakref.WeakSet()
+
+def _flush_all():
+    for store in list(_stores):
+        store.flush()
+
+atexit.register(_flush_all)
+
+CONFIG_LOADS = metrics.counter("blynclight_config_loads_total", "Times config.json was read and parsed")
+CONFIG_STAT_CHECKS = metrics.counter("blynclight_config_stat_checks_total", "reload() calls that had to stat config.json (no watcher, or a change event)")
+CONFIG_SAVES = metrics.counter("blynclight_config_saves_total", "In-memory config changes")
+CONFIG_WRITE_SECONDS = metrics.histogram("blynclight_config_write_seconds", "Time to atomically write config.json")
+
+def get_config_dir():
+    """Where config.json, the status channel and the logs live."""
+    return Path.home() / ".blynclight_scheduler"
 
 class ConfigStore:
     DEFAULT_CONFIG = {
@@ -16,25 +44,122 @@ class ConfigStore:
             }
         ],
         "manual_override": None,
+        # When the manual override ends (ISO local time), or null to hold until resumed
+        "override_until": None,
+        # How long tray "Force" overrides last: null (until resumed), minutes, or "next"
+        # (until the schedule next changes)
+        "override_duration": None,
         "poll_seconds": 2,
         "turn_off_on_exit": True,
-        "start_on_login": False
+        "start_on_login": False,
+        # User-defined states: {"name": "#RRGGBB" or [r, g, b]}
+        "custom_states": {},
+        # Sleep until the next schedule change instead of waking every second.
+        # Without a config watcher (e.g. on Windows) the engine still stats
+        # config.json every poll_seconds so edits apply promptly
+        "sleep_until_change": True,
+        "max_sleep_seconds": 900,
+        # Use OS file events (inotify) instead of stat'ing config.json on every read
+        "watch_config": True,
+        # Coalesce bursts of saves into one atomic write after this delay
+        "save_debounce_seconds": 0.25,
+        # "shm" publishes device status through a memory-mapped record, "file" uses status.json
+        "status_channel": "shm",
+        # React to USB attach/detach events instead of enumerating every tick
+        "hotplug_monitor": True,
+        "hotplug_poll_seconds": 2,
+        # Host the dashboard server inside the engine (opens in the browser)
+        # instead of launching a separate settings process
+        "settings_in_process": False,
+        # Logging: level name, app.log rotation size and backups, and the
+        # window in which repeats of the same message are dropped
+        "log_level": "INFO",
+        "log_max_bytes": 1048576,
+        "log_backup_count": 3,
+        "log_dedup_seconds": 60,
+        # Local .ics files whose events override the rules while they run:
+        # [{"path": "...", "state": "focused", "all_day_state": null}]
+        "calendars": []
     }
 
     def __init__(self, config_name="config.json"):
-        self.config_dir = Path.home() / ".blynclight_scheduler"
+        self.config_dir = get_config_dir()
         self.config_dir.mkdir(exist_ok=True)
         self.config_path = self.config_dir / config_name
         self.status_path = self.config_dir / "status.json"
+        self.status_shm_path = self.config_dir / "status.shm"
         self.log_path = self.config_dir / "app.log"
         self.last_mtime = 0
         self.last_status_mtime = 0
         self.runtime_status = {} 
-        self.config = self.load_config()
+        # True in the process that publishes device status (the engine): its
+        # in-memory copy is authoritative, so reads skip the status channel
+        self.status_owner = False
+        self.log_pipeline = None
+        # Bumped whenever self.config is replaced or saved, so consumers
+        # (e.g. ScheduleEngine) can cache derived data per config version
+        self.version = 0
+        self.listeners = []
+        # Filesystem calls made by the read/write paths (stat, open), so we
+        # can confirm steady-state reads are free when a watcher is active
+        self.fs_calls = 0
+        self.watcher = None
+        self._config_dirty = False
+        self._status_dirty = True
+        # Write coalescing: saves inside a transaction or within the debounce
+        # window are folded into a single atomic write by flush()
+        self._lock = threading.RLock()
+        self._txn_depth = 0
+        self._save_pending = False
+        self._save_timer = None
+        _stores.add(self)
+        # The config as last read from or written to disk: whatever differs
+        # from it in self.config is this process's unwritten change
+        self._saved_config = {}
+        self.config = self._load()
+        self.status_channel = None
+        if self.config.get("status_channel", "shm") == "shm":
+            self.status_channel = status_channel.open_channel(self.status_shm_path)
+        if self.config.get("watch_config", True):
+            self.start_watching()
+
+    def start_watching(self):
+        """Switches reloads to OS file events; keeps mtime polling if unavailable."""
+        if self.watcher is None:
+            self.watcher = config_watcher.create_watcher(self.config_dir, self._on_file_event, self._on_watcher_stopped)
+            if self.watcher:
+                logging.debug(f"Watching {self.config_dir} for config changes")
+
+    def stop_watching(self):
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
+
+    def _on_file_event(self, name):
+        # Runs on the watcher thread: only flag the snapshot as stale
+        if name is None or name == self.config_path.name:
+            self._config_dirty = True
+            self._notify_listeners()
+        if name is None or name == self.status_path.name:
+            self._status_dirty = True
+
+    def _on_watcher_stopped(self):
+        # Runs on the dying watcher thread: go back to stat polling, and
+        # re-read whatever changed while events were being missed
+        watcher, self.watcher = self.watcher, None
+        self._config_dirty = True
+        self._status_dirty = True
+        if watcher:
+            # Its thread is exiting; release the fds without joining it
+            watcher.thread = None
+            watcher.stop()
 
     def load_config(self):
+        self.fs_calls += 1
         if self.config_path.exists():
             try:
+                self.fs_calls += 2
+                CONFIG_LOADS.inc()
                 self.last_mtime = os.path.getmtime(self.config_path)
                 with open(self.config_path, 'r', encoding='utf-8') as f:
                     content = json.load(f)
@@ -48,6 +173,11 @@ class ConfigStore:
                     # Migrate old polling interval for better reactivity
                     if content.get("poll_seconds") == 30:
                         content["poll_seconds"] = 2
+
+                    # Saved with the old opt-in defaults: move to sleeping until the next change
+                    if content.get("sleep_until_change") is False and content.get("max_sleep_seconds") == 60:
+                        content["sleep_until_change"] = True
+                        content["max_sleep_seconds"] = self.DEFAULT_CONFIG["max_sleep_seconds"]
                         
                     # Simple validation/merge
                     config = self.DEFAULT_CONFIG.copy()
@@ -58,18 +188,147 @@ class ConfigStore:
                 logging.error(f"Failed to load config: {e}")
         return self.DEFAULT_CONFIG.copy()
 
+    def _load(self):
+        config = self.load_config()
+        self._saved_config = copy.deepcopy(config)
+        return config
+
+    def _merge_external_changes(self):
+        """
+        Folds config.json, changed on disk by another process while this one
+        has unwritten changes, into the in-memory config: keys changed here
+        keep their local value, everything else comes from disk.
+        """
+        saved = self._saved_config
+        local = {key: value for key, value in self.config.items() if key not in saved or saved[key] != value}
+        removed = [key for key in saved if key not in self.config]
+        merged = self._load()
+        merged.update(copy.deepcopy(local))
+        for key in removed:
+            merged.pop(key, None)
+        self.config = merged
+
     def save_config(self):
+        """
+        Marks the in-memory config as changed and schedules it to be written.
+        Inside a transaction the write waits for the outermost block to exit;
+        otherwise it is debounced by save_debounce_seconds (0 writes at once).
+        """
+        with self._lock:
+            CONFIG_SAVES.inc()
+            self.version += 1
+            self._save_pending = True
+            self._notify_listeners()
+            if self._txn_depth:
+                return
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        delay = self.config.get("save_debounce_seconds", 0) or 0
+        if delay <= 0:
+            self.flush()
+        elif self._save_timer is None:
+            self._save_timer = threading.Timer(delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """Writes any pending changes to disk now."""
+        with self._lock:
+            if self._save_timer:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._save_pending:
+                return
+            # Don't overwrite what another process wrote since we last read
+            self._check_external_write()
+            self._save_pending = False
+            self._write_atomic()
+
+    def _write_atomic(self):
+        # Write a sibling temp file and rename it over config.json, so readers
+        # in other processes see either the old or the new file, never a partial one
+        tmp_path = self.config_path.with_name(f".{self.config_path.name}.{os.getpid()}.tmp")
+        start = time.perf_counter()
         try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
+            self.fs_calls += 3
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 json.dump(self.config, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Windows refuses to replace a file another process has open; retry briefly
+            for attempt in range(5):
+                try:
+                    os.replace(tmp_path, self.config_path)
+                    break
+                except PermissionError:
+                    if attempt == 4:
+                        raise
+                    time.sleep(0.05)
+
             # Update mtime after saving to prevent immediate reload
             self.last_mtime = os.path.getmtime(self.config_path)
+            self._saved_config = copy.deepcopy(self.config)
+            CONFIG_WRITE_SECONDS.observe(time.perf_counter() - start)
         except Exception as e:
             logging.error(f"Failed to save config: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups several mutations into a single write:
+
+            with config_store.transaction():
+                config_store.set("default_state", "away")
+                config_store.set("rules", rules)
+
+        If the block raises, the config is rolled back to how it was when
+        the block started.
+        """
+        with self._lock:
+            if self._txn_depth == 0:
+                self.reload()
+            # If the block raises, its changes are discarded rather than written
+            snapshot = (copy.deepcopy(self.config), self._save_pending)
+            self._txn_depth += 1
+            try:
+                yield self
+            except BaseException:
+                if self.config != snapshot[0]:
+                    self.config, self._save_pending = snapshot
+                    self.version += 1
+                    self._notify_listeners()
+                raise
+            finally:
+                self._txn_depth -= 1
+                if self._txn_depth == 0 and self._save_pending:
+                    self._schedule_flush()
+
+    def add_listener(self, callback):
+        """Registers a no-argument callback invoked whenever the config changes."""
+        self.listeners.append(callback)
+
+    def _notify_listeners(self):
+        for callback in self.listeners:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Config listener failed: {e}")
 
     def get(self, key, default=None):
-        # 1. Device status requires cross-process sync from status.json
+        # 1. Device status requires cross-process sync (shared memory, else status.json)
         if key == "device_status":
+            if self.status_owner:
+                return self.runtime_status.get("device_status", "searching")
+            if self.status_channel:
+                published = self.status_channel.read()
+                if published is not None:
+                    return published.get("device_status", "searching")
             self._reload_status_file()
             return self.runtime_status.get("device_status", "searching")
 
@@ -78,24 +337,62 @@ class ConfigStore:
         return self.config.get(key, default)
 
     def set(self, key, value):
-        # 1. Device status goes to dedicated status file to avoid locking config.json
+        # 1. Device status goes to the status channel to avoid locking config.json
         if key == "device_status":
+            self.status_owner = True
             if self.runtime_status.get(key) != value:
                 self.runtime_status[key] = value
-                self._save_status_file()
+                self._publish_status()
             return
 
         # 2. Regular settings
-        self.reload()
-        if self.config.get(key) != value:
-            self.config[key] = value
-            self.save_config()
+        with self._lock:
+            if not self._txn_depth:
+                self.reload()
+            if self.config.get(key) != value:
+                self.config[key] = value
+                self.save_config()
+
+    def claim_status(self, value):
+        """
+        Makes this process the device status publisher and publishes value
+        right away, so readers stop seeing what a previous run left behind.
+        """
+        self.status_owner = True
+        self.runtime_status = {"device_status": value}
+        self._publish_status()
+
+    @property
+    def status_sequence(self):
+        """Changes whenever the published device status changes."""
+        if self.status_channel:
+            seq = self.status_channel.sequence
+            if seq:
+                return seq
+        self._reload_status_file()
+        return self.last_status_mtime
+
+    def _publish_status(self):
+        if self.status_channel:
+            try:
+                self.status_channel.write(self.runtime_status)
+                return
+            except Exception as e:
+                logging.error(f"Status channel write failed, using status file: {e}")
+                self.status_channel = None
+        self._save_status_file()
 
     def _reload_status_file(self):
+        if self.watcher:
+            if not self._status_dirty: return
+            self._status_dirty = False
+        self.fs_calls += 1
         if not self.status_path.exists(): return
         try:
+            self.fs_calls += 1
             mtime = os.path.getmtime(self.status_path)
             if mtime > self.last_status_mtime:
+                self.fs_calls += 1
                 with open(self.status_path, 'r') as f:
                     self.runtime_status.update(json.load(f))
                 self.last_status_mtime = mtime
@@ -103,28 +400,58 @@ class ConfigStore:
 
     def _save_status_file(self):
         try:
+            self.fs_calls += 2
             with open(self.status_path, 'w') as f:
                 json.dump(self.runtime_status, f)
             self.last_status_mtime = os.path.getmtime(self.status_path)
         except: pass
 
     def reload(self):
+        # With a watcher, the in-memory snapshot is current until an event says otherwise
+        if self.watcher:
+            if not self._config_dirty:
+                return
+            self._config_dirty = False
+
+        CONFIG_STAT_CHECKS.inc()
+        self._check_external_write()
+
+    def _check_external_write(self):
+        """Picks up config.json if another process wrote it, keeping unwritten local changes on top."""
+        self.fs_calls += 1
         if not self.config_path.exists():
             return
             
         try:
+            self.fs_calls += 1
             current_mtime = os.path.getmtime(self.config_path)
             if current_mtime > self.last_mtime:
-                self.config = self.load_config()
+                with self._lock:
+                    if self._save_pending:
+                        self._merge_external_changes()
+                    else:
+                        self.config = self._load()
+                    self.version += 1
+                self._notify_listeners()
         except Exception:
             pass
 
-    def setup_logging(self):
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.StreamHandler(),
-                logging.FileHandler(self.log_path)
-            ]
+    def setup_logging(self, log_name=None):
+        """
+        Starts the background log writer; see log_pipeline.LogPipeline.
+        log_name picks another file in the config dir, so a second
+        long-lived process never rotates the engine's app.log under it.
+        """
+        if self.log_pipeline is not None:
+            return
+        cfg = self.config
+        self.log_pipeline = log_pipeline.LogPipeline(
+            self.config_dir / log_name if log_name else self.log_path,
+            level=cfg.get("log_level", "INFO"),
+            max_bytes=cfg.get("log_max_bytes", 1024 * 1024),
+            backup_count=cfg.get("log_backup_count", 3),
+            dedup_seconds=cfg.get("log_dedup_seconds", 60)
         )
+        self.log_pipeline.start()
+        # Level changes in config.json apply without a restart
+        self.add_listener(lambda: self.log_pipeline.set_level(self.config.get("log_level", "INFO")))
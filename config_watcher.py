@@ -0,0 +1,112 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import platform
+import select
+import struct
+import threading
+
+class InotifyWatcher:
+    """
+    Watches a directory with Linux inotify and reports the names of files
+    that were written, created, replaced or deleted.
+
+    The directory (not the file) is watched so atomic replacements via
+    rename are seen as well as in-place writes.
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_CLOEXEC = 0o2000000
+
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, directory, on_change, on_stop=None):
+        self.directory = str(directory)
+        self.on_change = on_change # Called with a file name, or None on queue overflow
+        self.on_stop = on_stop # Called if the thread dies on an error (not on stop())
+        self.fd = None
+        self.thread = None
+        self._stop_r, self._stop_w = None, None
+
+    @staticmethod
+    def is_supported():
+        return platform.system() == "Linux" and ctypes.util.find_library("c") is not None
+
+    def start(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(self.IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f"inotify_add_watch failed for {self.directory}")
+
+        self.fd = fd
+        self._stop_r, self._stop_w = os.pipe()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self._stop_w is not None:
+            os.write(self._stop_w, b"x")
+        if self.thread:
+            self.thread.join(timeout=1)
+        for fd in (self.fd, self._stop_r, self._stop_w):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.fd = self._stop_r = self._stop_w = None
+        self.thread = None
+
+    def _run(self):
+        while True:
+            try:
+                readable, _, _ = select.select([self.fd, self._stop_r], [], [])
+                if self._stop_r in readable:
+                    return
+                data = os.read(self.fd, 4096)
+            except OSError as e:
+                logging.error(f"Config watcher stopped: {e}")
+                if self.on_stop:
+                    try:
+                        self.on_stop()
+                    except Exception as e:
+                        logging.error(f"Config watcher stop callback failed: {e}")
+                return
+
+            offset = 0
+            while offset + self.EVENT_HEADER.size <= len(data):
+                _, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+                offset += name_len
+
+                try:
+                    self.on_change(None if mask & self.IN_Q_OVERFLOW else name)
+                except Exception as e:
+                    logging.error(f"Config watcher callback failed: {e}")
+
+def create_watcher(directory, on_change, on_stop=None):
+    """
+    Returns a started watcher for directory, or None if no event backend is
+    available on this platform (callers then fall back to mtime polling).
+    on_stop is called if the watcher later dies, so callers can fall back then too.
+    """
+    if not InotifyWatcher.is_supported():
+        return None
+    try:
+        watcher = InotifyWatcher(directory, on_change, on_stop)
+        watcher.start()
+        return watcher
+    except Exception as e:
+        logging.warning(f"Config watcher unavailable, falling back to polling: {e}")
+        return None
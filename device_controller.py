@@ -1,19 +1,45 @@
 import collections
+import collections.abc
 import sys
 import logging
+import random
+import threading
 import time
 from abc import ABC, abstractmethod
-
-# Monkeypatch collections for Python 3.10+ compatibility (required for blynclight library)
-if not hasattr(collections, 'Sequence'):
-    import collections.abc
-    collections.Sequence = collections.abc.Sequence
-    sys.modules['collections.Sequence'] = collections.abc.Sequence
-
-try:
-    from blynclight import BlyncLight as BlynclightLib
-except ImportError:
-    BlynclightLib = None
+from concurrent.futures import ThreadPoolExecutor, wait
+from state_registry import StateRegistry, build_hid_frame
+import hotplug
+import metrics
+import tracing
+
+DEVICE_WRITES = metrics.counter("blynclight_device_writes_total", "Color writes sent to light hardware (skipped identical writes excluded)")
+DEVICE_WRITE_FAILURES = metrics.counter("blynclight_device_write_failures_total", "Light writes that failed")
+DEVICE_ENUMERATIONS = metrics.counter("blynclight_device_enumerations_total", "USB/library enumerations for discovery and liveness checks")
+DEVICE_CONNECTS = metrics.counter("blynclight_device_connects_total", "Full hardware rescans")
+DEVICE_RECONNECTS = metrics.counter("blynclight_device_reconnects_total", "Rescans started by the background reconnect worker")
+LIGHTS_CONNECTED = metrics.gauge("blynclight_lights_connected", "Physical lights currently accepting commands")
+COLOR_CHANGE_SECONDS = metrics.histogram("blynclight_color_change_seconds", "Time to push one color change to every light")
+
+# The blynclight library (and the collections monkeypatch it needs) is
+# imported on first use, so startup can drive a light over plain HID first
+BlynclightLib = None
+_blynclight_loaded = False
+
+def load_blynclight():
+    """Imports the blynclight library once; returns the BlyncLight class or None."""
+    global BlynclightLib, _blynclight_loaded
+    if not _blynclight_loaded:
+        _blynclight_loaded = True
+        # Monkeypatch collections for Python 3.10+ compatibility (required for blynclight library)
+        if not hasattr(collections, 'Sequence'):
+            collections.Sequence = collections.abc.Sequence
+            sys.modules['collections.Sequence'] = collections.abc.Sequence
+        try:
+            from blynclight import BlyncLight
+            BlynclightLib = BlyncLight
+        except ImportError:
+            BlynclightLib = None
+    return BlynclightLib
 
 try:
     import hid
@@ -43,8 +69,21 @@ class LightController(ABC):
 
 class BlynclightController(LightController):
     """Wrapper for the official blynclight library."""
-    def __init__(self):
+    def __init__(self, light_id=0):
+        self.light_id = light_id # Index into BlynclightLib.available_lights()
         self.device = None
+        self.last_color = None # Skip writes identical to the last one
+
+    @staticmethod
+    def discover():
+        """Returns the number of lights the library can see."""
+        if not load_blynclight(): return 0
+        try:
+            DEVICE_ENUMERATIONS.inc()
+            return len(BlynclightLib.available_lights())
+        except Exception as e:
+            logging.debug(f"Blynclight library discovery failed: {e}")
+            return 0
 
     def is_alive(self):
         if not self.device: return False
@@ -52,16 +91,18 @@ class BlynclightController(LightController):
             # We check available lights to see if it's still there
             # This is more reliable than checking properties on the handle
             if not BlynclightLib: return False
-            return len(BlynclightLib.available_lights()) > 0
+            DEVICE_ENUMERATIONS.inc()
+            return len(BlynclightLib.available_lights()) > self.light_id
         except Exception:
             self.device = None
             return False
 
     def connect(self):
-        if not BlynclightLib:
+        if not load_blynclight():
             return False, "Library 'blynclight' not installed."
         try:
-            self.device = BlynclightLib.get_light()
+            self.device = BlynclightLib.get_light(self.light_id)
+            self.last_color = None
             if self.device:
                 return True, "Connected via Blynclight Library"
             return False, "No Blynclight hardware detected."
@@ -73,15 +114,19 @@ class BlynclightController(LightController):
 
     def set_color(self, r, g, b):
         if not self.device: return False
+        if self.last_color == (r, g, b): return True
         try:
             # Ensure the device is 'on'
             self.device.on = True
             # Set the color tuple (Swapping B and G because library internal order is R, B, G)
             self.device.color = (r, b, g)
             # Force update
+            DEVICE_WRITES.inc()
             self.device.update(force=True)
+            self.last_color = (r, g, b)
             return True
         except Exception as e:
+            DEVICE_WRITE_FAILURES.inc()
             logging.error(f"Blynclight library set_color failed: {e}")
             self.disconnect()
             return False
@@ -90,6 +135,7 @@ class BlynclightController(LightController):
         if self.device:
             try:
                 self.device.on = False
+                self.last_color = None
                 return True
             except Exception:
                 self.disconnect()
@@ -99,14 +145,33 @@ class HIDFallbackController(LightController):
     """Direct HID implementation for maximum reliability."""
     VID = 0x2C0D
     
-    def __init__(self):
+    def __init__(self, path=None):
         self.device = None
         self.device_path = None
+        self.target_path = path # Specific light to open; None opens the first one found
+        self.variant = "standard"
+        self.last_frame = None # Skip writes identical to the last one
+
+    @classmethod
+    def discover(cls):
+        """Returns the HID paths of every attached light, in enumeration order."""
+        if not hid: return []
+        try:
+            DEVICE_ENUMERATIONS.inc()
+            paths = []
+            for d in hid.enumerate(cls.VID):
+                if d['path'] not in paths:
+                    paths.append(d['path'])
+            return paths
+        except Exception as e:
+            logging.debug(f"HID discovery failed: {e}")
+            return []
 
     def is_alive(self):
         if not self.device: return False
         try:
             if not hid: return False
+            DEVICE_ENUMERATIONS.inc()
             devices = hid.enumerate(self.VID)
             return any(d['path'] == self.device_path for d in devices)
         except Exception:
@@ -117,7 +182,10 @@ class HIDFallbackController(LightController):
         if not hid:
             return False, "Library 'hidapi' not installed."
         try:
+            DEVICE_ENUMERATIONS.inc()
             devices = hid.enumerate(self.VID)
+            if self.target_path is not None:
+                devices = [d for d in devices if d['path'] == self.target_path]
             if not devices:
                 return False, "No Blynclight hardware found on USB."
             
@@ -127,6 +195,9 @@ class HIDFallbackController(LightController):
             self.device.open_path(d['path'])
             self.device_path = d['path']
             self.product_name = d.get('product_string', 'Blynclight')
+            # Report layout differs between the Plus and standard models
+            self.variant = "plus" if "Plus" in (self.product_name or '') else "standard"
+            self.last_frame = None
             return True, f"Connected to {self.product_name} (Direct HID)"
         except Exception as e:
             return False, f"HID Connection Error: {str(e)}"
@@ -138,26 +209,21 @@ class HIDFallbackController(LightController):
             except: pass
             self.device = None
         self.device_path = None
+        self.last_frame = None
 
     def set_color(self, r, g, b):
         if not self.device: return False
         try:
-            # Byte 4 is Control: 0x08 = On (Speed 1), 0x00 = Off/Reset
-            # Byte 8 is Model Variant: 0x05 = Plus, 0x00 = Standard
-            
-            # We determine the variant based on the product string acquired during connect
-            is_plus = "Plus" in (getattr(self, 'product_name', '') or '')
-            
-            if is_plus:
-                # Blynclight Plus expects RBG order with 0x05 at the end
-                pattern = [0x00, r, b, g, 0x00, 0x00, 0x00, 0x00, 0x05]
-            else:
-                # Standard Blynclights usually expect RBG with 0x08 in control byte
-                pattern = [0x00, r, b, g, 0x08, 0x00, 0x00, 0x00, 0x00]
-            
-            self.device.write(pattern)
+            # Pre-built per variant and color, see state_registry.build_hid_frame
+            frame = build_hid_frame(self.variant, r, g, b)
+            if frame == self.last_frame:
+                return True
+            DEVICE_WRITES.inc()
+            self.device.write(frame)
+            self.last_frame = frame
             return True
         except Exception as e:
+            DEVICE_WRITE_FAILURES.inc()
             logging.error(f"HID write failed: {e}")
             self.disconnect()
             return False
@@ -190,95 +256,349 @@ class SimulatedController(LightController):
             self.on_color_change("off")
         return True
 
+class ManagedLight:
+    """One attached light and its own connection state."""
+    def __init__(self, light_id, controller):
+        self.light_id = light_id
+        self.controller = controller
+        self.connected = False
+        self.message = "Initializing..."
+        # Serializes writes and reconnects for this device only
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.connected, self.message = self.controller.connect()
+        return self.connected
+
+    def set_color(self, r, g, b):
+        with self.lock:
+            if self.controller.set_color(r, g, b):
+                return True
+            # Reconnecting is left to DeviceManager's background worker
+            self.connected = False
+            self.message = "Light is not accepting commands."
+            return False
+
+    def turn_off(self):
+        with self.lock:
+            return self.controller.turn_off()
+
+    def disconnect(self):
+        with self.lock:
+            self.controller.disconnect()
+            self.connected = False
+
+    def get_status(self):
+        return {
+            "id": self.light_id,
+            "code": "connected" if self.connected else "error",
+            "message": self.message
+        }
+
+class CircuitBreaker:
+    """
+    Spaces out reconnect attempts after failures: "closed" allows attempts,
+    "open" blocks them until retry_at (exponential backoff with jitter), and
+    "half_open" means a single trial attempt is in progress.
+    """
+    def __init__(self, base_delay=1, max_delay=60):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = "closed"
+        self.failures = 0
+        self.retry_at = 0
+
+    def allow_attempt(self):
+        if self.state == "open" and time.time() >= self.retry_at:
+            self.state = "half_open"
+            return True
+        return self.state == "closed"
+
+    def seconds_until_retry(self):
+        if self.state != "open":
+            return 0
+        return max(0, self.retry_at - time.time())
+
+    def record_failure(self):
+        self.failures += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+        # Jitter keeps several lights/hosts from retrying in lockstep
+        self.retry_at = time.time() + delay * random.uniform(0.5, 1.0)
+        self.state = "open"
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.retry_at = 0
+
+    def close(self):
+        """Allows attempts again but keeps the failure count, so a flapping device still backs off."""
+        self.state = "closed"
+        self.retry_at = 0
+
+    def get_status(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "next_retry": self.retry_at if self.state == "open" else None
+        }
+
 class DeviceManager:
+    # Parallel writes: one worker per light up to this many, and how long a
+    # color change waits for slow lights before moving on
+    MAX_WRITE_WORKERS = 4
+    WRITE_TIMEOUT_SECONDS = 2
+
     def __init__(self, config):
         self.config = config
-        self.controller = None
+        self.lights = []
         self.simulated_mode = False
         self.on_sim_color_change = None
+        self.on_status_change = None # Optional no-argument callback, also fired on hotplug events
+        self.write_pool = None
+        self.hotplug_monitor = None
+        self.hardware_changed = False # Set by the hotplug monitor, consumed by get_connection_status
+        self.state_registry = StateRegistry(config)
+
+        # Reconnects run on a background thread, gated by the circuit breaker
+        self.breaker = CircuitBreaker()
+        self.reconnect_thread = None
+        self._reconnect_needed = False
+        self._reconnect_event = threading.Event()
+        self._connect_lock = threading.Lock()
+        # Held while self.lights is in use (writes, status) or being replaced,
+        # so a background reconnect can't close lights mid-write
+        self._lights_lock = threading.RLock()
         
         # Internal status state
         self.connection_status = {
             "code": "searching",
             "message": "Initializing...",
-            "timestamp": time.time()
+            "timestamp": time.time(),
+            "lights": [],
+            "breaker": self.breaker.get_status()
         }
+        # Replace a stale status.shm from an earlier run before the first connect
+        if self.config:
+            self.config.claim_status(self.connection_status)
         
         self.needs_sync = False # Indicates hardware needs an initial push
-        
-        self.available_controllers = [
-            BlynclightController(), # Try library first
-            HIDFallbackController()  # Fallback to direct HID
-        ]
 
-    def connect(self):
-        """Force a full hardware re-scan and update internal status."""
-        for ctrl in self.available_controllers:
-            success, message = ctrl.connect()
-            if success:
-                self.controller = ctrl
+    def start_hotplug(self):
+        """Switches liveness checks from per-tick enumeration to attach/detach events."""
+        if self.hotplug_monitor is None:
+            poll_seconds = self.config.config.get("hotplug_poll_seconds", 2) if self.config else 2
+            self.hotplug_monitor = hotplug.create_monitor(self._on_hotplug, self._enumerate_light_ids, poll_seconds)
+
+    def stop_hotplug(self):
+        if self.hotplug_monitor:
+            self.hotplug_monitor.stop()
+            self.hotplug_monitor = None
+
+    def _enumerate_light_ids(self):
+        return [f"lib:{i}" for i in range(BlynclightController.discover())] + HIDFallbackController.discover()
+
+    def _on_hotplug(self, action):
+        # Runs on the monitor thread: flag it and wake the main loop, which reconnects
+        logging.info(f"Hotplug event: light {'attached' if action == 'add' else 'detached'}")
+        self.hardware_changed = True
+        if self.on_status_change:
+            self.on_status_change()
+
+    def discover_lights(self, prefer_hid=False):
+        """Yields the attached lights per backend: library first, then direct HID (or the reverse)."""
+        backends = [("library", self._discover_library_lights), ("hid", self._discover_hid_lights)]
+        for backend, discover in (reversed(backends) if prefer_hid else backends):
+            with tracing.span("device.discover", backend=backend):
+                lights = discover()
+            yield lights
+
+    def _discover_library_lights(self):
+        return [ManagedLight(f"lib:{i}", BlynclightController(i)) for i in range(BlynclightController.discover())]
+
+    def _discover_hid_lights(self):
+        return [ManagedLight(f"hid:{path!r}", HIDFallbackController(path)) for path in HIDFallbackController.discover()]
+
+    def connect(self, prefer_hid=False):
+        """
+        Force a full hardware re-scan and update internal status. prefer_hid
+        tries direct HID before the blynclight library (which is slower to import).
+        """
+        with self._connect_lock, self._lights_lock, tracing.span("device.connect", prefer_hid=prefer_hid):
+            DEVICE_CONNECTS.inc()
+            for light in self.lights:
+                light.disconnect()
+
+            # Use the first backend that can drive at least one light
+            connected = []
+            for candidates in self.discover_lights(prefer_hid):
+                with tracing.span("device.open", lights=len(candidates)):
+                    connected = [light for light in candidates if light.connect()]
+                if connected:
+                    break
+
+            if connected:
+                self.lights = connected
                 self.simulated_mode = False
                 self.needs_sync = True # Force sync on fresh hardware connection
-                self._update_status("connected", message)
+                self.breaker.close()
+                self._reconnect_needed = False
+                self._refresh_status()
                 return True
-        
-        # Fallback to simulation
-        self.controller = SimulatedController(on_color_change=self.on_sim_color_change)
-        self.controller.connect()
-        self.simulated_mode = True
-        self._update_status("not_detected", "No physical light found. Virtual Mode active.")
-        return True
+            
+            # Fallback to simulation
+            simulated = ManagedLight("sim", SimulatedController(on_color_change=self.on_sim_color_change))
+            simulated.connect()
+            self.lights = [simulated]
+            self.simulated_mode = True
+            LIGHTS_CONNECTED.set(0)
+            self.breaker.record_failure()
+            # Keep looking for hardware in the background (with backoff): hotplug
+            # events only fire when the device set changes, so a light that is
+            # attached but failed to open (busy, transient HID error) needs retries.
+            # Hotplug events just skip the backoff (request_reconnect(immediate=True))
+            self._reconnect_needed = True
+            self._update_status("not_detected", "No physical light found. Virtual Mode active.", [])
+            self._ensure_reconnect_thread()
+            return True
 
-    def _update_status(self, code, message):
+    def request_reconnect(self, immediate=False):
+        """Asks the background worker to rescan; immediate skips the breaker's backoff (e.g. on hotplug)."""
+        if immediate:
+            self.breaker.close()
+        self._reconnect_needed = True
+        self._ensure_reconnect_thread()
+        self._reconnect_event.set()
+
+    def _ensure_reconnect_thread(self):
+        if self.reconnect_thread is None:
+            self.reconnect_thread = threading.Thread(target=self._reconnect_loop, name="light-reconnect", daemon=True)
+            self.reconnect_thread.start()
+
+    def _reconnect_loop(self):
+        while True:
+            timeout = self.breaker.seconds_until_retry() if self._reconnect_needed else None
+            self._reconnect_event.wait(timeout)
+            self._reconnect_event.clear()
+            if not self._reconnect_needed or not self.breaker.allow_attempt():
+                continue
+            try:
+                DEVICE_RECONNECTS.inc()
+                self.connect()
+            except Exception as e:
+                logging.error(f"Background reconnect failed: {e}")
+                self.breaker.record_failure()
+                self._refresh_status()
+
+    def _refresh_status(self):
+        """Recomputes the aggregate status from the individual lights."""
+        with self._lights_lock:
+            self._refresh_status_locked()
+
+    def _refresh_status_locked(self):
+        if self.simulated_mode:
+            LIGHTS_CONNECTED.set(0)
+            self._update_status("not_detected", "No physical light found. Virtual Mode active.", [])
+            return
+        lights = [light.get_status() for light in self.lights]
+        alive = [light for light in self.lights if light.connected]
+        LIGHTS_CONNECTED.set(len(alive))
+        if not alive:
+            self._update_status("error", "All lights stopped responding.", lights)
+        elif len(self.lights) == 1:
+            self._update_status("connected", alive[0].message, lights)
+        else:
+            self._update_status("connected", f"{len(alive)} of {len(self.lights)} lights connected", lights)
+
+    def _update_status(self, code, message, lights=None):
         """Internal helper to update status only when it actually changes."""
-        if self.connection_status.get("code") != code or self.connection_status.get("message") != message:
+        lights = lights if lights is not None else self.connection_status.get("lights", [])
+        breaker = self.breaker.get_status()
+        # Breaker counters move on every failed retry; on their own they
+        # aren't a status change worth publishing or waking the loop for
+        if (self.connection_status.get("code") == code and self.connection_status.get("message") == message
+                and self.connection_status.get("lights") == lights):
+            self.connection_status = dict(self.connection_status, breaker=breaker)
+        else:
             self.connection_status = {
                 "code": code,
                 "message": message,
-                "timestamp": time.time()
+                "timestamp": time.time(),
+                "lights": lights,
+                "breaker": breaker
             }
             logging.info(f"Connection Status Change: {code} - {message}")
+            # Publish straight away so the settings process sees it without waiting for a tick
+            if self.config:
+                self.config.set("device_status", self.connection_status)
+            if self.on_status_change:
+                self.on_status_change()
 
     def get_connection_status(self):
         """Check hardware health and return the current status."""
+        # 0. With a hotplug monitor, liveness is a flag read; rescan only on attach/detach
+        if self.hotplug_monitor:
+            if self.hardware_changed:
+                self.hardware_changed = False
+                self.request_reconnect(immediate=True)
+            return self.connection_status
+
         # 1. If we are supposed to be on hardware, check if it's still alive
-        if self.controller and not self.simulated_mode:
-            if not self.controller.is_alive():
+        if self.lights and not self.simulated_mode and not self._reconnect_needed:
+            if not all(light.controller.is_alive() for light in self.lights):
                 logging.info("Hardware disconnected detected.")
-                self.connect()
-        
-        # 2. If we are in virtual mode, try to find hardware occasionally
-        elif self.simulated_mode:
-            # Poll every 2 seconds for new hardware
-            if time.time() - self.connection_status.get("timestamp", 0) > 2:
-                self.connect()
+                self.request_reconnect()
 
+        # 2. In virtual mode the background worker keeps looking for hardware
         return self.connection_status
 
     def is_connected(self):
-        return self.controller is not None and not self.simulated_mode
+        return bool(self.lights) and not self.simulated_mode
+
+    def _for_each_light(self, action):
+        """Runs action(light) on every light concurrently, so one slow light can't hold up the rest."""
+        with self._lights_lock:
+            self._for_each_light_locked(action)
+
+    def _for_each_light_locked(self, action):
+        lights = list(self.lights)
+        start = time.perf_counter()
+        if len(lights) == 1:
+            action(lights[0])
+        elif lights:
+            if self.write_pool is None:
+                self.write_pool = ThreadPoolExecutor(max_workers=self.MAX_WRITE_WORKERS, thread_name_prefix="light-write")
+            futures = [self.write_pool.submit(action, light) for light in lights]
+            done, pending = wait(futures, timeout=self.WRITE_TIMEOUT_SECONDS)
+            if pending:
+                logging.warning(f"{len(pending)} light(s) did not finish writing within {self.WRITE_TIMEOUT_SECONDS}s")
+            for future in done:
+                if future.exception():
+                    logging.error(f"Light write failed: {future.exception()}")
+        COLOR_CHANGE_SECONDS.observe(time.perf_counter() - start)
+
+        if not self.simulated_mode:
+            if all(light.connected for light in lights):
+                self.breaker.record_success()
+            else:
+                # Back off before reconnecting so a flaky hub can't cause a retry storm
+                self.breaker.record_failure()
+                self.request_reconnect()
+            self._refresh_status()
 
     def set_color(self, r, g, b):
-        if not self.controller:
+        if not self.lights:
             self.connect()
-        
-        if self.controller:
-            if not self.controller.set_color(r, g, b):
-                # If command failed, re-connect and retry once
-                if self.connect():
-                    self.controller.set_color(r, g, b)
+        self._for_each_light(lambda light: light.set_color(r, g, b))
 
     def turn_off(self):
-        if self.controller:
-            self.controller.turn_off()
+        self._for_each_light(lambda light: light.turn_off())
 
     def set_status_color(self, status):
-        status = status.lower()
-        if status in ["open", "green"]:
-            self.set_color(0, 255, 0)
-        elif status in ["focused", "red"]:
-            self.set_color(255, 0, 0)
-        elif status in ["away", "blue"]:
-            self.set_color(0, 0, 255)
-        elif status in ["off"]:
+        rgb = self.state_registry.get_rgb(status)
+        if rgb is None:
+            logging.warning(f"Unknown state '{status}', leaving the light unchanged")
+        elif rgb == (0, 0, 0):
             self.turn_off()
+        else:
+            self.set_color(*rgb)
@@ -0,0 +1,60 @@
+import heapq
+import itertools
+import threading
+
+class ExpiryScheduler:
+    """
+    Named deadlines kept in a min-heap, so the earliest one is always at
+    the top. Rescheduling or cancelling a key leaves its old entry in the
+    heap; stale entries are discarded when they surface.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        # key -> (when, sequence) of its live entry
+        self._live = {}
+        self._sequence = itertools.count()
+
+    def schedule(self, key, when):
+        """Sets (or moves) key's deadline."""
+        with self._lock:
+            entry = (when, next(self._sequence))
+            self._live[key] = entry
+            heapq.heappush(self._heap, (entry[0], entry[1], key))
+
+    def cancel(self, key):
+        with self._lock:
+            self._live.pop(key, None)
+
+    def deadline(self, key):
+        """key's pending deadline, or None."""
+        entry = self._live.get(key)
+        return entry[0] if entry else None
+
+    def _drop_stale(self):
+        while self._heap:
+            when, sequence, key = self._heap[0]
+            if self._live.get(key) == (when, sequence):
+                return
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        """The earliest pending deadline, or None when nothing is scheduled."""
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """Removes and returns [(key, deadline)] for every deadline at or before now, earliest first."""
+        due = []
+        with self._lock:
+            self._drop_stale()
+            while self._heap and self._heap[0][0] <= now:
+                when, _, key = heapq.heappop(self._heap)
+                del self._live[key]
+                due.append((key, when))
+                self._drop_stale()
+        return due
+
+    def __len__(self):
+        return len(self._live)
@@ -0,0 +1,160 @@
+import logging
+import os
+import platform
+import select
+import socket
+import threading
+
+BLYNCLIGHT_VID = 0x2C0D
+
+class NetlinkHotplugMonitor:
+    """
+    Listens for kernel uevents on a netlink socket (Linux) and reports
+    Blynclight attach/detach events. A single plug produces a burst of
+    usb/hid/hidraw events, so they are coalesced for `settle_seconds`
+    (which also gives the hidraw node time to appear) before on_change
+    is called with the last action seen ("add" or "remove").
+    """
+    NETLINK_KOBJECT_UEVENT = 15
+
+    def __init__(self, on_change, settle_seconds=0.5):
+        self.on_change = on_change
+        self.settle_seconds = settle_seconds
+        self.sock = None
+        self.thread = None
+        self._timer = None
+        self._action = None
+        self._stop_r, self._stop_w = None, None
+
+    @staticmethod
+    def is_supported():
+        return platform.system() == "Linux" and hasattr(socket, "AF_NETLINK")
+
+    @staticmethod
+    def is_blynclight_event(env):
+        product = env.get("PRODUCT", "")
+        if product.split("/")[0] == f"{BLYNCLIGHT_VID:x}":
+            return True
+        return f"{BLYNCLIGHT_VID:08X}" in env.get("HID_ID", "").upper()
+
+    @staticmethod
+    def parse_uevent(data):
+        """Returns the KEY=VALUE environment of a raw uevent message."""
+        env = {}
+        for field in data.split(b"\0")[1:]:
+            key, sep, value = field.partition(b"=")
+            if sep:
+                env[key.decode(errors="replace")] = value.decode(errors="replace")
+        return env
+
+    def start(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, self.NETLINK_KOBJECT_UEVENT)
+        try:
+            # Group 1: uevents broadcast by the kernel
+            sock.bind((0, 1))
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self._stop_r, self._stop_w = os.pipe()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self._stop_w is not None:
+            os.write(self._stop_w, b"x")
+        if self.thread:
+            self.thread.join(timeout=1)
+        if self._timer:
+            self._timer.cancel()
+        if self.sock:
+            self.sock.close()
+        for fd in (self._stop_r, self._stop_w):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.sock = self.thread = self._timer = None
+        self._stop_r = self._stop_w = None
+
+    def _run(self):
+        while True:
+            try:
+                readable, _, _ = select.select([self.sock, self._stop_r], [], [])
+                if self._stop_r in readable:
+                    return
+                data = self.sock.recv(65536)
+            except OSError as e:
+                logging.error(f"Hotplug monitor stopped: {e}")
+                return
+
+            env = self.parse_uevent(data)
+            if env.get("ACTION") in ("add", "remove") and self.is_blynclight_event(env):
+                self._action = env["ACTION"]
+                if self._timer is None:
+                    self._timer = threading.Timer(self.settle_seconds, self._fire)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def _fire(self):
+        self._timer = None
+        try:
+            self.on_change(self._action)
+        except Exception as e:
+            logging.error(f"Hotplug callback failed: {e}")
+
+class PollingHotplugMonitor:
+    """
+    Fallback for platforms without a hotplug event source: enumerates in a
+    background thread every `interval` seconds and reports when the set of
+    attached lights changes. The hot path only ever reads the cached result.
+    """
+    def __init__(self, on_change, enumerate_fn, interval=2):
+        self.on_change = on_change
+        self.enumerate_fn = enumerate_fn
+        self.interval = interval
+        self.snapshot = None
+        self.thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self.snapshot = self.enumerate_fn()
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread:
+            self.thread.join(timeout=1)
+        self.thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                current = self.enumerate_fn()
+            except Exception as e:
+                logging.debug(f"Hotplug enumeration failed: {e}")
+                continue
+            if current != self.snapshot:
+                previous, self.snapshot = self.snapshot, current
+                action = "add" if len(current) >= len(previous) else "remove"
+                try:
+                    self.on_change(action)
+                except Exception as e:
+                    logging.error(f"Hotplug callback failed: {e}")
+
+def create_monitor(on_change, enumerate_fn, poll_interval=2):
+    """Returns a started hotplug monitor: netlink uevents on Linux, else cached enumeration."""
+    if NetlinkHotplugMonitor.is_supported():
+        try:
+            monitor = NetlinkHotplugMonitor(on_change)
+            monitor.start()
+            return monitor
+        except Exception as e:
+            logging.warning(f"Netlink hotplug unavailable, falling back to polling: {e}")
+
+    monitor = PollingHotplugMonitor(on_change, enumerate_fn, poll_interval)
+    monitor.start()
+    return monitor
@@ -0,0 +1,210 @@
+import os
+import sys
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Base colors (modern SaaS palette)
+STATE_COLORS = {
+    "open": (16, 185, 129),    # Emerald
+    "focused": (239, 68, 68),  # Rose
+    "away": (59, 130, 246),    # Azure
+    "off": (148, 163, 184),    # Slate
+    "gray": (148, 163, 184)
+}
+
+# Legacy color names used as states
+STATE_ALIASES = {"green": "open", "red": "focused", "blue": "away"}
+
+# Tray icon sizes: 32px on macOS, 64px elsewhere
+ICON_SIZES = (32, 64)
+
+# Pre-baked sprite sheet written by build_exe.py: one row per state (in
+# STATE_COLORS order), one column per ICON_SIZES entry, each icon in the
+# top-left corner of a max(ICON_SIZES) square cell
+ATLAS_NAME = "icon_atlas.png"
+ATLAS_CELL = max(ICON_SIZES)
+# PNG text chunk recording the palette and sizes an atlas was baked from
+ATLAS_KEY_CHUNK = "blynclight-atlas"
+
+def glow_color(base_rgb):
+    """1.5x brighter center for the "glow"."""
+    return tuple(min(255, int(c * 1.5)) for c in base_rgb)
+
+def render_gradient_icon(base_rgb, center_rgb, size=None, canvas_size=256, margin=8):
+    """
+    Returns the radial-gradient disc as an RGBA image of size x size pixels
+    (canvas_size if size is None). Uses the vectorized NumPy renderer when
+    NumPy is installed, and the ellipse loop otherwise.
+    """
+    if np is not None:
+        return render_gradient_numpy(base_rgb, center_rgb, size, canvas_size, margin)
+    return render_gradient_ellipses(base_rgb, center_rgb, size, canvas_size, margin)
+
+@lru_cache(maxsize=8)
+def _gradient_fields(size, canvas_size, margin, supersample):
+    """
+    Color-independent coverage fields for one icon size, per output pixel:
+    disc coverage (0..255), disc coverage weighted by the gradient
+    parameter t, and border alpha. Rendering a color is then a weighted sum.
+    """
+    grid = size * supersample
+    scale = canvas_size / grid
+    max_radius = (canvas_size // 2) - margin + 0.5
+
+    # Distance of each sample's center from the disc center, in canvas units.
+    # ImageDraw fills bbox pixels inclusively, so its disc is centered on the
+    # middle of pixel canvas_size // 2 and is half a pixel wider than max_radius
+    coords = (np.arange(grid, dtype=np.float32) + 0.5) * scale - (canvas_size // 2 + 0.5)
+    dist = np.sqrt(coords[None, :] ** 2 + coords[:, None] ** 2)
+
+    # Same "stronger in middle" curve as the ellipse loop (0 at center, 1 at edge)
+    t = np.clip(dist / max_radius, 0, 1) ** 1.8
+    # Subtle translucent border for depth (replaces pixels, like ImageDraw does)
+    border = (dist <= max_radius) & (dist > max_radius - 4)
+    fill = (dist <= max_radius - 4).astype(np.float32) * 255
+
+    def box_filter(field):
+        return field.reshape(size, supersample, size, supersample).mean(axis=(1, 3))
+
+    return box_filter(fill), box_filter(fill * t), box_filter(border.astype(np.float32) * 40)
+
+def render_gradient_numpy(base_rgb, center_rgb, size=None, canvas_size=256, margin=8, supersample=4):
+    """
+    Vectorized renderer: the gradient is evaluated on a supersampled
+    distance field and box-filtered down (in premultiplied alpha, so the
+    transparent surround doesn't darken the edge). The geometry is cached
+    per size, so each color costs a few array operations.
+    """
+    from PIL import Image
+
+    fill, fill_t, border_alpha = _gradient_fields(size or canvas_size, canvas_size, margin, supersample)
+    base = np.asarray(base_rgb, dtype=np.float32)
+    center = np.asarray(center_rgb, dtype=np.float32)
+
+    # Premultiplied color: center + (base - center) * t inside the disc, black on the border
+    alpha = fill + border_alpha
+    premultiplied = fill[..., None] * center + fill_t[..., None] * (base - center)
+    rgb = premultiplied / np.maximum(alpha, 1e-6)[..., None]
+
+    pixels = np.empty(alpha.shape + (4,), dtype=np.float32)
+    pixels[..., :3] = rgb
+    pixels[..., 3] = alpha
+    return Image.fromarray(np.clip(pixels + 0.5, 0, 255).astype(np.uint8), 'RGBA')
+
+def render_gradient_ellipses(base_rgb, center_rgb, size=None, canvas_size=256, margin=8):
+    """Draws the radial-gradient disc at canvas_size and optionally downscales it to size."""
+    from PIL import Image, ImageDraw
+
+    # Create high-res canvas with transparency
+    image = Image.new('RGBA', (canvas_size, canvas_size), (0, 0, 0, 0))
+    dc = ImageDraw.Draw(image)
+
+    center_xy = canvas_size // 2
+    max_radius = (canvas_size // 2) - margin
+
+    # DRAW RADIAL GRADIENT
+    # We iterate from outer to inner to create a smooth transition
+    # working at 256px resolution ensures no visible banding
+    for r in range(max_radius, 0, -2):
+        # Calculate interpolation factor (0 at center, 1 at edge)
+        # Use quadratic curve for a "stronger in middle" appearance
+        t = (r / max_radius) ** 1.8
+
+        curr_color = tuple(
+            int(center_rgb[i] + (base_rgb[i] - center_rgb[i]) * t)
+            for i in range(3)
+        )
+
+        bbox = [center_xy - r, center_xy - r, center_xy + r, center_xy + r]
+        dc.ellipse(bbox, fill=curr_color)
+
+    # Subtle translucent border for depth
+    dc.ellipse([center_xy - max_radius, center_xy - max_radius,
+               center_xy + max_radius, center_xy + max_radius],
+               outline=(0, 0, 0, 40), width=4)
+
+    if size is None or size == canvas_size:
+        return image
+
+    # Downscale using high-quality Lanczos filter
+    # Handle different PIL versions for Resampling constant
+    resampling_filter = getattr(Image, 'Resampling', Image).LANCZOS if hasattr(Image, 'Resampling') else getattr(Image, 'ANTIALIAS', 1)
+    return image.resize((size, size), resample=resampling_filter)
+
+def icon_color(state, custom_rgb=None):
+    """Palette color for state; custom_rgb (e.g. a user-defined state's color) or gray otherwise."""
+    state = STATE_ALIASES.get(state, state)
+    if state in STATE_COLORS:
+        return STATE_COLORS[state]
+    return tuple(custom_rgb) if custom_rgb else STATE_COLORS["gray"]
+
+def render_state_icon(state, size):
+    base_rgb = icon_color(state)
+    return render_gradient_icon(base_rgb, glow_color(base_rgb), size=size)
+
+def create_atlas():
+    """Renders every state at every size into a single sprite sheet image."""
+    from PIL import Image
+    atlas = Image.new('RGBA', (ATLAS_CELL * len(ICON_SIZES), ATLAS_CELL * len(STATE_COLORS)), (0, 0, 0, 0))
+    for row, state in enumerate(STATE_COLORS):
+        for col, size in enumerate(ICON_SIZES):
+            atlas.paste(render_state_icon(state, size), (col * ATLAS_CELL, row * ATLAS_CELL))
+    return atlas
+
+def atlas_key():
+    """Identifies the palette and sizes; an atlas baked from different ones is stale."""
+    return repr((list(STATE_COLORS.items()), ICON_SIZES))
+
+def save_atlas(path):
+    """Bakes the atlas to path, tagged with atlas_key() so load_atlas can tell if it's stale."""
+    from PIL import PngImagePlugin
+    info = PngImagePlugin.PngInfo()
+    info.add_text(ATLAS_KEY_CHUNK, atlas_key())
+    create_atlas().save(path, pnginfo=info)
+
+def atlas_path():
+    """Location of the pre-baked atlas: next to the code, or inside the PyInstaller bundle."""
+    base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_path, ATLAS_NAME)
+
+@lru_cache(maxsize=1)
+def load_atlas():
+    """Returns the pre-baked atlas image, or None if it is missing or baked from another palette or layout."""
+    path = atlas_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        from PIL import Image
+        atlas = Image.open(path)
+        atlas.load()
+        if atlas.size != (ATLAS_CELL * len(ICON_SIZES), ATLAS_CELL * len(STATE_COLORS)):
+            return None
+        if getattr(atlas, "text", {}).get(ATLAS_KEY_CHUNK) != atlas_key():
+            return None
+        return atlas
+    except Exception:
+        return None
+
+@lru_cache(maxsize=32)
+def get_icon(base_rgb, size):
+    """
+    Returns the tray icon for base_rgb at size. Each (color, size) pair is
+    produced once per process: cropped from the pre-baked atlas when it
+    holds that color, rendered otherwise.
+    """
+    atlas = load_atlas()
+    palette = list(STATE_COLORS.values())
+    if atlas is not None and base_rgb in palette and size in ICON_SIZES:
+        row = palette.index(base_rgb)
+        col = ICON_SIZES.index(size)
+        x, y = col * ATLAS_CELL, row * ATLAS_CELL
+        return atlas.crop((x, y, x + size, y + size))
+    return render_gradient_icon(base_rgb, glow_color(base_rgb), size=size)
+
+def get_state_icon(state, size, custom_rgb=None):
+    """Tray icon for state; custom_rgb colors states outside the built-in palette."""
+    return get_icon(icon_color(state, custom_rgb), size)
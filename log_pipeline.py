@@ -0,0 +1,105 @@
+import atexit
+import collections
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+class DedupFilter(logging.Filter):
+    """
+    Drops repeats of a message (same logger, level and text) seen within
+    the last `window` seconds. The next copy logged after the window
+    passes through with the number of repeats that were dropped.
+    """
+    def __init__(self, window=60, max_keys=1000):
+        super().__init__()
+        self.window = window
+        self.max_keys = max_keys
+        # key -> [window start, suppressed count], least recently seen first
+        self.seen = collections.OrderedDict()
+        # Filters run on every logging thread, outside the handler lock
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.window <= 0:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                self.seen.move_to_end(key)
+                return False
+
+            suppressed = entry[1] if entry else 0
+            self.seen[key] = [now, 0]
+            self.seen.move_to_end(key)
+            while len(self.seen) > self.max_keys:
+                self.seen.popitem(last=False)
+        if suppressed:
+            record.msg = f"{record.getMessage()} (repeated {suppressed} more times in the last {self.window}s)"
+            record.args = None
+        return True
+
+class LogPipeline:
+    """
+    Queue-based logging: callers only format and enqueue a record, and a
+    background QueueListener thread writes it to a size-rotated log file
+    (and the console, when there is one).
+    """
+    def __init__(self, log_path, level="INFO", max_bytes=1024 * 1024, backup_count=3, dedup_seconds=60):
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = []
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+        # The windowed EXE has no console
+        if sys.stderr is not None:
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(formatter)
+            handlers.append(stream_handler)
+
+        self.queue = queue.SimpleQueue()
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.dedup = DedupFilter(dedup_seconds)
+        self.queue_handler.addFilter(self.dedup)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.level = None
+        self.running = False
+        self.set_level(level)
+
+    def set_level(self, level):
+        """Accepts a level name ("DEBUG", "info", ...) or number; unknown names fall back to INFO."""
+        if isinstance(level, str):
+            level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            level = logging.INFO
+        if level != self.level:
+            self.level = level
+            logging.getLogger().setLevel(level)
+
+    def start(self):
+        root = logging.getLogger()
+        # Replace whatever was configured before (e.g. basicConfig's handlers)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        self.listener.start()
+        self.running = True
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Flushes queued records and closes the handlers."""
+        if not self.running:
+            return
+        self.running = False
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        logging.getLogger().removeHandler(self.queue_handler)
@@ -1,29 +1,135 @@
+import time
+_PROCESS_START = time.perf_counter()
+
 import sys
+import json
 import logging
-import subprocess
 import socket
-from pathlib import Path
-from config_store import ConfigStore
-from device_controller import DeviceManager
-from tray_app import TrayApp
+from contextlib import contextmanager
+from config_store import ConfigStore, get_config_dir
+import command_channel
+from command_channel import LOCK_PORT
+
+# Upper bound on waiting for the desktop (taskbar) after login
+READY_TIMEOUT_SECONDS = 5
 
-# Port used to ensure only one background engine runs
-LOCK_PORT = 8988
+# --trace-dump writes here (in the config dir), replacing the previous dump
+TRACE_DUMP_NAME = "trace.json"
 
 def is_already_running():
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex(('localhost', LOCK_PORT)) == 0
 
+class StartupTrace:
+    """Per-phase startup timings, logged as one JSON line when --startup-trace is given."""
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - start) * 1000, 2)
+
+    def report(self):
+        if not self.enabled:
+            return
+        timings = dict(self.phases, total=round((time.perf_counter() - _PROCESS_START) * 1000, 2))
+        logging.info(f"Startup trace (ms): {json.dumps(timings)}")
+
+def wait_until_ready(timeout=READY_TIMEOUT_SECONDS):
+    """Waits for the desktop to be able to host the tray icon, instead of a fixed delay."""
+    import system_utils
+    deadline = time.time() + timeout
+    while not system_utils.is_desktop_ready():
+        if time.time() >= deadline:
+            logging.warning(f"Desktop not ready after {timeout}s, starting anyway")
+            return
+        time.sleep(0.1)
+
+def get_cli_command(argv):
+    """The command a launch hands to an already-running engine (open-settings by default)."""
+    if "--force" in argv:
+        index = argv.index("--force")
+        state = argv[index + 1] if index + 1 < len(argv) else ""
+        # --for MINUTES or --for next makes it a timed override
+        if "--for" in argv and argv.index("--for") + 1 < len(argv):
+            return f"force {state} {argv[argv.index('--for') + 1]}"
+        return f"force {state}"
+    if "--resume" in argv:
+        return "resume"
+    if "--status" in argv:
+        return "status"
+    if "--trace-dump" in argv:
+        return "trace-dump"
+    return "open-settings"
+
+def hand_off(command):
+    """
+    Sends command to the running engine. Returns an exit code, or None if
+    no engine is running and this process should start one. Runs before any
+    ConfigStore or log file is set up, so a launch that only forwards a
+    command leaves the engine's files alone.
+    """
+    reply = command_channel.send_command(command)
+    if reply is None:
+        if is_already_running():
+            # Holding the port but not answering: open settings ourselves
+            config_store = ConfigStore()
+            config_store.setup_logging("settings.log")
+            logging.info("Application already running. Opening settings instead...")
+            import settings_server
+            settings_server.start_settings_ui()
+            return 0
+        if command != "open-settings":
+            print("Blynclight Scheduler is not running.")
+            return 1
+        return None
+
+    if not reply.get("ok"):
+        print(f"Error: {reply.get('error')}")
+        return 1
+    if command == "status":
+        print(json.dumps(reply, indent=2))
+    elif command == "trace-dump":
+        import tracing
+        path = get_config_dir() / TRACE_DUMP_NAME
+        spans = tracing.write_trace(reply["trace"], path)
+        print(f"Wrote {spans} spans to {path}")
+    return 0
+
+def push_initial_state(config_store):
+    """Drives the light to the desired state before the tray UI (and its heavy imports) load."""
+    from device_controller import DeviceManager
+    from schedule_engine import ScheduleEngine
+
+    device_manager = DeviceManager(config_store)
+    # Plain HID first: it avoids importing the blynclight library on the critical path
+    device_manager.connect(prefer_hid=True)
+    device_manager.set_status_color(ScheduleEngine(config_store).get_desired_status())
+    return device_manager
+
 def main():
-    # Warm-up delay: Give Windows a moment to settle on boot
-    import time
+    trace = StartupTrace("--startup-trace" in sys.argv)
+    if "--trace" in sys.argv:
+        import tracing
+        tracing.enable()
+
+    # 1. Single Instance Check: hand the request to the running engine and exit
     if "--settings" not in sys.argv:
-        time.sleep(5)
+        with trace.phase("hand_off"):
+            exit_code = hand_off(get_cli_command(sys.argv))
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    # 2. Initialize Config and Logging (only processes that stay running get here)
+    with trace.phase("config"):
+        config_store = ConfigStore()
+        config_store.setup_logging("settings.log" if "--settings" in sys.argv else None)
 
-    # 1. Initialize Config and Logging
-    config_store = ConfigStore()
-    config_store.setup_logging()
-    
     # Check if we just want to open settings
     if "--settings" in sys.argv:
         logging.info("Opening Rules Dashboard...")
@@ -31,34 +137,41 @@ def main():
         settings_server.start_settings_ui()
         return
 
-    # 2. Single Instance Check
-    if is_already_running():
-        logging.info("Application already running. Opening settings instead...")
-        # Cross-instance communication: just launch a settings-only process
-        import settings_server
-        settings_server.start_settings_ui()
-        sys.exit(0)
-
     # 3. Hold the lock port
     # We keep this socket open for the duration of the process
     try:
         lock_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         lock_socket.bind(('localhost', LOCK_PORT))
-        lock_socket.listen(1)
+        lock_socket.listen(5)
     except Exception as e:
         logging.error(f"Could not bind to lock port {LOCK_PORT}: {e}")
         sys.exit(1)
 
+    # Answer hand-offs right away; commands are queued until the tray app is ready
+    command_server = command_channel.CommandServer(lock_socket)
+    command_server.start()
+
     logging.info("Blynclight Scheduler Starting...")
-    
-    # 4. Initialize Device Manager
-    device_manager = DeviceManager(config_store)
-    
-    # 5. Create and Run Tray App
-    app = TrayApp(config_store, device_manager)
-    
+
+    # 4. Light first: push the desired state as early as possible
+    with trace.phase("first_light"):
+        device_manager = push_initial_state(config_store)
+
+    # 5. Give Windows a moment to settle on boot, but only as long as it needs
+    with trace.phase("desktop_ready"):
+        wait_until_ready()
+
+    # 6. Create and Run Tray App (pystray and PIL load here)
+    with trace.phase("import_tray"):
+        from tray_app import TrayApp
+    with trace.phase("tray_setup"):
+        app = TrayApp(config_store, device_manager)
+
+    # Runs the commands queued during startup, then serves new ones directly
+    command_server.set_handler(app.handle_command)
+
     try:
-        app.run()
+        app.run(on_ready=trace.report)
     except KeyboardInterrupt:
         logging.info("Received KeyboardInterrupt, exiting...")
         app.on_exit()
@@ -66,6 +179,7 @@ def main():
         logging.critical(f"Application crashed: {e}")
         sys.exit(1)
     finally:
+        command_server.stop()
         lock_socket.close()
 
 if __name__ == "__main__":
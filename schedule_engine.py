@@ -1,8 +1,44 @@
-from datetime import datetime, time
+import copy
+import json
+import sys
+import time as _time
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from calendar_source import CalendarIndex
+import metrics
+
+SCHEDULE_EVALUATIONS = metrics.counter("blynclight_schedule_evaluations_total", "get_desired_status calls")
+SCHEDULE_COMPILES = metrics.counter("blynclight_schedule_compiles_total", "Week table rebuilds after a config change")
+SCHEDULE_COMPILE_SECONDS = metrics.histogram("blynclight_schedule_compile_seconds", "Time to compile the rules into the week table")
+
+# use weekday() -> 0: Mon, 1: Tue... 6: Sun
+DAYS_MAP = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+# Longest timed override; anything longer is a typo (or "inf"), use no duration instead
+MAX_OVERRIDE_MINUTES = 30 * MINUTES_PER_DAY
+
+# A compiled schedule. Built in full and then published with one assignment,
+# so handler threads sharing the engine never see parts of two compiles.
+#   version: the store version it was last checked against
+#   source: a copy of the (default_state, rules) it was compiled from
+#   slots: the resolved state for each minute of the week
+#   transitions: slots where the state differs from the previous minute
+#   intervals: (start_slot, end_slot, state) runs, split at the week boundary
+#   interval_starts: each interval's start_slot, for bisecting
+WeekTable = namedtuple("WeekTable", "version source slots transitions intervals interval_starts")
 
 class ScheduleEngine:
     def __init__(self, config_store):
         self.config_store = config_store
+        # Compiled week table (a WeekTable)
+        self._week_table = None
+        # NumPy form of the table for batch lookups: (WeekTable.slots, state names, per-slot codes)
+        self._table_codes = None
+        # Events from the configured .ics calendars, which take precedence over the rules
+        self.calendars = CalendarIndex()
+        self._calendars_key = None
 
     def is_time_in_range(self, start_str, end_str, check_time):
         """Checks if check_time is in [start, end) range. Supports overnight."""
@@ -18,50 +54,385 @@ class ScheduleEngine:
         except:
             return False
 
-    def get_desired_status(self, now=None):
-        if now is None:
-            now = datetime.now()
-        
-        current_time = now.time()
-        # use weekday() -> 0: Mon, 1: Tue... 6: Sun
-        days_map = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
-        current_day = days_map[now.weekday()]
-        
-        # 1. ALWAYS PRIORITIZE MANUAL OVERRIDE
-        # We reload here to ensure current state is fresh
-        self.config_store.reload()
+    def _parse_minute(self, time_str):
+        """Parses 'HH:MM' into minutes since midnight, or None if invalid."""
+        try:
+            t = datetime.strptime(time_str, "%H:%M").time()
+            return t.hour * 60 + t.minute
+        except:
+            return None
+
+    def _compile_rules(self, rules, default_state):
+        """
+        Builds a 10,080-slot table (one per minute of the week) with the state
+        that applies at that minute. Rules are painted in order, so later
+        rules overwrite earlier ones (last match wins). Overnight rules cover
+        [start, 24:00) and [00:00, end) on each of their own days.
+        """
+        table = [str(default_state).lower()] * MINUTES_PER_WEEK
+
+        for rule in rules:
+            if not rule.get("enabled", True):
+                continue
+
+            start = self._parse_minute(rule.get("start"))
+            end = self._parse_minute(rule.get("end"))
+            if start is None or end is None or "state" not in rule:
+                continue
+
+            state = str(rule["state"]).lower()
+            if start <= end:
+                spans = [(start, end)]
+            else:
+                # Spans midnight
+                spans = [(start, MINUTES_PER_DAY), (0, end)]
+
+            rule_days = [str(d).lower() for d in rule.get("days", [])]
+            for day_idx, day in enumerate(DAYS_MAP):
+                if day not in rule_days:
+                    continue
+                base = day_idx * MINUTES_PER_DAY
+                for span_start, span_end in spans:
+                    table[base + span_start:base + span_end] = [state] * (span_end - span_start)
+
+        return table
+
+    def _config_key(self):
+        # Prefer the store's version counter; fall back to the config content
+        # for stores that don't track versions
+        key = getattr(self.config_store, "version", None)
+        if key is None:
+            settings = self.config_store.config
+            key = json.dumps([settings.get("default_state", "away"), settings.get("rules", []),
+                              settings.get("calendars", [])], sort_keys=True, default=str)
+        return key
+
+    def _get_calendars(self):
+        """Returns the calendar index, or None when no calendars are configured."""
+        calendars = self.config_store.config.get("calendars") or []
+        if not calendars:
+            return None
+        key = self._config_key()
+        if key != self._calendars_key:
+            self.calendars.configure(calendars)
+            self._calendars_key = key
+        return self.calendars
+
+    def calendar_generation(self):
+        """Changes whenever the calendar files (or their config) change; for caching timelines."""
+        calendars = self._get_calendars()
+        return calendars.check_files() if calendars is not None else None
+
+    def _get_week_table(self):
+        """Returns the compiled WeekTable, rebuilding it only when the rules or default state change."""
+        compiled = self._week_table
+        version = getattr(self.config_store, "version", None)
+        if compiled is not None and version is not None and version == compiled.version:
+            return compiled
+
+        # Most writes (overrides, their expiry, device settings) leave the
+        # schedule alone; comparing is far cheaper than recompiling
+        settings = self.config_store.config
+        source = (settings.get("default_state", "away"), settings.get("rules", []))
+        if compiled is not None and source == compiled.source:
+            compiled = self._week_table = compiled._replace(version=version)
+            return compiled
+
+        default_state, rules = source
+        SCHEDULE_COMPILES.inc()
+        start = _time.perf_counter()
+        table = self._compile_rules(rules, default_state)
+        # Transitions wrap around the end of the week; used by next_transition()
+        transitions = [i for i in range(MINUTES_PER_WEEK) if table[i] != table[i - 1]]
+        bounds = sorted(set([0] + transitions)) + [MINUTES_PER_WEEK]
+        intervals = [(bounds[i], bounds[i + 1], table[bounds[i]]) for i in range(len(bounds) - 1)]
+        compiled = WeekTable(version, copy.deepcopy(source), table, transitions, intervals, bounds[:-1])
+        self._week_table = compiled
+        SCHEDULE_COMPILE_SECONDS.observe(_time.perf_counter() - start)
+        return compiled
+
+    def _override_state(self):
+        """The normalized manual_override value, ignoring its expiry."""
         override = self.config_store.config.get("manual_override")
-        
+
         # Mapping labels to internal states
         cmap = {
-            "red": "focused", 
-            "green": "open", 
+            "red": "focused",
+            "green": "open",
             "blue": "away",
             "open window": "open",
             "closed window": "focused"
         }
-        
+
         override_str = str(override).lower() if override is not None else "none"
         if override_str in cmap:
             override_str = cmap[override_str]
-            
-        if override_str not in ["none", "null"]:
-            return override_str
 
-        # 2. EVALUATE RULES
-        settings = self.config_store.config
-        rules = settings.get("rules", [])
-        default_state = settings.get("default_state", "away")
-        
-        final_state = default_state
-        
-        for rule in rules:
-            if not rule.get("enabled", True):
-                continue
-                
-            rule_days = [d.lower() for d in rule.get("days", [])]
-            if current_day.lower() in rule_days:
-                if self.is_time_in_range(rule["start"], rule["end"], current_time):
-                    final_state = rule["state"]
-                    
-        return final_state.lower()
+        if override_str in ["none", "null"]:
+            return None
+        return override_str
+
+    def get_active_override(self, now=None):
+        """
+        Returns the normalized manual override state, or None if the schedule
+        is in control (including once a timed override has expired).
+        """
+        override = self._override_state()
+        if override is None:
+            return None
+        until = self.get_override_until()
+        if until is not None and (now or datetime.now()) >= until:
+            return None
+        return override
+
+    def get_override_until(self):
+        """When the manual override expires (naive local time), or None if it holds until resumed."""
+        until = self.config_store.config.get("override_until")
+        if not until:
+            return None
+        try:
+            return datetime.fromisoformat(str(until))
+        except ValueError:
+            return None
+
+    def set_override(self, state, duration=None, now=None):
+        """
+        Sets the manual override (None resumes the schedule) together with
+        its expiry in one atomic config write. duration is None (until
+        resumed), a number of minutes, or "next" (until the schedule would
+        next change on its own). Returns the expiry time, or None.
+        """
+        if now is None:
+            now = datetime.now()
+        until = None
+        if state is not None and str(duration).lower() not in ("none", "null", ""):
+            if str(duration).lower() == "next":
+                self.config_store.reload()
+                until = self._next_change(now)
+                if until is None:
+                    # Would silently become "until resumed"; make the caller choose
+                    raise ValueError("the schedule never changes, so there is no next change to wait for")
+            else:
+                try:
+                    minutes = float(duration)
+                except TypeError:
+                    raise ValueError(f"override duration must be a number of minutes: {duration!r}")
+                if not minutes > 0:
+                    raise ValueError(f"override duration must be positive: {duration}")
+                # Also rejects inf, which timedelta would overflow on
+                if not minutes <= MAX_OVERRIDE_MINUTES:
+                    raise ValueError(f"override duration must be at most {MAX_OVERRIDE_MINUTES} minutes: {duration}")
+                until = (now + timedelta(minutes=minutes)).replace(microsecond=0)
+
+        with self.config_store.transaction():
+            self.config_store.set("manual_override", state)
+            self.config_store.set("override_until", until.isoformat() if until else None)
+        return until
+
+    def clear_expired_override(self, until):
+        """
+        Resumes the schedule if the override still expires at until (it may
+        have been replaced meanwhile). Returns True if it was cleared.
+        """
+        with self.config_store.transaction():
+            if self.get_override_until() != until:
+                return False
+            self.config_store.set("manual_override", None)
+            self.config_store.set("override_until", None)
+        return True
+
+    def get_desired_status(self, now=None):
+        if now is None:
+            now = datetime.now()
+        SCHEDULE_EVALUATIONS.inc()
+
+        # 1. ALWAYS PRIORITIZE MANUAL OVERRIDE
+        # We reload here to ensure current state is fresh
+        self.config_store.reload()
+        override = self.get_active_override(now)
+        if override is not None:
+            return override
+
+        # 2. CALENDAR EVENTS (bisect into the expanded window)
+        calendars = self._get_calendars()
+        if calendars is not None:
+            state = calendars.state_at(now)
+            if state is not None:
+                return state
+
+        # 3. EVALUATE RULES (O(1) lookup into the compiled week table)
+        table = self._get_week_table().slots
+        slot = now.weekday() * MINUTES_PER_DAY + now.hour * 60 + now.minute
+        return table[slot]
+
+    def get_desired_status_many(self, timestamps):
+        """
+        Returns get_desired_status(t) for every t in timestamps, as a list,
+        reloading the config and reading the override once for the batch.
+        A NumPy datetime64 array (naive local time, like the datetimes the
+        scalar path takes) is resolved with vectorized indexing; any other
+        iterable of datetimes goes through the same table lookup per item.
+        """
+        self.config_store.reload()
+        override = self._override_state()
+        # A timed override only covers the timestamps before it expires
+        until = self.get_override_until() if override is not None else None
+        np = sys.modules.get("numpy")
+        if np is not None and isinstance(timestamps, np.ndarray) and timestamps.dtype.kind == "M":
+            if override is not None and until is None:
+                return [override] * timestamps.size
+            states = self._lookup_numpy(np, timestamps)
+            calendars = self._get_calendars()
+            if calendars is not None and timestamps.size:
+                self._apply_calendars_numpy(np, calendars, timestamps, states)
+            if override is not None:
+                flat = timestamps.ravel().astype("datetime64[us]")
+                for i in np.flatnonzero(flat < np.datetime64(until, "us")).tolist():
+                    states[i] = override
+            return states
+
+        timestamps = list(timestamps)
+        if override is not None and until is None:
+            return [override] * len(timestamps)
+        table = self._get_week_table().slots
+        states = [table[t.weekday() * MINUTES_PER_DAY + t.hour * 60 + t.minute] for t in timestamps]
+        calendars = self._get_calendars()
+        if calendars is not None and timestamps:
+            segments = calendars.segments(min(timestamps), max(timestamps) + timedelta(microseconds=1))
+            starts = [segment[0] for segment in segments]
+            for i, t in enumerate(timestamps):
+                idx = bisect_right(starts, t) - 1
+                if idx >= 0 and t < segments[idx][1]:
+                    states[i] = segments[idx][2]
+        if override is not None:
+            states = [override if t < until else state for t, state in zip(timestamps, states)]
+        return states
+
+    def _apply_calendars_numpy(self, np, calendars, timestamps, states):
+        """Overwrites states (flat, in timestamps order) where a calendar event is in progress."""
+        flat = timestamps.ravel().astype("datetime64[us]")
+        first, last = flat.min().item(), flat.max().item()
+        segments = calendars.segments(first, last + timedelta(microseconds=1))
+        if not segments:
+            return
+        starts = np.array([segment[0] for segment in segments], dtype="datetime64[us]")
+        ends = np.array([segment[1] for segment in segments], dtype="datetime64[us]")
+        idx = np.searchsorted(starts, flat, side="right") - 1
+        inside = (idx >= 0) & (flat < ends[np.maximum(idx, 0)])
+        for i in np.flatnonzero(inside).tolist():
+            states[i] = segments[idx[i]][2]
+
+    def _lookup_numpy(self, np, timestamps):
+        if np.isnat(timestamps).any():
+            raise ValueError("timestamps contain NaT")
+        compiled = self._get_week_table()
+        cached = self._table_codes
+        if cached is None or cached[0] is not compiled.slots:
+            names, codes = np.unique(np.array(compiled.slots, dtype=object), return_inverse=True)
+            cached = self._table_codes = (compiled.slots, names, codes.astype(np.int16))
+        _, names, codes = cached
+
+        # Casting to minutes floors; 1970-01-01 (minute 0) was a Thursday
+        minutes = timestamps.ravel().astype("datetime64[m]").astype(np.int64)
+        slots = (minutes + 3 * MINUTES_PER_DAY) % MINUTES_PER_WEEK
+        return names[codes[slots]].tolist()
+
+    def next_transition(self, now=None):
+        """
+        Returns the datetime at which the desired status will next change, or
+        None if it cannot change on its own (e.g. an override without expiry
+        is active, or every minute of the week resolves to the same state).
+        """
+        if now is None:
+            now = datetime.now()
+
+        self.config_store.reload()
+        if self.get_active_override(now) is not None:
+            # Untimed overrides hold until someone resumes the schedule
+            return self.get_override_until()
+        return self._next_change(now)
+
+    def _next_change(self, now):
+        """Next change of the scheduled (rules and calendars) state after now."""
+        calendars = self._get_calendars()
+        calendar_change = calendars.next_change(now) if calendars is not None else None
+
+        transitions = self._get_week_table().transitions
+        if not transitions:
+            return calendar_change
+
+        slot = now.weekday() * MINUTES_PER_DAY + now.hour * 60 + now.minute
+        idx = bisect_right(transitions, slot)
+        if idx < len(transitions):
+            delta = transitions[idx] - slot
+        else:
+            # Wrap around to the first transition of next week
+            delta = transitions[0] + MINUTES_PER_WEEK - slot
+
+        rule_change = now.replace(second=0, microsecond=0) + timedelta(minutes=delta)
+        if calendar_change is not None and calendar_change < rule_change:
+            return calendar_change
+        return rule_change
+
+    def get_timeline(self, start, end):
+        """
+        Returns the schedule between start and end as a list of
+        (interval_start, interval_end, state) tuples covering [start, end),
+        with adjacent runs of the same state merged. Calendar events are
+        laid over the rules; manual overrides are not applied.
+        """
+        self.config_store.reload()
+        compiled = self._get_week_table()
+        intervals = compiled.intervals
+
+        week_start = datetime.combine((start - timedelta(days=start.weekday())).date(), time())
+        slot = int((start - week_start).total_seconds() // 60)
+        idx = bisect_right(compiled.interval_starts, slot) - 1
+
+        timeline = []
+        cursor = start
+        while cursor < end:
+            _, end_slot, state = intervals[idx]
+            segment_end = min(end, week_start + timedelta(minutes=end_slot))
+            if timeline and timeline[-1][2] == state:
+                timeline[-1] = (timeline[-1][0], segment_end, state)
+            else:
+                timeline.append((cursor, segment_end, state))
+            cursor = segment_end
+
+            idx += 1
+            if idx == len(intervals):
+                idx = 0
+                week_start += timedelta(days=7)
+
+        calendars = self._get_calendars()
+        if calendars is not None:
+            timeline = self._overlay(timeline, calendars.segments(start, end))
+        return timeline
+
+    def _overlay(self, timeline, segments):
+        """Lays disjoint, sorted (start, end, state) segments over a timeline."""
+        result = []
+
+        def add(piece_start, piece_end, state):
+            if piece_start >= piece_end:
+                return
+            if result and result[-1][2] == state and result[-1][1] == piece_start:
+                result[-1] = (result[-1][0], piece_end, state)
+            else:
+                result.append((piece_start, piece_end, state))
+
+        i = 0
+        for piece_start, piece_end, state in timeline:
+            cursor = piece_start
+            while i < len(segments) and segments[i][0] < piece_end:
+                segment_start, segment_end, segment_state = segments[i]
+                add(cursor, segment_start, state)
+                add(max(segment_start, cursor), min(segment_end, piece_end), segment_state)
+                cursor = max(cursor, min(segment_end, piece_end))
+                if segment_end > piece_end:
+                    # Continues into the next piece
+                    break
+                i += 1
+            add(cursor, piece_end, state)
+        return result
@@ -1,87 +1,380 @@
+import functools
 import http.server
 import socketserver
 import json
 import os
+import select
+import socket
 import sys
+import threading
+import time
 import webbrowser
-from pathlib import Path
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
 from config_store import ConfigStore
+import command_channel
+import metrics
 import system_utils
+import tracing
 
 PORT = 8989
-config_store = ConfigStore()
+# The store the dashboard reads and writes: the engine's own when hosted
+# in-process, otherwise a private one created on first use
+config_store = None
+# True when config_store is one passed in by the engine (hosted in-process)
+serving_engine_store = False
+
+# /events streams re-check device status (and, without a config watcher,
+# config.json) at this interval; config changes wake them immediately
+EVENTS_POLL_SECONDS = 1
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# Concurrent connections served at once (each keep-alive client holds one);
+# a connection that can't get a slot within SATURATED_WAIT_SECONDS gets a 503.
+# /events streams live as long as the tab, so they have their own, separate cap
+MAX_WORKERS = 32
+MAX_EVENT_STREAMS = 8
+SATURATED_WAIT_SECONDS = 2
+# Idle keep-alive connections are closed after this many seconds
+IDLE_TIMEOUT_SECONDS = 10
+
+HTTP_REQUESTS = metrics.counter(metrics.HTTP_PREFIX + "requests_total", "Dashboard HTTP requests", ("method", "path"))
+HTTP_REQUEST_SECONDS = metrics.histogram(metrics.HTTP_PREFIX + "request_seconds", "Dashboard request latency (excluding /events streams)", ("path",))
+# Paths reported individually; everything else (static files) is "other"
+METRIC_PATHS = ("/", "/config", "/timeline", "/metrics", "/trace", "/save", "/force", "/_health")
+
+class EventHub:
+    """Wakes /events streams when something they report may have changed."""
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.generation = 0
+
+    def notify(self):
+        with self.cond:
+            self.generation += 1
+            self.cond.notify_all()
+
+    def wait(self, generation, timeout):
+        """Blocks until notify() is called after `generation`, or timeout. Returns the new generation."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.generation != generation, timeout)
+            return self.generation
+
+event_hub = EventHub()
+
+# Serialized /config body, keyed by (config version, device status sequence).
+# The boot token keeps ETags from colliding across server restarts, since
+# both counters start over in a new process.
+_config_cache = (None, None, None)
+_boot_token = f"{int(time.time() * 1000):x}"
+
+def use_config_store(store=None):
+    """Serves store (e.g. the running engine's) instead of a private ConfigStore."""
+    global config_store, settings_server_engine, _config_cache, serving_engine_store
+    if store is None:
+        store = config_store or ConfigStore()
+    elif store is not config_store:
+        serving_engine_store = True
+    if store is config_store:
+        return store
+    if config_store is not None and event_hub.notify in config_store.listeners:
+        config_store.listeners.remove(event_hub.notify)
+    config_store = store
+    config_store.add_listener(event_hub.notify)
+    settings_server_engine = None
+    _config_cache = (None, None, None)
+    with _timeline_cache_lock:
+        _timeline_cache.clear()
+    return store
+
+def render_metrics():
+    """
+    Prometheus text for /metrics. In-process, one registry holds everything;
+    a standalone dashboard asks the engine for its metrics over the command
+    channel (which leaves out request metrics) and adds its own.
+    """
+    if serving_engine_store:
+        return metrics.REGISTRY.render()
+    reply = command_channel.send_command("metrics", timeout=1)
+    engine_text = reply.get("text", "") if reply and reply.get("ok") else ""
+    return engine_text + metrics.REGISTRY.render(prefix=metrics.HTTP_PREFIX)
+
+def get_trace_body():
+    """
+    Chrome trace JSON for /trace: this process's spans when hosted in the
+    engine, otherwise the engine's, fetched over the command channel. None if tracing is off.
+    """
+    if serving_engine_store:
+        return json.dumps(tracing.TRACER.export()).encode() if tracing.is_enabled() else None
+    reply = command_channel.send_command("trace-dump", timeout=5)
+    if not reply or not reply.get("ok"):
+        return None
+    return json.dumps(reply["trace"]).encode()
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match uses weak comparison: a W/ prefix on either tag doesn't matter."""
+    if if_none_match.strip() == "*":
+        return True
+    strip_weak = lambda tag: tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()
+    return strip_weak(etag) in [strip_weak(tag) for tag in if_none_match.split(",")]
+
+def get_config_body():
+    """Returns (etag, body) for /config, re-serializing only when something changed."""
+    global _config_cache
+    config_store.reload()
+    key = (config_store.version, config_store.status_sequence)
+    cached_key, etag, body = _config_cache
+    if key != cached_key:
+        full_data = config_store.config.copy()
+        # Include the granular device status object
+        full_data["device_status_obj"] = config_store.get("device_status")
+        full_data["config_version"] = config_store.version
+        body = json.dumps(full_data).encode()
+        etag = f'"{_boot_token}-{key[0]}-{key[1]}"'
+        _config_cache = (key, etag, body)
+    return etag, body
+
+# /timeline serves at most this many days per request; responses are
+# cached per config version and calendar file generation (the schedule
+# can't change without one of them changing)
+TIMELINE_MAX_DAYS = 31
+TIMELINE_CACHE_SIZE = 16
+_timeline_cache = {}
+# Handler threads share the cache; bodies are computed outside the lock
+_timeline_cache_lock = threading.Lock()
+
+def parse_timeline_range(query):
+    """
+    Returns (start, end) from the ?from=&to= ISO local times, defaulting to
+    the current week (Monday 00:00 for 7 days). Raises ValueError if invalid.
+    """
+    params = parse_qs(query)
+    if "from" in params:
+        start = datetime.fromisoformat(params["from"][0])
+    else:
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = today - timedelta(days=today.weekday())
+    end = datetime.fromisoformat(params["to"][0]) if "to" in params else start + timedelta(days=7)
+    if start.tzinfo or end.tzinfo:
+        raise ValueError("from/to are local times without a UTC offset")
+    if not start < end <= start + timedelta(days=TIMELINE_MAX_DAYS):
+        raise ValueError(f"'to' must be after 'from' and at most {TIMELINE_MAX_DAYS} days later")
+    return start, end
+
+def get_timeline_body(start, end):
+    """Serialized schedule intervals for [start, end), computed once per config version."""
+    config_store.reload()
+    calendar_generation = get_engine().calendar_generation()
+    key = ((config_store.version, calendar_generation), start, end)
+    with _timeline_cache_lock:
+        body = _timeline_cache.get(key)
+    if body is None:
+        timeline = get_engine().get_timeline(start, end)
+        body = json.dumps({
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "version": config_store.version,
+            "calendar_generation": calendar_generation,
+            "intervals": [{"start": a.isoformat(), "end": b.isoformat(), "state": state} for a, b, state in timeline]
+        }).encode()
+        with _timeline_cache_lock:
+            # Entries for older versions are dead; drop everything when full
+            if len(_timeline_cache) >= TIMELINE_CACHE_SIZE or any(k[0] != key[0] for k in _timeline_cache):
+                _timeline_cache.clear()
+            _timeline_cache[key] = body
+    return body
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
     try:
         base_path = sys._MEIPASS
     except Exception:
-        base_path = os.path.abspath(".")
+        base_path = os.path.dirname(os.path.abspath(__file__))
 
     return os.path.join(base_path, relative_path)
 
+def get_engine():
+    global settings_server_engine
+    if settings_server_engine is None:
+        import schedule_engine
+        settings_server_engine = schedule_engine.ScheduleEngine(config_store)
+    return settings_server_engine
+
+def get_live_status():
+    """The subset of state the dashboard shows live: override, computed state and device status."""
+    config_store.reload()
+    return {
+        "manual_override": config_store.config.get("manual_override"),
+        "override_until": config_store.config.get("override_until"),
+        "state": get_engine().get_desired_status(),
+        "device_status_obj": config_store.get("device_status"),
+        # Lets the dashboard refetch /timeline when the schedule changes
+        "config_version": config_store.version,
+        "calendar_generation": get_engine().calendar_generation()
+    }
+
 class SettingsHandler(http.server.SimpleHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests, so every response
+    # must carry a Content-Length (or close the connection)
+    protocol_version = "HTTP/1.1"
+    timeout = IDLE_TIMEOUT_SECONDS
+
     def log_message(self, format, *args): return
 
+    def send_body(self, body, content_type="application/json", headers=None):
+        self.send_response(200)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_GET(self):
+        self.handle_timed(self.handle_get)
+
+    def do_POST(self):
+        self.handle_timed(self.handle_post)
+
+    def handle_timed(self, handler):
+        path = urlsplit(self.path).path
+        label = path if path in METRIC_PATHS or path == "/events" else "other"
+        HTTP_REQUESTS.labels(self.command, label).inc()
+        if label == "/events":
+            # Streams last as long as the tab is open; their duration isn't latency
+            return handler()
+        with HTTP_REQUEST_SECONDS.time(label), tracing.span(f"http {self.command} {label}"):
+            handler()
+
+    def handle_get(self):
         # Redirect root to our UI file
         if self.path == "/":
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.send_header("Cache-Control", "no-store, no-cache, must-revalidate, max-age=0")
-            self.end_headers()
             ui_path = resource_path(os.path.join("web_ui", "index.html"))
             with open(ui_path, 'rb') as f:
-                self.wfile.write(f.read())
+                self.send_body(f.read(), "text/html", {"Cache-Control": "no-store, no-cache, must-revalidate, max-age=0"})
             return
             
         if self.path == "/config":
-            config_store.reload()
-            full_data = config_store.config.copy()
-            # Include the granular device status object
-            full_data["device_status_obj"] = config_store.get("device_status")
-            
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.send_header("Cache-Control", "no-store")
-            self.end_headers()
-            self.wfile.write(json.dumps(full_data).encode())
+            etag, body = get_config_body()
+            # no-cache (not no-store) lets clients revalidate with If-None-Match
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if etag_matches(self.headers.get("If-None-Match", ""), etag):
+                self.send_response(304)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                return
+            self.send_body(body, headers=headers)
+        elif self.path == "/events":
+            self.stream_events()
+        elif self.path == "/trace":
+            body = get_trace_body()
+            if body is None:
+                self.send_error(404, "Tracing is off (start with --trace or BLYNCLIGHT_TRACE=1)")
+                return
+            self.send_body(body, headers={"Cache-Control": "no-store", "Content-Disposition": 'attachment; filename="blynclight-trace.json"'})
+        elif self.path == "/metrics":
+            self.send_body(render_metrics().encode(), "text/plain; version=0.0.4; charset=utf-8", {"Cache-Control": "no-store"})
+        elif urlsplit(self.path).path == "/timeline":
+            try:
+                start, end = parse_timeline_range(urlsplit(self.path).query)
+            except (ValueError, TypeError) as e:
+                self.send_error(400, str(e))
+                return
+            self.send_body(get_timeline_body(start, end), headers={"Cache-Control": "no-cache"})
         else:
             return super().do_GET()
 
-    def do_POST(self):
+    def stream_events(self):
+        """Server-Sent Events: pushes get_live_status() whenever it changes."""
+        # The stream has no length, so it ends the connection when it ends
+        self.close_connection = True
+        # Streams count against their own cap, not the request workers
+        if not self.server.start_stream():
+            self.send_error(503, "Too many open dashboards")
+            return
+        try:
+            self._stream_events()
+        finally:
+            self.server.end_stream()
+
+    def _stream_events(self):
+        self.send_response(200)
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        last_sent = None
+        last_write = time.time()
+        generation = event_hub.generation
+        try:
+            while True:
+                live = get_live_status()
+                if live != last_sent:
+                    self.wfile.write(f"data: {json.dumps(live)}\n\n".encode())
+                    self.wfile.flush()
+                    last_sent = live
+                    last_write = time.time()
+                elif time.time() - last_write > EVENTS_KEEPALIVE_SECONDS:
+                    # Comment line: keeps proxies happy and detects closed tabs
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                    last_write = time.time()
+                generation = event_hub.wait(generation, EVENTS_POLL_SECONDS)
+                if self.client_closed():
+                    return
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError, socket.timeout):
+            # Dashboard tab closed
+            return
+
+    def client_closed(self):
+        """True once the client has hung up (the socket reads EOF)."""
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return self.connection.recv(1, socket.MSG_PEEK) == b""
+        except (BlockingIOError, socket.timeout):
+            return False
+        except OSError:
+            return True
+
+    def handle_post(self):
         length = int(self.headers['Content-Length'])
         data = json.loads(self.rfile.read(length).decode())
 
         if self.path == "/save":
-            # 1. Reload existing config to get current manual_override and start_on_login
-            config_store.reload()
-            current_override = config_store.config.get("manual_override")
-            current_autostart = config_store.config.get("start_on_login", False)
-            
-            # 2. Update with new dashboard settings
-            new_autostart = data.get("start_on_login", False)
-            config_store.config["default_state"] = data.get("default_state", "away")
-            config_store.config["rules"] = data.get("rules", [])
-            config_store.config["start_on_login"] = new_autostart
-            
-            # 3. Explicitly preserve the override state (don't let dashboard wipe it)
-            config_store.config["manual_override"] = current_override
-            config_store.save_config()
+            # All dashboard changes land in one atomic write
+            with config_store.transaction():
+                # 1. Transaction start reloads, so manual_override and start_on_login are current
+                current_autostart = config_store.config.get("start_on_login", False)
+                
+                # 2. Update with new dashboard settings
+                # (manual_override is deliberately untouched so the dashboard can't wipe it)
+                new_autostart = data.get("start_on_login", False)
+                config_store.set("default_state", data.get("default_state", "away"))
+                config_store.set("rules", data.get("rules", []))
+                config_store.set("start_on_login", new_autostart)
 
-            # 4. Update system autostart if changed
+            # 3. Update system autostart if changed
             if new_autostart != current_autostart:
                 system_utils.set_autostart(new_autostart)
             
         elif self.path == "/force":
-            state = data.get("state")
-            config_store.reload()
-            config_store.set("manual_override", state)
+            # {"state": ..., "duration": null | minutes | "next"}; state null resumes
+            try:
+                until = get_engine().set_override(data.get("state"), data.get("duration"))
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            self.send_body(json.dumps({"status": "ok", "override_until": until.isoformat() if until else None}).encode())
+            return
 
         elif self.path == "/_health": # Changed from /health to /_health
             # Diagnostic endpoint to see what the Python engine thinks
             import datetime
-            engine = settings_server_engine # using a global assigned in start_settings_ui
+            engine = get_engine()
             now = datetime.datetime.now()
             status = engine.get_desired_status(now)
             health = {
@@ -91,51 +384,119 @@ class SettingsHandler(http.server.SimpleHTTPRequestHandler):
                 "manual_override": config_store.config.get("manual_override"),
                 "rules_count": len(config_store.config.get("rules", []))
             }
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(health).encode())
+            self.send_body(json.dumps(health).encode())
             return
 
-        self.send_response(200)
-        self.send_header("Content-type", "application/json")
-        self.end_headers()
-        self.wfile.write(b'{"status":"ok"}')
+        self.send_body(b'{"status":"ok"}')
+
+class SettingsServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Thread-per-connection server with a bounded number of concurrent connections."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, max_workers=None, max_streams=None):
+        self.slots = threading.BoundedSemaphore(max_workers or MAX_WORKERS)
+        self.stream_slots = threading.BoundedSemaphore(max_streams or MAX_EVENT_STREAMS)
+        # Open /events streams
+        self.streams = 0
+        self._streams_lock = threading.Lock()
+        # Whether the current connection thread holds one of `slots`
+        self._local = threading.local()
+        super().__init__(server_address, handler_class)
+
+    def process_request_thread(self, request, client_address):
+        # Waits on the connection's own thread, so accept() never stalls
+        if not self.slots.acquire(timeout=SATURATED_WAIT_SECONDS):
+            # Saturated: answer instead of queueing indefinitely
+            try:
+                # Drain the request first so closing doesn't reset the connection
+                request.settimeout(0.5)
+                request.recv(65536)
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self._local.holds_slot = True
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._release_slot()
+
+    def _release_slot(self):
+        if getattr(self._local, "holds_slot", False):
+            self._local.holds_slot = False
+            self.slots.release()
+
+    def start_stream(self):
+        """Moves the current connection from a worker slot to a stream slot; False if none is free."""
+        if not self.stream_slots.acquire(blocking=False):
+            return False
+        self._release_slot()
+        with self._streams_lock:
+            self.streams += 1
+        return True
+
+    def end_stream(self):
+        with self._streams_lock:
+            self.streams -= 1
+        self.stream_slots.release()
 
 def is_server_running():
-    import socket
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex(('localhost', PORT)) == 0
 
-def run_server():
-    os.chdir(Path(__file__).parent)
+# Seconds start_server waits for the listening socket before giving up
+READY_TIMEOUT_SECONDS = 5
+
+def run_server(ready=None):
+    """Serves the dashboard until shutdown; sets the `ready` event once the port is bound (or binding failed)."""
+    global httpd
+    # Static files come from web_ui only; the process's cwd is left alone
+    handler = functools.partial(SettingsHandler, directory=resource_path("web_ui"))
     try:
-        socketserver.TCPServer.allow_reuse_address = True
-        with socketserver.TCPServer(("", PORT), SettingsHandler) as httpd:
+        with SettingsServer(("", PORT), handler) as server:
+            httpd = server
             print(f"Rules Dashboard started at http://localhost:{PORT}")
-            httpd.serve_forever()
+            if ready:
+                ready.set()
+            server.serve_forever()
     except OSError:
         # Port might be busy or already running
         pass
+    finally:
+        httpd = None
+        if ready:
+            ready.set()
 
-# Global for health checks
+# Globals for health checks and the running server
 settings_server_engine = None
+httpd = None
 
-def start_settings_ui():
-    global settings_server_engine
-    import schedule_engine
-    settings_server_engine = schedule_engine.ScheduleEngine(config_store)
-    
+def start_server(store=None):
+    """
+    Starts the dashboard server in a background thread (unless one is
+    already listening) and returns its URL once it accepts connections.
+    Pass the engine's ConfigStore to serve its live state in-process.
+    """
+    use_config_store(store)
+    get_engine()
     url = f"http://localhost:{PORT}"
-    
+    if httpd is None and not is_server_running():
+        ready = threading.Event()
+        threading.Thread(target=run_server, args=(ready,), daemon=True).start()
+        if not ready.wait(READY_TIMEOUT_SECONDS):
+            import logging
+            logging.warning(f"Settings server not ready after {READY_TIMEOUT_SECONDS}s")
+    return url
+
+def stop_server():
+    if httpd is not None:
+        httpd.shutdown()
+
+def start_settings_ui():
     # 1. Start Server in background
-    if not is_server_running():
-        import threading
-        t = threading.Thread(target=run_server, daemon=True)
-        t.start()
-        # Wait a moment for server to bind
-        import time
-        time.sleep(1)
+    url = start_server()
 
     # 2. Try to open as a standalone Desktop Window
     try:
@@ -0,0 +1,89 @@
+import logging
+from functools import lru_cache
+
+# Light colors for the built-in states (and their legacy color aliases).
+# "off" is black, which the controllers treat as turning the light off.
+BUILTIN_STATES = {
+    "open": (0, 255, 0),
+    "green": (0, 255, 0),
+    "focused": (255, 0, 0),
+    "red": (255, 0, 0),
+    "away": (0, 0, 255),
+    "blue": (0, 0, 255),
+    "off": (0, 0, 0),
+}
+
+HID_VARIANTS = ("standard", "plus")
+
+@lru_cache(maxsize=256)
+def build_hid_frame(variant, r, g, b):
+    """Returns the HID output report that sets a light of the given variant to (r, g, b)."""
+    # Byte 4 is Control: 0x08 = On (Speed 1), 0x00 = Off/Reset
+    # Byte 8 is Model Variant: 0x05 = Plus, 0x00 = Standard
+    if variant == "plus":
+        # Blynclight Plus expects RBG order with 0x05 at the end
+        return bytes([0x00, r, b, g, 0x00, 0x00, 0x00, 0x00, 0x05])
+    # Standard Blynclights usually expect RBG with 0x08 in control byte
+    return bytes([0x00, r, b, g, 0x08, 0x00, 0x00, 0x00, 0x00])
+
+def parse_rgb(value):
+    """Accepts '#RRGGBB' or [r, g, b]; returns an (r, g, b) tuple or None."""
+    try:
+        if isinstance(value, str):
+            value = value.lstrip("#")
+            if len(value) != 6:
+                return None
+            rgb = tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+        else:
+            rgb = tuple(int(c) for c in value)
+        if len(rgb) == 3 and all(0 <= c <= 255 for c in rgb):
+            return rgb
+    except (TypeError, ValueError):
+        pass
+    return None
+
+class StateRegistry:
+    """
+    Maps state names to light colors: the built-in states plus any
+    user-defined ones from the "custom_states" config key, e.g.
+
+        "custom_states": {"lunch": "#FFA500", "on-air": [255, 0, 128]}
+
+    HID frames for every state are pre-built for each device variant
+    whenever the config changes.
+    """
+    def __init__(self, config_store=None):
+        self.config_store = config_store
+        self.states = dict(BUILTIN_STATES)
+        self._key = None
+
+    def _refresh(self):
+        if self.config_store is None:
+            return
+        key = getattr(self.config_store, "version", None)
+        if key is not None and key == self._key:
+            return
+        self._key = key
+
+        states = dict(BUILTIN_STATES)
+        for name, value in (self.config_store.config.get("custom_states") or {}).items():
+            rgb = parse_rgb(value)
+            if rgb is None:
+                logging.warning(f"Ignoring custom state '{name}': invalid color {value!r}")
+                continue
+            states[str(name).lower()] = rgb
+
+        # Warm the frame cache so the hot path never builds a report
+        for rgb in set(states.values()):
+            for variant in HID_VARIANTS:
+                build_hid_frame(variant, *rgb)
+        self.states = states
+
+    def get_rgb(self, state):
+        """Returns the (r, g, b) color for state, or None for an unknown state."""
+        self._refresh()
+        return self.states.get(str(state).lower())
+
+    def names(self):
+        self._refresh()
+        return list(self.states)
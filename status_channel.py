@@ -0,0 +1,100 @@
+import json
+import logging
+import mmap
+import os
+import struct
+
+class StatusChannel:
+    """
+    Fixed-size, memory-mapped record used to publish the runtime status
+    from the engine process to the settings process.
+
+    Layout (little endian):
+        0   4s  magic "BLYS"
+        4   I   layout version
+        8   Q   sequence counter (odd while a write is in progress)
+        16  I   payload length
+        20  ..  UTF-8 JSON payload (at most PAYLOAD_SIZE bytes)
+
+    Readers use the sequence counter as a seqlock: a snapshot is only
+    accepted when the counter is even and unchanged across the read. The
+    decoded payload is cached per sequence number, so reads of an unchanged
+    record are a single header load.
+    """
+    MAGIC = b"BLYS"
+    LAYOUT_VERSION = 1
+    HEADER = struct.Struct("<4sIQI")
+    SIZE = 4096
+    PAYLOAD_SIZE = SIZE - HEADER.size
+
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < self.SIZE:
+                os.ftruncate(fd, self.SIZE)
+            self.mm = mmap.mmap(fd, self.SIZE)
+        finally:
+            os.close(fd)
+        self.buffer = memoryview(self.mm)
+        self._cached_seq = None
+        self._cached_value = None
+
+    def close(self):
+        self.buffer.release()
+        self.mm.close()
+
+    @property
+    def sequence(self):
+        magic, layout, seq, _ = self.HEADER.unpack_from(self.buffer, 0)
+        if magic != self.MAGIC or layout != self.LAYOUT_VERSION:
+            return 0
+        return seq
+
+    def write(self, value):
+        payload = json.dumps(value).encode("utf-8")
+        if len(payload) > self.PAYLOAD_SIZE:
+            raise ValueError(f"Status payload too large ({len(payload)} bytes)")
+
+        seq = self.sequence
+        if seq % 2:
+            # A previous writer died mid-update; move back to an even value
+            seq += 1
+        self.HEADER.pack_into(self.buffer, 0, self.MAGIC, self.LAYOUT_VERSION, seq + 1, 0)
+        self.buffer[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+        self.HEADER.pack_into(self.buffer, 0, self.MAGIC, self.LAYOUT_VERSION, seq + 2, len(payload))
+        self._cached_seq = seq + 2
+        self._cached_value = value
+
+    def read(self, retries=100):
+        """Returns the last published value, or None if nothing was published yet."""
+        for _ in range(retries):
+            magic, layout, seq, length = self.HEADER.unpack_from(self.buffer, 0)
+            if magic != self.MAGIC or layout != self.LAYOUT_VERSION or seq == 0:
+                return None
+            if seq == self._cached_seq:
+                return self._cached_value
+            if seq % 2:
+                continue # Writer in progress
+
+            payload = bytes(self.buffer[self.HEADER.size:self.HEADER.size + min(length, self.PAYLOAD_SIZE)])
+            if self.HEADER.unpack_from(self.buffer, 0)[2] != seq:
+                continue # Torn read, try again
+            try:
+                value = json.loads(payload)
+            except ValueError:
+                continue
+            self._cached_seq = seq
+            self._cached_value = value
+            return value
+
+        logging.debug("Status channel busy, no consistent snapshot")
+        return self._cached_value
+
+def open_channel(path):
+    """Returns a StatusChannel for path, or None if shared memory is unavailable."""
+    try:
+        return StatusChannel(path)
+    except Exception as e:
+        logging.warning(f"Status channel unavailable, using status file: {e}")
+        return None
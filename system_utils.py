@@ -15,6 +15,19 @@ def set_autostart(enabled=True):
     else:
         logging.warning("Autostart not supported on this platform.")
 
+def is_desktop_ready():
+    """
+    True once the desktop can host a tray icon. On Windows this waits for
+    Explorer's taskbar window, which may not exist yet right after login.
+    """
+    if platform.system() == "Windows":
+        try:
+            import ctypes
+            return bool(ctypes.windll.user32.FindWindowW("Shell_TrayWnd", None))
+        except Exception:
+            return True
+    return True
+
 def _set_windows_autostart(enabled):
     import winreg
     key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
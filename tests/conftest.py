@@ -0,0 +1,22 @@
+import pytest
+from config_store import ConfigStore
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def make_store(home):
+    """Builds ConfigStores in the temporary home; their watcher threads and fds are released on teardown."""
+    stores = []
+
+    def make():
+        store = ConfigStore()
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.stop_watching()
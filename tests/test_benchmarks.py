@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import run_benchmarks
+
+def test_compare_flags_only_real_slowdowns():
+    baseline = {"fast": 0.2, "slow": 100.0, "steady": 50.0}
+    results = {"fast": 0.5, "slow": 180.0, "steady": 55.0, "new": 10.0}
+    # "fast" is 2.5x slower but only by 0.3us: noise
+    assert run_benchmarks.compare(results, baseline) == {"slow": 1.8}
+
+def test_generated_rules_are_deterministic():
+    assert run_benchmarks.make_rules(50) == run_benchmarks.make_rules(50)
+    assert len(run_benchmarks.make_rules(50)) == 50
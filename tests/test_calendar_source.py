@@ -0,0 +1,200 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+from calendar_source import CalendarIndex, flatten, parse_ics, to_local
+from schedule_engine import ScheduleEngine
+
+class MockConfig:
+    def __init__(self, config):
+        self.config = config
+    def get(self, key, default=None):
+        return self.config.get(key, default)
+    def reload(self):
+        pass
+
+def ics(*events):
+    body = "\r\n".join(f"BEGIN:VEVENT\r\n{event.strip()}\r\nEND:VEVENT" for event in events)
+    return f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n{body}\r\nEND:VCALENDAR\r\n"
+
+def starts(event, start, end):
+    return [s for s, _ in event.occurrences(start, end)]
+
+def test_weekly_rule_with_exdate_and_folded_lines():
+    [event] = parse_ics(ics("""
+UID:standup
+SUMMARY:Stand
+ up
+DTSTART:20260202T093000
+DTEND:20260202T094500
+RRULE:FREQ=WEEKLY;BYDAY=MO,WE
+EXDATE:20260204T093000
+"""))
+    assert event.summary == "Standup"
+    assert starts(event, datetime(2026, 2, 1), datetime(2026, 2, 12)) == [
+        datetime(2026, 2, 2, 9, 30), datetime(2026, 2, 9, 9, 30), datetime(2026, 2, 11, 9, 30)]
+
+def test_count_until_and_interval():
+    count, until, every_other = parse_ics(ics(
+        "UID:a\nDTSTART:20260101T100000\nDURATION:PT30M\nRRULE:FREQ=DAILY;COUNT=3",
+        "UID:b\nDTSTART:20260101T100000\nDURATION:PT30M\nRRULE:FREQ=DAILY;UNTIL=20260102",
+        "UID:c\nDTSTART:20260101T100000\nDURATION:PT30M\nRRULE:FREQ=DAILY;INTERVAL=2"))
+    window = (datetime(2026, 1, 1), datetime(2026, 1, 8))
+    assert [s.day for s in starts(count, *window)] == [1, 2, 3]
+    assert [s.day for s in starts(until, *window)] == [1, 2]
+    assert [s.day for s in starts(every_other, *window)] == [1, 3, 5, 7]
+    # Without COUNT the expansion jumps straight to the window
+    assert starts(every_other, datetime(2030, 1, 1), datetime(2030, 1, 3)) == [datetime(2030, 1, 2, 10)]
+
+def test_monthly_rules():
+    last_friday, fifteenth, thirty_first = parse_ics(ics(
+        "UID:a\nDTSTART:20260130T150000\nDURATION:PT1H\nRRULE:FREQ=MONTHLY;BYDAY=-1FR",
+        "UID:b\nDTSTART:20260115T150000\nDURATION:PT1H\nRRULE:FREQ=MONTHLY;BYMONTHDAY=15,-1",
+        "UID:c\nDTSTART:20260131T150000\nDURATION:PT1H\nRRULE:FREQ=MONTHLY"))
+    window = (datetime(2026, 1, 1), datetime(2026, 5, 1))
+    assert [s.date().isoformat() for s in starts(last_friday, *window)] == [
+        "2026-01-30", "2026-02-27", "2026-03-27", "2026-04-24"]
+    assert [s.day for s in starts(fifteenth, datetime(2026, 2, 1), datetime(2026, 3, 1))] == [15, 28]
+    # Months without a 31st are skipped
+    assert [s.month for s in starts(thirty_first, *window)] == [1, 3]
+
+def test_recurrence_id_moves_one_occurrence():
+    master, moved = parse_ics(ics(
+        "UID:sync\nDTSTART:20260202T100000\nDURATION:PT1H\nRRULE:FREQ=DAILY;COUNT=3",
+        "UID:sync\nRECURRENCE-ID:20260203T100000\nDTSTART:20260203T140000\nDURATION:PT1H"))
+    window = (datetime(2026, 2, 1), datetime(2026, 2, 6))
+    assert [s.hour for s in starts(master, *window)] == [10, 10]
+    assert starts(moved, *window) == [datetime(2026, 2, 3, 14)]
+
+def test_utc_times_are_converted_to_local():
+    [event] = parse_ics(ics("UID:a\nDTSTART:20260202T150000Z\nDTEND:20260202T160000Z"))
+    expected = to_local(datetime(2026, 2, 2, 15), timezone.utc)
+    assert starts(event, expected - timedelta(hours=1), expected + timedelta(hours=1)) == [expected]
+
+def test_flatten_resolves_overlaps_by_priority():
+    t = lambda h: datetime(2026, 2, 2, h)
+    segments = flatten([(t(9), t(12), "focused", 0), (t(10), t(11), "away", 1), (t(12), t(13), "focused", 0)], t(0), t(23))
+    assert segments == [(t(9), t(10), "focused"), (t(10), t(11), "away"), (t(11), t(13), "focused")]
+
+@pytest.fixture
+def calendar_file(tmp_path):
+    path = tmp_path / "work.ics"
+    path.write_text(ics(
+        "UID:standup\nDTSTART:20260202T093000\nDTEND:20260202T100000\nRRULE:FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR",
+        "UID:offsite\nDTSTART;VALUE=DATE:20260206\nDTEND;VALUE=DATE:20260207",
+        "UID:free\nDTSTART:20260203T130000\nDTEND:20260203T140000\nTRANSP:TRANSPARENT"))
+    return path
+
+def test_engine_applies_calendar_between_override_and_rules(calendar_file):
+    rules = [{"days": ["Mon", "Tue", "Wed", "Thu", "Fri"], "start": "09:00", "end": "17:00", "state": "open"}]
+    settings = {"default_state": "away", "rules": rules, "calendars": [{"path": str(calendar_file), "state": "focused"}]}
+    engine = ScheduleEngine(MockConfig(settings))
+
+    assert engine.get_desired_status(datetime(2026, 2, 3, 9, 45)) == "focused"
+    assert engine.get_desired_status(datetime(2026, 2, 3, 10, 0)) == "open"
+    # Free time and (unless configured) all-day events don't count
+    assert engine.get_desired_status(datetime(2026, 2, 3, 13, 30)) == "open"
+    assert engine.get_desired_status(datetime(2026, 2, 6, 12, 0)) == "open"
+    assert engine.next_transition(datetime(2026, 2, 3, 9, 0)) == datetime(2026, 2, 3, 9, 30)
+
+    settings["manual_override"] = "away"
+    assert engine.get_desired_status(datetime(2026, 2, 3, 9, 45)) == "away"
+
+def test_all_day_state(calendar_file):
+    settings = {"default_state": "open", "rules": [],
+                "calendars": [{"path": str(calendar_file), "state": "focused", "all_day_state": "away"}]}
+    engine = ScheduleEngine(MockConfig(settings))
+    assert engine.get_desired_status(datetime(2026, 2, 6, 12, 0)) == "away"
+    assert engine.get_desired_status(datetime(2026, 2, 7, 12, 0)) == "open"
+
+def test_batch_and_timeline_agree_with_scalar(calendar_file):
+    settings = {"default_state": "away", "rules": [], "calendars": [{"path": str(calendar_file), "state": "focused"}]}
+    engine = ScheduleEngine(MockConfig(settings))
+    start = datetime(2026, 2, 1)
+    # Spans far past the rolling window
+    times = [start + timedelta(minutes=7 * i) for i in range(60 * 24 * 40 // 7)]
+    expected = [engine.get_desired_status(t) for t in times]
+    assert engine.get_desired_status_many(times) == expected
+
+    timeline = engine.get_timeline(start, start + timedelta(days=14))
+    assert timeline[1] == (datetime(2026, 2, 2, 9, 30), datetime(2026, 2, 2, 10), "focused")
+    for t in times[:len(times) // 3]:
+        state = next(s for a, b, s in timeline if a <= t < b)
+        assert state == engine.get_desired_status(t)
+
+def test_batch_numpy_matches(calendar_file):
+    np = pytest.importorskip("numpy")
+    settings = {"default_state": "away", "rules": [], "calendars": [{"path": str(calendar_file), "state": "focused"}]}
+    engine = ScheduleEngine(MockConfig(settings))
+    times = np.arange("2026-02-02T09:00", "2026-02-04T11:00", 5, dtype="datetime64[m]")
+    assert engine.get_desired_status_many(times) == [engine.get_desired_status(t.item()) for t in times]
+
+def test_window_advances_incrementally_and_files_reload(calendar_file):
+    index = CalendarIndex(window_days=7, check_seconds=0)
+    index.configure([{"path": str(calendar_file), "state": "focused"}])
+    assert index.state_at(datetime(2026, 2, 2, 9, 45)) == "focused"
+    first_window = index.window_start
+
+    # Moving forward keeps what's still in range and adds the new days
+    assert index.state_at(datetime(2026, 2, 8, 9, 45)) is None
+    assert index.window_start > first_window
+    assert index.state_at(datetime(2026, 2, 9, 9, 45)) == "focused"
+    assert [s.day for s, _, _ in index._segments] == [9, 10, 11, 12, 13]
+
+    generation = index.generation
+    calendar_file.write_text(ics("UID:x\nDTSTART:20260209T120000\nDTEND:20260209T130000"))
+    os.utime(calendar_file, (time.time() + 5, time.time() + 5))
+    assert index.state_at(datetime(2026, 2, 9, 9, 45)) is None
+    assert index.state_at(datetime(2026, 2, 9, 12, 30)) == "focused"
+    assert index.generation > generation
+
+def test_missing_file_is_ignored(tmp_path):
+    engine = ScheduleEngine(MockConfig({"default_state": "away", "rules": [],
+                                        "calendars": [{"path": str(tmp_path / "nope.ics"), "state": "focused"}]}))
+    assert engine.get_desired_status(datetime(2026, 2, 2, 9, 45)) == "away"
+
+def test_lookups_stay_fast_with_many_recurring_events(tmp_path):
+    events = [f"UID:e{i}\nDTSTART:2020{1 + i % 12:02d}{1 + i % 28:02d}T{8 + i % 10:02d}{i % 60:02d}00\n"
+              f"DURATION:PT15M\nRRULE:FREQ=WEEKLY;BYDAY={['MO', 'TU', 'WE', 'TH', 'FR'][i % 5]}" for i in range(3000)]
+    path = tmp_path / "big.ics"
+    path.write_text(ics(*events))
+    index = CalendarIndex()
+    index.configure([{"path": str(path), "state": "focused"}])
+    now = datetime(2026, 2, 2, 8)
+    index.state_at(now)
+
+    start = time.perf_counter()
+    for minute in range(10000):
+        index.state_at(now + timedelta(seconds=minute))
+    assert (time.perf_counter() - start) / 10000 < 0.0005
+
+def test_unknown_tzid_warns_once(caplog):
+    from calendar_source import get_zone
+    get_zone.cache_clear()
+    text = ics("UID:a\nDTSTART;TZID=Pacific Standard Time:20260202T090000\nDURATION:PT1H",
+               "UID:b\nDTSTART;TZID=Pacific Standard Time:20260203T090000\nDURATION:PT1H")
+    with caplog.at_level("WARNING"):
+        first, second = parse_ics(text)
+    assert first.tz is None and first.start == datetime(2026, 2, 2, 9)
+    assert len([r for r in caplog.records if "Pacific Standard Time" in r.getMessage()]) == 1
+
+def test_file_change_cannot_reset_the_index_mid_lookup(calendar_file, monkeypatch):
+    import threading
+    import calendar_source
+    index = CalendarIndex(check_seconds=0)
+    index.configure([{"path": str(calendar_file), "state": "focused"}])
+    moment = datetime(2026, 2, 2, 9, 45)
+    assert index.state_at(moment) == "focused"
+
+    # Another thread (e.g. a dashboard request) sees the file change between
+    # this lookup's bisect and its read of the segments
+    real_bisect = calendar_source.bisect_right
+    def bisect_then_change(a, x):
+        result = real_bisect(a, x)
+        os.utime(calendar_file, (time.time() + 10, time.time() + 10))
+        other = threading.Thread(target=index.check_files)
+        other.start()
+        other.join(0.2)
+        return result
+    monkeypatch.setattr(calendar_source, "bisect_right", bisect_then_change)
+    assert index.state_at(moment) == "focused"
@@ -0,0 +1,83 @@
+import socket
+import pytest
+from command_channel import CommandServer, parse_command, send_command
+
+@pytest.fixture
+def server():
+    received = []
+
+    def handler(name, args):
+        received.append((name, args))
+        if name == "force" and args[0] == "bogus":
+            raise ValueError("unknown state: bogus")
+        if name == "status":
+            return {"state": "open"}
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("localhost", 0))
+    sock.listen(5)
+    command_server = CommandServer(sock, handler)
+    command_server.start()
+    yield sock.getsockname()[1], received
+    command_server.stop()
+    sock.close()
+
+def test_parse_command():
+    assert parse_command("force focused\n") == ("force", ["focused"])
+    assert parse_command("force away 30") == ("force", ["away", "30"])
+    assert parse_command("status") == ("status", [])
+    with pytest.raises(ValueError):
+        parse_command("force")
+    with pytest.raises(ValueError):
+        parse_command("reboot")
+
+def test_commands_round_trip(server):
+    port, received = server
+    assert send_command("status", port=port) == {"ok": True, "state": "open"}
+    assert send_command("force away", port=port) == {"ok": True}
+    assert send_command("resume", port=port) == {"ok": True}
+    assert received == [("status", []), ("force", ["away"]), ("resume", [])]
+
+def test_errors_are_reported(server):
+    port, received = server
+    assert send_command("force bogus", port=port) == {"ok": False, "error": "unknown state: bogus"}
+    assert send_command("reboot", port=port)["ok"] is False
+    assert received == [("force", ["bogus"])]
+
+def test_bare_probe_is_ignored(server):
+    port, received = server
+    # The old single-instance check just connects and closes
+    with socket.create_connection(("localhost", port)):
+        pass
+    assert send_command("status", port=port)["ok"] is True
+    assert received == [("status", [])]
+
+def test_no_engine_running():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("localhost", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    assert send_command("status", port=port) is None
+
+def test_commands_are_queued_until_the_engine_is_ready():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("localhost", 0))
+    sock.listen(5)
+    port = sock.getsockname()[1]
+    command_server = CommandServer(sock)
+    command_server.start()
+    try:
+        # Answered immediately while starting, not left to time out
+        assert send_command("force away", port=port) == {"ok": True, "queued": True}
+        assert send_command("open-settings", port=port) == {"ok": True, "queued": True}
+        assert send_command("status", port=port)["ok"] is False
+
+        received = []
+        command_server.set_handler(lambda name, args: received.append((name, args)))
+        assert received == [("force", ["away"]), ("open-settings", [])]
+
+        assert send_command("resume", port=port) == {"ok": True}
+        assert received[-1] == ("resume", [])
+    finally:
+        command_server.stop()
+        sock.close()
@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import pytest
+from config_store import ConfigStore
+import config_watcher
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+def test_polling_reload_picks_up_external_write(make_store):
+    store = make_store()
+    store.stop_watching()
+    store.set("default_state", "open")
+    store.flush()
+
+    other = make_store()
+    other.stop_watching()
+    assert other.get("default_state") == "open"
+
+    # Polling stats the file on every read
+    before = store.fs_calls
+    store.get("default_state")
+    assert store.fs_calls > before
+
+@pytest.mark.skipif(not config_watcher.InotifyWatcher.is_supported(), reason="inotify not available")
+def test_watcher_reads_cost_no_filesystem_calls(make_store):
+    store = make_store()
+    assert store.watcher is not None
+    store.set("default_state", "open")
+    store.flush()
+    # Let the event for our own write settle
+    wait_for(lambda: store._config_dirty)
+    time.sleep(0.1)
+    store.get("default_state")
+    store.get("device_status")
+
+    before = store.fs_calls
+    for _ in range(100):
+        store.get("default_state")
+        store.get("device_status")
+        store.reload()
+    assert store.fs_calls == before
+
+    # Writes from another process are picked up after the OS reports them
+    data = json.loads(store.config_path.read_text())
+    data["default_state"] = "focused"
+    store.config_path.write_text(json.dumps(data))
+    assert wait_for(lambda: store.get("default_state") == "focused")
+    store.stop_watching()
+
+@pytest.mark.skipif(not config_watcher.InotifyWatcher.is_supported(), reason="inotify not available")
+def test_dead_watcher_falls_back_to_polling(monkeypatch, make_store):
+    store = make_store()
+    store.config["save_debounce_seconds"] = 0
+    store.set("default_state", "open")
+    thread = store.watcher.thread
+
+    # The watcher thread hits an error on its next wakeup and exits
+    def broken_select(*args):
+        raise OSError("inotify fd went away")
+    monkeypatch.setattr(config_watcher.select, "select", broken_select)
+    store.config_path.write_text(store.config_path.read_text())
+    thread.join(2)
+    monkeypatch.undo()
+    assert not thread.is_alive()
+    assert store.watcher is None
+
+    # Edits are still picked up, now by stat polling
+    data = json.loads(store.config_path.read_text())
+    data["default_state"] = "focused"
+    store.config_path.write_text(json.dumps(data))
+    os.utime(store.config_path, (time.time() + 5, time.time() + 5))
+    assert store.get("default_state") == "focused"
+
+def test_transaction_coalesces_into_one_write(monkeypatch, make_store):
+    store = make_store()
+    store.stop_watching()
+    store.config["save_debounce_seconds"] = 0
+    writes = []
+    original = store._write_atomic
+    monkeypatch.setattr(store, "_write_atomic", lambda: (writes.append(1), original()))
+
+    with store.transaction():
+        store.set("default_state", "open")
+        store.set("poll_seconds", 5)
+        store.set("manual_override", "focused")
+        assert writes == []
+
+    assert len(writes) == 1
+    on_disk = json.loads(store.config_path.read_text())
+    assert on_disk["default_state"] == "open"
+    assert on_disk["manual_override"] == "focused"
+    # No temp files are left behind
+    assert [p.name for p in store.config_dir.iterdir() if p.name.endswith(".tmp")] == []
+
+def test_debounced_sets_flush_once(monkeypatch, make_store):
+    store = make_store()
+    store.stop_watching()
+    store.config["save_debounce_seconds"] = 0.05
+    writes = []
+    original = store._write_atomic
+    monkeypatch.setattr(store, "_write_atomic", lambda: (writes.append(1), original()))
+
+    for i in range(10):
+        store.set("poll_seconds", i + 1)
+    # Local reads see pending changes before they hit the disk
+    assert store.get("poll_seconds") == 10
+
+    assert wait_for(lambda: len(writes) == 1)
+    time.sleep(0.1)
+    assert len(writes) == 1
+    assert json.loads(store.config_path.read_text())["poll_seconds"] == 10
+
+def test_status_channel_round_trip(make_store):
+    engine_store = make_store()
+    settings_store = make_store()
+    assert engine_store.status_channel is not None
+    assert settings_store.get("device_status") == "searching"
+
+    status = {"code": "connected", "message": "Connected", "timestamp": 1.0}
+    engine_store.set("device_status", status)
+    seq = settings_store.status_sequence
+    assert settings_store.get("device_status") == status
+
+    # Unchanged records are served from the cached snapshot
+    assert settings_store.get("device_status") is settings_store.get("device_status")
+    assert settings_store.status_sequence == seq
+
+    engine_store.set("device_status", dict(status, code="not_detected"))
+    assert settings_store.get("device_status")["code"] == "not_detected"
+    assert settings_store.status_sequence > seq
+    # The shared-memory channel replaces status.json
+    assert not engine_store.status_path.exists()
+
+def test_new_engine_replaces_a_stale_status(make_store):
+    # A previous run published "connected" and exited without cleaning up
+    old_engine = make_store()
+    old_engine.set("device_status", {"code": "connected", "message": "Connected", "timestamp": 1.0})
+    old_engine.status_channel.close()
+    settings_store = make_store()
+    stale_sequence = settings_store.status_sequence
+    assert settings_store.get("device_status")["code"] == "connected"
+
+    # The new engine publishes its own status as soon as its DeviceManager exists
+    from device_controller import DeviceManager
+    DeviceManager(make_store())
+    assert settings_store.get("device_status")["code"] == "searching"
+    assert settings_store.status_sequence > stale_sequence
+
+def test_status_file_fallback(make_store):
+    engine_store = make_store()
+    engine_store.status_channel = None
+    settings_store = make_store()
+    settings_store.status_channel = None
+    settings_store.stop_watching()
+
+    status = {"code": "connected", "message": "Connected", "timestamp": 1.0}
+    engine_store.set("device_status", status)
+    assert settings_store.get("device_status") == status
+
+def test_external_write_during_debounce_is_merged(make_store):
+    store = make_store()
+    store.stop_watching()
+    store.flush()
+    store.set("poll_seconds", 2)
+    store.config["save_debounce_seconds"] = 60
+    store.set("default_state", "open")
+    assert store._save_pending
+
+    # Another process (e.g. the dashboard) writes a different key meanwhile
+    other = make_store()
+    other.stop_watching()
+    other.config["save_debounce_seconds"] = 0
+    other.set("manual_override", "away")
+    os.utime(store.config_path, (time.time() + 5, time.time() + 5))
+
+    store.reload()
+    assert store.config["manual_override"] == "away"
+    assert store.config["default_state"] == "open"
+
+    store.flush()
+    saved = json.loads(store.config_path.read_text())
+    assert (saved["manual_override"], saved["default_state"]) == ("away", "open")
+
+def test_failed_transaction_rolls_back(make_store):
+    store = make_store()
+    store.stop_watching()
+    store.config["save_debounce_seconds"] = 0
+    store.set("default_state", "open")
+    writes = []
+    real_write = store._write_atomic
+    store._write_atomic = lambda: (writes.append(dict(store.config)), real_write())
+
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.set("default_state", "off")
+            store.set("rules", [])
+            raise RuntimeError("half-applied")
+    assert writes == []
+    assert store.config["default_state"] == "open"
+    assert store.config["rules"] == ConfigStore.DEFAULT_CONFIG["rules"]
+
+def test_stores_are_not_pinned_by_atexit(home):
+    import gc
+    import weakref
+    # Not from make_store, which keeps its stores alive until teardown
+    store = ConfigStore()
+    store.stop_watching()
+    ref = weakref.ref(store)
+    del store
+    gc.collect()
+    assert ref() is None
+
+def test_old_opt_in_sleep_defaults_are_migrated(make_store):
+    store = make_store()
+    store.stop_watching()
+    assert store.config["sleep_until_change"] is True
+
+    data = dict(store.config, sleep_until_change=False, max_sleep_seconds=60)
+    store.config_path.write_text(json.dumps(data))
+    assert make_store().config["sleep_until_change"] is True
+
+    # A deliberately chosen cap is kept as it is
+    store.config_path.write_text(json.dumps(dict(data, max_sleep_seconds=5)))
+    other = make_store()
+    other.stop_watching()
+    assert (other.config["sleep_until_change"], other.config["max_sleep_seconds"]) == (False, 5)
@@ -0,0 +1,303 @@
+import time
+import pytest
+import device_controller
+from device_controller import DeviceManager
+
+class FakeHIDDevice:
+    def __init__(self, hid_module):
+        self.hid_module = hid_module
+        self.path = None
+
+    def open_path(self, path):
+        if self.hid_module.behaviour.get(path) == "busy":
+            raise OSError("open failed")
+        self.path = path
+
+    def write(self, data):
+        behaviour = self.hid_module.behaviour.get(self.path)
+        if behaviour == "slow":
+            time.sleep(0.5)
+        elif behaviour == "fail":
+            raise OSError("write failed")
+        self.hid_module.writes.setdefault(self.path, []).append(list(data))
+        self.hid_module.events.append(("write", self.path))
+        return len(data)
+
+    def close(self):
+        self.hid_module.events.append(("close", self.path))
+
+class FakeHID:
+    """Stands in for the hidapi module: a set of attached lights."""
+    def __init__(self, paths, product="Blynclight"):
+        self.paths = list(paths)
+        self.product = product
+        self.behaviour = {}
+        self.writes = {}
+        # ("write" | "close", path) in the order they happened
+        self.events = []
+        self.enumerate_calls = 0
+
+    def enumerate(self, vid=0):
+        self.enumerate_calls += 1
+        return [{"path": p, "product_string": self.product} for p in self.paths]
+
+    def device(self):
+        return FakeHIDDevice(self)
+
+@pytest.fixture
+def fake_hid(monkeypatch):
+    fake = FakeHID([b"light-1", b"light-2", b"light-3"])
+    monkeypatch.setattr(device_controller, "hid", fake)
+    monkeypatch.setattr(device_controller, "BlynclightLib", None)
+    monkeypatch.setattr(device_controller, "_blynclight_loaded", True)
+    return fake
+
+def test_connects_every_light(fake_hid):
+    manager = DeviceManager(None)
+    manager.connect()
+    assert not manager.simulated_mode
+    assert len(manager.lights) == 3
+    status = manager.get_connection_status()
+    assert status["code"] == "connected"
+    assert [light["code"] for light in status["lights"]] == ["connected"] * 3
+
+def test_color_goes_to_all_lights_in_parallel(fake_hid):
+    manager = DeviceManager(None)
+    manager.connect()
+    fake_hid.behaviour[b"light-1"] = "slow"
+    fake_hid.behaviour[b"light-2"] = "slow"
+
+    start = time.time()
+    manager.set_status_color("focused")
+    # Two slow lights written concurrently, not one after the other
+    assert time.time() - start < 0.9
+    assert set(fake_hid.writes) == {b"light-1", b"light-2", b"light-3"}
+
+def test_failing_light_does_not_block_others(fake_hid):
+    manager = DeviceManager(None)
+    manager.connect()
+    fake_hid.behaviour[b"light-2"] = "fail"
+
+    manager.set_status_color("open")
+    assert set(fake_hid.writes) == {b"light-1", b"light-3"}
+    status = manager.connection_status
+    assert status["code"] == "connected"
+    assert [light["code"] for light in status["lights"]] == ["connected", "error", "connected"]
+
+def test_no_lights_falls_back_to_simulation(fake_hid):
+    fake_hid.paths = []
+    manager = DeviceManager(None)
+    manager.connect()
+    assert manager.simulated_mode
+    assert manager.connection_status["code"] == "not_detected"
+
+class FakeConfig:
+    def __init__(self, config):
+        self.config = config
+        self.version = 1
+        self.published = []
+    def set(self, key, value):
+        if key == "device_status":
+            self.published.append(value)
+    def claim_status(self, value):
+        pass
+
+def test_identical_frames_are_skipped(fake_hid):
+    fake_hid.paths = [b"light-1"]
+    manager = DeviceManager(None)
+    manager.connect()
+    manager.set_status_color("focused")
+    manager.set_status_color("focused")
+    manager.set_status_color("red")
+    assert fake_hid.writes[b"light-1"] == [[0x00, 255, 0, 0, 0x08, 0x00, 0x00, 0x00, 0x00]]
+
+    manager.set_status_color("away")
+    assert len(fake_hid.writes[b"light-1"]) == 2
+
+def test_plus_variant_frame(fake_hid):
+    fake_hid.paths = [b"light-1"]
+    fake_hid.product = "Blynclight Plus"
+    manager = DeviceManager(None)
+    manager.connect()
+    manager.set_status_color("open")
+    assert fake_hid.writes[b"light-1"] == [[0x00, 0, 0, 255, 0x00, 0x00, 0x00, 0x00, 0x05]]
+
+def test_custom_state_from_config(fake_hid):
+    fake_hid.paths = [b"light-1"]
+    config = FakeConfig({"custom_states": {"Lunch": "#FFA500", "broken": "nope"}})
+    manager = DeviceManager(config)
+    manager.connect()
+    manager.set_status_color("lunch")
+    assert fake_hid.writes[b"light-1"][-1][1:4] == [255, 0, 165]
+
+    # Unknown and invalid states leave the light alone
+    manager.set_status_color("broken")
+    manager.set_status_color("nonexistent")
+    assert len(fake_hid.writes[b"light-1"]) == 1
+
+def test_uevent_filter():
+    from hotplug import NetlinkHotplugMonitor
+    raw = b"add@/devices/pci0000:00/usb1/1-2\0ACTION=add\0SUBSYSTEM=usb\0PRODUCT=2c0d/c/100\0"
+    env = NetlinkHotplugMonitor.parse_uevent(raw)
+    assert env["ACTION"] == "add"
+    assert NetlinkHotplugMonitor.is_blynclight_event(env)
+    assert NetlinkHotplugMonitor.is_blynclight_event({"HID_ID": "0003:00002C0D:0000000C"})
+    assert not NetlinkHotplugMonitor.is_blynclight_event({"PRODUCT": "46d/c52b/1211"})
+
+def test_hotplug_events_replace_enumeration(fake_hid, monkeypatch):
+    import hotplug
+    from hotplug import PollingHotplugMonitor
+    monkeypatch.setattr(hotplug.NetlinkHotplugMonitor, "is_supported", staticmethod(lambda: False))
+    fake_hid.paths = []
+    manager = DeviceManager(FakeConfig({"hotplug_poll_seconds": 0.05}))
+    manager.start_hotplug()
+    assert isinstance(manager.hotplug_monitor, PollingHotplugMonitor)
+    manager.connect()
+    assert manager.simulated_mode
+
+    # Steady state: no enumeration on the status path
+    manager.hotplug_monitor.stop()
+    before = fake_hid.enumerate_calls
+    for _ in range(10):
+        manager.get_connection_status()
+    assert fake_hid.enumerate_calls == before
+
+    # A light appears: the monitor flags it and the next status check connects
+    woken = []
+    manager.on_status_change = lambda: woken.append(True)
+    manager.hotplug_monitor.start()
+    fake_hid.paths = [b"light-1"]
+    deadline = time.time() + 2
+    while not manager.hardware_changed and time.time() < deadline:
+        time.sleep(0.01)
+    assert woken
+    # The next status check hands the rescan to the background worker
+    manager.get_connection_status()
+    deadline = time.time() + 2
+    while manager.connection_status["code"] != "connected" and time.time() < deadline:
+        time.sleep(0.01)
+    assert manager.connection_status["code"] == "connected"
+    assert not manager.simulated_mode
+    manager.stop_hotplug()
+
+def test_failed_open_is_retried_with_hotplug_enabled(fake_hid, monkeypatch):
+    import hotplug
+    monkeypatch.setattr(hotplug.NetlinkHotplugMonitor, "is_supported", staticmethod(lambda: False))
+    fake_hid.paths = [b"light-1"]
+    # Attached but held by another program
+    fake_hid.behaviour[b"light-1"] = "busy"
+    manager = DeviceManager(FakeConfig({"hotplug_poll_seconds": 0.05}))
+    manager.breaker.base_delay = 0.05
+    manager.start_hotplug()
+    manager.connect()
+    assert manager.simulated_mode
+
+    # Released later: picked up without any attach/detach event
+    fake_hid.behaviour.clear()
+    deadline = time.time() + 2
+    while manager.simulated_mode and time.time() < deadline:
+        time.sleep(0.01)
+    assert not manager.hardware_changed
+    assert not manager.simulated_mode
+    assert manager.connection_status["code"] == "connected"
+    manager.stop_hotplug()
+
+def test_writes_during_a_reconnect_go_to_the_new_lights(fake_hid, monkeypatch):
+    import threading
+    fake_hid.paths = [b"light-1"]
+    manager = DeviceManager(None)
+    manager.connect()
+
+    # A background reconnect has closed the old light and is still scanning
+    discover = manager._discover_hid_lights
+    def slow_discover():
+        time.sleep(0.3)
+        return discover()
+    monkeypatch.setattr(manager, "_discover_hid_lights", slow_discover)
+    reconnect = threading.Thread(target=manager.connect, kwargs={"prefer_hid": True})
+    reconnect.start()
+    time.sleep(0.1)
+
+    # The main loop's write waits for the new lights instead of failing on the
+    # closed ones (which would mark them dead and trigger yet another reconnect)
+    manager.set_status_color("focused")
+    reconnect.join()
+    assert fake_hid.events[-2:] == [("close", b"light-1"), ("write", b"light-1")]
+    assert manager.connection_status["code"] == "connected"
+    assert not manager._reconnect_needed
+
+def test_failed_retries_publish_status_once(fake_hid):
+    fake_hid.paths = []
+    config = FakeConfig({})
+    manager = DeviceManager(config)
+    woken = []
+    manager.on_status_change = lambda: woken.append(True)
+    manager.connect()
+    published = len(config.published)
+    # Each retry records a breaker failure but leaves the status as it was
+    for _ in range(5):
+        manager.connect()
+    assert len(config.published) == published
+    assert len(woken) == 1
+    assert manager.connection_status["breaker"] == manager.breaker.get_status()
+
+def test_circuit_breaker_backoff():
+    from device_controller import CircuitBreaker
+    breaker = CircuitBreaker(base_delay=1, max_delay=8)
+    assert breaker.allow_attempt()
+
+    delays = []
+    for _ in range(6):
+        breaker.record_failure()
+        delays.append(breaker.seconds_until_retry())
+        assert not breaker.allow_attempt()
+    # Exponential growth with jitter in [0.5, 1.0] of the nominal delay, capped at max_delay
+    for failures, delay in enumerate(delays, start=1):
+        nominal = min(8, 2 ** (failures - 1))
+        assert nominal * 0.5 - 0.01 <= delay <= nominal
+    assert breaker.get_status()["state"] == "open"
+
+    breaker.retry_at = 0
+    assert breaker.allow_attempt()
+    assert breaker.state == "half_open"
+    breaker.record_success()
+    assert breaker.get_status() == {"state": "closed", "failures": 0, "next_retry": None}
+
+def test_write_failure_reconnects_in_background(fake_hid):
+    fake_hid.paths = [b"light-1"]
+    manager = DeviceManager(None)
+    manager.connect()
+    manager.breaker.base_delay = 0.05
+    fake_hid.behaviour[b"light-1"] = "fail"
+
+    enumerations = fake_hid.enumerate_calls
+    manager.set_status_color("open")
+    # No inline rescan on the calling thread; the breaker opens instead
+    assert fake_hid.enumerate_calls == enumerations
+    assert manager.connection_status["code"] == "error"
+    assert manager.connection_status["breaker"]["state"] == "open"
+
+    fake_hid.behaviour.clear()
+    deadline = time.time() + 2
+    while manager.connection_status["code"] != "connected" and time.time() < deadline:
+        time.sleep(0.01)
+    assert manager.connection_status["code"] == "connected"
+    assert manager.needs_sync
+
+def test_prefer_hid_skips_library_import(fake_hid, monkeypatch):
+    monkeypatch.setattr(device_controller, "_blynclight_loaded", False)
+    manager = DeviceManager(None)
+    manager.connect(prefer_hid=True)
+    assert len(manager.lights) == 3
+    # HID found the lights, so the blynclight library was never imported
+    assert device_controller._blynclight_loaded is False
+
+def test_write_metrics(fake_hid):
+    manager = DeviceManager(None)
+    manager.connect()
+    before = device_controller.DEVICE_WRITES.value
+    manager.set_status_color("open")
+    manager.set_status_color("open")
+    # Identical frames are skipped, so only the first color change reaches the lights
+    assert device_controller.DEVICE_WRITES.value - before == 3
+    assert device_controller.LIGHTS_CONNECTED.value == 3
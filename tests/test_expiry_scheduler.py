@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+from expiry_scheduler import ExpiryScheduler
+
+T0 = datetime(2026, 2, 2, 9, 0)
+
+def test_pops_due_deadlines_in_order():
+    expiries = ExpiryScheduler()
+    expiries.schedule("b", T0 + timedelta(minutes=20))
+    expiries.schedule("a", T0 + timedelta(minutes=10))
+    expiries.schedule("c", T0 + timedelta(minutes=30))
+
+    assert expiries.next_deadline() == T0 + timedelta(minutes=10)
+    assert expiries.pop_due(T0) == []
+    assert expiries.pop_due(T0 + timedelta(minutes=25)) == [
+        ("a", T0 + timedelta(minutes=10)), ("b", T0 + timedelta(minutes=20))]
+    assert expiries.next_deadline() == T0 + timedelta(minutes=30)
+    assert len(expiries) == 1
+
+def test_reschedule_and_cancel_skip_stale_entries():
+    expiries = ExpiryScheduler()
+    expiries.schedule("override", T0 + timedelta(minutes=5))
+    expiries.schedule("override", T0 + timedelta(minutes=60))
+    assert expiries.deadline("override") == T0 + timedelta(minutes=60)
+    assert expiries.next_deadline() == T0 + timedelta(minutes=60)
+    assert expiries.pop_due(T0 + timedelta(minutes=30)) == []
+
+    expiries.cancel("override")
+    assert expiries.next_deadline() is None
+    assert expiries.pop_due(T0 + timedelta(days=1)) == []
+    assert len(expiries) == 0
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import icon_renderer
+
+@pytest.mark.parametrize("rgb", [(16, 185, 129), (239, 68, 68), (255, 165, 0)])
+@pytest.mark.parametrize("size", icon_renderer.ICON_SIZES)
+def test_numpy_renderer_matches_ellipse_loop(rgb, size):
+    glow = icon_renderer.glow_color(rgb)
+    a = np.asarray(icon_renderer.render_gradient_ellipses(rgb, glow, size), dtype=int)
+    b = np.asarray(icon_renderer.render_gradient_numpy(rgb, glow, size), dtype=int)
+    assert a.shape == b.shape == (size, size, 4)
+
+    # The disc body matches closely; near the rim Lanczos ringing in the
+    # ellipse path brightens a few pixels
+    yy, xx = np.mgrid[0:size, 0:size]
+    body = np.hypot(xx - size / 2, yy - size / 2) < size * 0.35
+    assert np.abs(a[body] - b[body]).max() <= 4
+    opaque = (a[..., 3] == 255) & (b[..., 3] == 255)
+    assert np.abs(a[opaque] - b[opaque]).max() <= 20
+
+def test_default_renderer_is_numpy(monkeypatch):
+    # The shipped path: render_gradient_icon picks NumPy when it's importable
+    calls = []
+    monkeypatch.setattr(icon_renderer, "render_gradient_numpy", lambda *args: calls.append(args) or "numpy")
+    assert icon_renderer.render_gradient_icon((16, 185, 129), (24, 255, 193), 32) == "numpy"
+    assert calls
+
+def test_icons_are_memoized_per_color_and_size():
+    first = icon_renderer.get_state_icon("focused", 64)
+    assert icon_renderer.get_state_icon("red", 64) is first
+    custom = icon_renderer.get_state_icon("lunch", 64, (255, 165, 0))
+    assert custom is not first
+    assert custom.size == (64, 64)
+
+@pytest.fixture
+def atlas_file(tmp_path, monkeypatch):
+    path = tmp_path / icon_renderer.ATLAS_NAME
+    monkeypatch.setattr(icon_renderer, "atlas_path", lambda: str(path))
+    icon_renderer.load_atlas.cache_clear()
+    icon_renderer.get_icon.cache_clear()
+    yield path
+    icon_renderer.load_atlas.cache_clear()
+    icon_renderer.get_icon.cache_clear()
+
+def test_atlas_covers_every_state_and_size():
+    atlas = icon_renderer.create_atlas()
+    cell = icon_renderer.ATLAS_CELL
+    assert atlas.size == (cell * len(icon_renderer.ICON_SIZES), cell * len(icon_renderer.STATE_COLORS))
+    pixels = np.asarray(atlas)
+    for row, state in enumerate(icon_renderer.STATE_COLORS):
+        for col, size in enumerate(icon_renderer.ICON_SIZES):
+            x, y = col * cell, row * cell
+            # The icon's center pixel is opaque, and nothing spills past its size
+            assert pixels[y + size // 2, x + size // 2, 3] == 255
+            assert not pixels[y + size:y + cell, x:x + cell, 3].any()
+            assert not pixels[y:y + cell, x + size:x + cell, 3].any()
+
+def test_icons_are_cropped_from_the_atlas(atlas_file):
+    icon_renderer.save_atlas(atlas_file)
+    assert icon_renderer.load_atlas() is not None
+    for state, rgb in icon_renderer.STATE_COLORS.items():
+        for size in icon_renderer.ICON_SIZES:
+            expected = icon_renderer.render_gradient_icon(rgb, icon_renderer.glow_color(rgb), size=size)
+            icon = icon_renderer.get_icon(rgb, size)
+            assert icon.size == (size, size)
+            assert np.array_equal(np.asarray(icon), np.asarray(expected)), (state, size)
+
+def test_missing_or_stale_atlas_falls_back_to_rendering(atlas_file, monkeypatch):
+    rgb = icon_renderer.STATE_COLORS["focused"]
+    expected = np.asarray(icon_renderer.render_gradient_icon(rgb, icon_renderer.glow_color(rgb), size=32))
+
+    assert icon_renderer.load_atlas() is None
+    assert np.array_equal(np.asarray(icon_renderer.get_icon(rgb, 32)), expected)
+
+    # Baked from an older palette: same layout, different colors
+    icon_renderer.save_atlas(atlas_file)
+    open_rgb = icon_renderer.STATE_COLORS["open"]
+    monkeypatch.setitem(icon_renderer.STATE_COLORS, "open", (0, 128, 0))
+    icon_renderer.load_atlas.cache_clear()
+    assert icon_renderer.load_atlas() is None
+
+    # An atlas without the key (e.g. hand-edited) is not trusted either
+    monkeypatch.setitem(icon_renderer.STATE_COLORS, "open", open_rgb)
+    icon_renderer.save_atlas(atlas_file)
+    icon_renderer.load_atlas.cache_clear()
+    assert icon_renderer.load_atlas() is not None
+    icon_renderer.create_atlas().save(atlas_file)
+    icon_renderer.load_atlas.cache_clear()
+    icon_renderer.get_icon.cache_clear()
+    assert icon_renderer.load_atlas() is None
+    assert np.array_equal(np.asarray(icon_renderer.get_icon(rgb, 32)), expected)
@@ -0,0 +1,65 @@
+import logging
+import time
+import pytest
+from log_pipeline import DedupFilter, LogPipeline
+
+def make_record(msg, *args, level=logging.INFO):
+    return logging.LogRecord("app", level, __file__, 1, msg, args, None)
+
+def test_dedup_drops_repeats_within_window():
+    dedup = DedupFilter(window=0.2)
+    assert dedup.filter(make_record("Reconnecting to %s", "hid:1"))
+    for _ in range(5):
+        assert not dedup.filter(make_record("Reconnecting to %s", "hid:1"))
+    # Different text or level is a different message
+    assert dedup.filter(make_record("Reconnecting to %s", "hid:2"))
+    assert dedup.filter(make_record("Reconnecting to %s", "hid:1", level=logging.ERROR))
+
+    time.sleep(0.25)
+    record = make_record("Reconnecting to %s", "hid:1")
+    assert dedup.filter(record)
+    assert record.getMessage() == "Reconnecting to hid:1 (repeated 5 more times in the last 0.2s)"
+
+def test_dedup_forgets_least_recent_keys():
+    dedup = DedupFilter(window=60, max_keys=2)
+    for msg in ("a", "b", "c"):
+        dedup.filter(make_record(msg))
+    assert list(key[2] for key in dedup.seen) == ["b", "c"]
+
+@pytest.fixture
+def pipeline(tmp_path):
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    pipelines = []
+
+    def start(**kwargs):
+        p = LogPipeline(tmp_path / "app.log", **kwargs)
+        p.start()
+        pipelines.append(p)
+        return p
+
+    yield start
+    for p in pipelines:
+        p.stop()
+    for handler in saved_handlers:
+        root.addHandler(handler)
+    root.setLevel(saved_level)
+
+def test_pipeline_writes_rotates_and_filters_by_level(pipeline, tmp_path):
+    p = pipeline(level="warning", max_bytes=200, backup_count=2, dedup_seconds=0)
+    logging.info("hidden")
+    for i in range(20):
+        logging.warning(f"message number {i}")
+    p.stop()
+
+    log = (tmp_path / "app.log").read_text()
+    assert "hidden" not in log
+    assert "message number 19" in log
+    assert (tmp_path / "app.log.1").exists() and (tmp_path / "app.log.2").exists()
+    assert not (tmp_path / "app.log.3").exists()
+
+def test_set_level_accepts_names(pipeline):
+    p = pipeline(level="DEBUG")
+    assert logging.getLogger().level == logging.DEBUG
+    p.set_level("bogus")
+    assert logging.getLogger().level == logging.INFO
@@ -0,0 +1,40 @@
+import json
+import socket
+import pytest
+import command_channel
+import main
+
+@pytest.fixture
+def engine(home, monkeypatch):
+    """A running engine's command channel on a free port, standing in for LOCK_PORT."""
+    def handler(name, args):
+        if name == "status":
+            return {"state": "open"}
+        if name == "trace-dump":
+            return {"trace": {"traceEvents": [{"name": "update_light", "ph": "X", "ts": 0, "dur": 1}]}}
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("localhost", 0))
+    sock.listen(5)
+    port = sock.getsockname()[1]
+    server = command_channel.CommandServer(sock, handler)
+    server.start()
+    original = command_channel.send_command
+    monkeypatch.setattr(main.command_channel, "send_command", lambda command, **kwargs: original(command, port=port))
+    yield home
+    server.stop()
+    sock.close()
+
+def test_hand_off_builds_no_store_or_log(engine, capsys):
+    assert main.hand_off("status") == 0
+    assert json.loads(capsys.readouterr().out)["state"] == "open"
+    # No config dir, watcher or app.log was set up just to forward a command
+    assert not (engine / ".blynclight_scheduler").exists()
+
+def test_trace_dump_overwrites_one_file(engine, capsys):
+    config_dir = engine / ".blynclight_scheduler"
+    config_dir.mkdir()
+    assert main.hand_off("trace-dump") == 0
+    assert main.hand_off("trace-dump") == 0
+    assert [p.name for p in config_dir.iterdir()] == [main.TRACE_DUMP_NAME]
+    assert "Wrote 1 spans" in capsys.readouterr().out
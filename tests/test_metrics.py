@@ -0,0 +1,48 @@
+import pytest
+from metrics import Registry
+
+def test_counter_and_gauge_render():
+    registry = Registry()
+    writes = registry.counter("writes_total", "Writes")
+    requests = registry.counter("requests_total", "Requests", ("path",))
+    lights = registry.gauge("lights", "Lights")
+    writes.inc()
+    writes.inc(2)
+    requests.labels('/a"b').inc()
+    lights.set_function(lambda: 3)
+
+    text = registry.render()
+    assert "# TYPE writes_total counter\nwrites_total 3\n" in text
+    assert 'requests_total{path="/a\\"b"} 1\n' in text
+    assert "lights 3\n" in text
+    # Labelled metrics must be updated through labels()
+    with pytest.raises(ValueError):
+        requests.inc()
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_count 4" in lines
+    assert "latency_seconds_sum 3.65" in lines
+
+def test_registry_returns_existing_metric():
+    registry = Registry()
+    assert registry.counter("a_total", "A") is registry.counter("a_total", "A")
+    with pytest.raises(ValueError):
+        registry.gauge("a_total", "A")
+    assert registry.render(prefix="b_") == "\n"
+
+def test_render_can_exclude_a_prefix():
+    registry = Registry()
+    registry.counter("app_loads_total", "Loads").inc()
+    registry.counter("app_http_requests_total", "Requests").inc()
+    text = registry.render(exclude="app_http_")
+    assert "app_loads_total 1" in text
+    assert "app_http_" not in text
@@ -1,5 +1,6 @@
+import json
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta
 from schedule_engine import ScheduleEngine
 
 class MockConfig:
@@ -84,3 +85,236 @@ def test_disabled_rule():
     
     now = datetime(2026, 2, 2, 10, 0)
     assert engine.get_desired_status(now) == "away"
+
+def _reference_status(engine, config, now):
+    """Rule-by-rule evaluation as done before the week table was compiled."""
+    days_map = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+    final_state = config.get("default_state", "away")
+    for rule in config.get("rules", []):
+        if not rule.get("enabled", True):
+            continue
+        if days_map[now.weekday()] in [d.lower() for d in rule.get("days", [])]:
+            if engine.is_time_in_range(rule["start"], rule["end"], now.time()):
+                final_state = rule["state"]
+    return final_state.lower()
+
+def test_week_table_matches_rule_evaluation():
+    import random
+    rnd = random.Random(42)
+    days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+    states = ["open", "focused", "away", "off"]
+    rules = []
+    for _ in range(40):
+        rules.append({
+            "days": rnd.sample(days, rnd.randint(1, 7)),
+            "start": f"{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}",
+            "end": f"{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}",
+            "state": rnd.choice(states),
+            "enabled": rnd.random() > 0.2
+        })
+    config = MockConfig({"default_state": "Away", "rules": rules})
+    engine = ScheduleEngine(config)
+
+    for _ in range(2000):
+        now = datetime(2026, 2, 2 + rnd.randint(0, 6), rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59))
+        assert engine.get_desired_status(now) == _reference_status(engine, config.config, now)
+
+def test_week_table_rebuilt_on_version_change():
+    rules = [{"days": ["Mon"], "start": "09:00", "end": "10:00", "state": "open", "enabled": True}]
+    config = MockConfig({"default_state": "away", "rules": rules})
+    config.version = 1
+    engine = ScheduleEngine(config)
+    now = datetime(2026, 2, 2, 9, 30)
+    assert engine.get_desired_status(now) == "open"
+
+    # Same version: the cached table is reused
+    table = engine._week_table
+    config.config["rules"] = [dict(rules[0], state="focused")]
+    assert engine.get_desired_status(now) == "open"
+    assert engine._week_table is table
+
+    # New version: the table is recompiled
+    config.version = 2
+    assert engine.get_desired_status(now) == "focused"
+
+    # A write that leaves the rules and default state alone (e.g. an
+    # override being set or expiring) reuses the compiled slots
+    slots = engine._week_table.slots
+    config.config["manual_override"] = "away"
+    config.config["override_until"] = "2026-02-02T10:00:00"
+    config.version = 3
+    assert engine.get_desired_status(now) == "away"
+    assert engine._get_week_table().slots is slots
+    assert engine._week_table.version == 3
+
+    # Editing a rule in place is still noticed
+    config.config["rules"][0]["state"] = "open"
+    config.config["manual_override"] = None
+    config.version = 4
+    assert engine.get_desired_status(now) == "open"
+
+def test_recompile_mid_lookup_keeps_a_consistent_table(monkeypatch):
+    import threading
+    import schedule_engine
+    config = MockConfig({"default_state": "away", "rules": [
+        {"days": ["Mon"], "start": "09:00", "end": "17:00", "state": "focused", "enabled": True}]})
+    config.version = 1
+    engine = ScheduleEngine(config)
+    engine.get_desired_status(datetime(2026, 2, 2, 9, 30))
+
+    # Another handler thread recompiles a much busier schedule while this
+    # lookup is bisecting the transitions
+    original = schedule_engine.bisect_right
+    def bisect_during_recompile(values, slot):
+        if config.version == 1:
+            config.config["rules"] = [{"days": ["Mon", "Tue", "Wed"], "start": f"{h:02d}:00", "end": f"{h:02d}:30",
+                                       "state": "open", "enabled": True} for h in range(24)]
+            config.version = 2
+            thread = threading.Thread(target=engine._get_week_table)
+            thread.start()
+            thread.join()
+        return original(values, slot)
+    monkeypatch.setattr(schedule_engine, "bisect_right", bisect_during_recompile)
+
+    # The answer comes from one table: the one the lookup started with
+    assert engine.next_transition(datetime(2026, 2, 2, 10, 0)) == datetime(2026, 2, 2, 17, 0)
+
+def test_next_transition():
+    rules = [{"days": ["Mon"], "start": "09:00", "end": "17:00", "state": "focused", "enabled": True}]
+    config = MockConfig({"default_state": "away", "rules": rules})
+    engine = ScheduleEngine(config)
+
+    # Monday 08:15:30 -> rule starts at 09:00
+    assert engine.next_transition(datetime(2026, 2, 2, 8, 15, 30)) == datetime(2026, 2, 2, 9, 0)
+    # Monday 09:00 exactly -> rule ends at 17:00
+    assert engine.next_transition(datetime(2026, 2, 2, 9, 0)) == datetime(2026, 2, 2, 17, 0)
+    # Tuesday -> wraps to next Monday 09:00
+    assert engine.next_transition(datetime(2026, 2, 3, 12, 0)) == datetime(2026, 2, 9, 9, 0)
+
+def test_next_transition_overnight_and_override():
+    rules = [{"days": ["Mon"], "start": "22:00", "end": "02:00", "state": "off", "enabled": True}]
+    config = MockConfig({"default_state": "away", "rules": rules})
+    engine = ScheduleEngine(config)
+
+    # Monday 01:00 is inside the early-morning part of the overnight span
+    assert engine.next_transition(datetime(2026, 2, 2, 1, 0)) == datetime(2026, 2, 2, 2, 0)
+    assert engine.next_transition(datetime(2026, 2, 2, 23, 0)) == datetime(2026, 2, 3, 0, 0)
+
+    # Manual overrides never expire on their own
+    config.config["manual_override"] = "open"
+    assert engine.next_transition(datetime(2026, 2, 2, 23, 0)) is None
+
+def test_next_transition_constant_schedule():
+    config = MockConfig({"default_state": "away", "rules": []})
+    engine = ScheduleEngine(config)
+    assert engine.next_transition(datetime(2026, 2, 2, 10, 0)) is None
+
+def test_timeline_matches_get_desired_status():
+    rules = [
+        {"days": ["Mon", "Tue"], "start": "09:00", "end": "17:00", "state": "focused", "enabled": True},
+        {"days": ["Sun"], "start": "22:00", "end": "02:00", "state": "off", "enabled": True},
+        {"days": ["Mon"], "start": "12:00", "end": "13:00", "state": "open", "enabled": True},
+    ]
+    engine = ScheduleEngine(MockConfig({"default_state": "away", "rules": rules}))
+
+    start = datetime(2026, 2, 4, 6, 30, 15)  # Wednesday, mid-minute
+    end = start + timedelta(days=9)
+    timeline = engine.get_timeline(start, end)
+
+    assert timeline[0][0] == start and timeline[-1][1] == end
+    for (_, prev_end, prev_state), (next_start, _, next_state) in zip(timeline, timeline[1:]):
+        assert prev_end == next_start and prev_state != next_state
+
+    # Every minute agrees with the per-minute lookup, across the week boundary
+    for interval_start, interval_end, state in timeline:
+        moment = interval_start
+        while moment < interval_end:
+            assert engine.get_desired_status(moment) == state
+            moment += timedelta(minutes=1)
+
+def test_timeline_constant_schedule():
+    engine = ScheduleEngine(MockConfig({"default_state": "away", "rules": []}))
+    start = datetime(2026, 2, 2)
+    assert engine.get_timeline(start, start + timedelta(days=14)) == [(start, start + timedelta(days=14), "away")]
+
+BATCH_RULES = [
+    {"days": ["Mon", "Fri"], "start": "09:00", "end": "17:30", "state": "focused", "enabled": True},
+    {"days": ["Wed"], "start": "23:00", "end": "01:15", "state": "off", "enabled": True},
+    {"days": ["Fri"], "start": "12:00", "end": "12:01", "state": "open", "enabled": True},
+]
+
+def test_get_desired_status_many_matches_scalar():
+    engine = ScheduleEngine(MockConfig({"default_state": "away", "rules": BATCH_RULES}))
+    timestamps = [datetime(2026, 2, 2) + timedelta(minutes=7 * i, seconds=i % 60) for i in range(4000)]
+    assert engine.get_desired_status_many(timestamps) == [engine.get_desired_status(t) for t in timestamps]
+
+def test_get_desired_status_many_numpy_matches_scalar():
+    np = pytest.importorskip("numpy")
+    engine = ScheduleEngine(MockConfig({"default_state": "away", "rules": BATCH_RULES}))
+    # Every 37 seconds across two weeks, including pre-1970 dates
+    start = np.datetime64("2026-01-26T00:00:00")
+    timestamps = np.concatenate([
+        np.arange(start, start + np.timedelta64(14, "D"), np.timedelta64(37, "s")),
+        np.array(["1969-12-31T23:59:30", "1900-03-04T09:00"], dtype="datetime64[s]"),
+    ])
+    expected = [engine.get_desired_status(t.astype(datetime)) for t in timestamps]
+    assert engine.get_desired_status_many(timestamps) == expected
+
+def test_get_desired_status_many_override():
+    engine = ScheduleEngine(MockConfig({"default_state": "away", "rules": BATCH_RULES, "manual_override": "red"}))
+    assert engine.get_desired_status_many([datetime(2026, 2, 2, 10)] * 3) == ["focused"] * 3
+
+def test_timed_override_expires():
+    config = MockConfig({"default_state": "away", "rules": BATCH_RULES,
+                         "manual_override": "open", "override_until": "2026-02-02T10:30:00"})
+    engine = ScheduleEngine(config)
+    assert engine.get_desired_status(datetime(2026, 2, 2, 10, 29, 59)) == "open"
+    assert engine.get_desired_status(datetime(2026, 2, 2, 10, 30)) == "focused"
+    assert engine.next_transition(datetime(2026, 2, 2, 10)) == datetime(2026, 2, 2, 10, 30)
+
+    timestamps = [datetime(2026, 2, 2, 10) + timedelta(minutes=i) for i in range(60)]
+    assert engine.get_desired_status_many(timestamps) == [engine.get_desired_status(t) for t in timestamps]
+
+@pytest.fixture
+def store(make_store):
+    store = make_store()
+    store.config["save_debounce_seconds"] = 0
+    store.set("rules", BATCH_RULES)
+    return store
+
+def test_set_override_writes_state_and_expiry_together(store):
+    engine = ScheduleEngine(store)
+    now = datetime(2026, 2, 2, 10, 0, 12, 500)
+    assert engine.set_override("off", 45, now=now) == datetime(2026, 2, 2, 10, 45, 12)
+    with open(store.config_path) as f:
+        saved = json.load(f)
+    assert (saved["manual_override"], saved["override_until"]) == ("off", "2026-02-02T10:45:12")
+
+    # "next" runs until the rules would change on their own (Monday 17:30)
+    assert engine.set_override("away", "next", now=now) == datetime(2026, 2, 2, 17, 30)
+    for bad in (0, "nan", "inf", 1e12, [15]):
+        with pytest.raises(ValueError):
+            engine.set_override("away", bad, now=now)
+    assert store.config["override_until"] == "2026-02-02T17:30:00"
+
+    assert engine.set_override(None, 30, now=now) is None
+    assert store.config["override_until"] is None
+
+def test_override_until_next_change_needs_a_change(store):
+    store.set("rules", [])
+    engine = ScheduleEngine(store)
+    assert engine.next_transition(datetime(2026, 2, 2, 10, 0)) is None
+    with pytest.raises(ValueError, match="never changes"):
+        engine.set_override("focused", "next", now=datetime(2026, 2, 2, 10, 0))
+    assert store.config["manual_override"] is None
+
+def test_clear_expired_override_only_clears_its_own_deadline(store):
+    engine = ScheduleEngine(store)
+    now = datetime(2026, 2, 2, 10)
+    first = engine.set_override("off", 10, now=now)
+    engine.set_override("open", 60, now=now)
+    assert not engine.clear_expired_override(first)
+    assert store.config["manual_override"] == "open"
+
+    assert engine.clear_expired_override(now + timedelta(minutes=60))
+    assert (store.config["manual_override"], store.config["override_until"]) == (None, None)
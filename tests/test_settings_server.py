@@ -0,0 +1,251 @@
+import json
+import os
+import socket
+import time
+import urllib.error
+import urllib.request
+import pytest
+import settings_server
+
+@pytest.fixture
+def server(home, monkeypatch):
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    monkeypatch.setattr(settings_server, "PORT", port)
+    yield port
+    settings_server.stop_server()
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=2) as response:
+        return json.loads(response.read())
+
+def test_in_process_server_shares_the_engine_store(server, make_store):
+    store = make_store()
+    store.set("device_status", {"code": "connected", "message": "1 light"})
+
+    url = settings_server.start_server(store)
+    # Ready on return: no sleep needed before the first request
+    config = get_json(url + "/config")
+    assert config["device_status_obj"]["code"] == "connected"
+
+    # In-memory changes are visible without a round trip through another process
+    store.set("manual_override", "away")
+    assert get_json(url + "/config")["manual_override"] == "away"
+    assert settings_server.config_store is store
+
+def test_timeline_endpoint(server, make_store):
+    store = make_store()
+    store.config["save_debounce_seconds"] = 0
+    store.set("rules", [{"days": ["Mon"], "start": "09:00", "end": "17:00", "state": "focused", "enabled": True}])
+    url = settings_server.start_server(store)
+
+    timeline = get_json(url + "/timeline?from=2026-02-02T00:00&to=2026-02-03T00:00")
+    assert [(i["start"], i["end"], i["state"]) for i in timeline["intervals"]] == [
+        ("2026-02-02T00:00:00", "2026-02-02T09:00:00", "away"),
+        ("2026-02-02T09:00:00", "2026-02-02T17:00:00", "focused"),
+        ("2026-02-02T17:00:00", "2026-02-03T00:00:00", "away"),
+    ]
+
+    # A config change invalidates the cached intervals
+    store.set("default_state", "off")
+    timeline = get_json(url + "/timeline?from=2026-02-02T00:00&to=2026-02-03T00:00")
+    assert timeline["intervals"][0]["state"] == "off"
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        get_json(url + "/timeline?from=2026-02-02T00:00&to=2026-01-01T00:00")
+    assert error.value.code == 400
+
+def test_metrics_endpoint(server, make_store):
+    url = settings_server.start_server(make_store())
+    get_json(url + "/config")
+    with urllib.request.urlopen(url + "/metrics", timeout=2) as response:
+        assert response.headers["Content-Type"].startswith("text/plain")
+        text = response.read().decode()
+    assert 'blynclight_http_requests_total{method="GET",path="/config"}' in text
+    assert 'blynclight_http_request_seconds_count{path="/config"}' in text
+    assert "# TYPE blynclight_config_loads_total counter" in text
+
+def test_force_with_duration(server, make_store):
+    store = make_store()
+    store.config["save_debounce_seconds"] = 0
+    url = settings_server.start_server(store)
+
+    def post(body):
+        request = urllib.request.Request(url + "/force", data=json.dumps(body).encode(), method="POST")
+        with urllib.request.urlopen(request, timeout=2) as response:
+            return json.loads(response.read())
+
+    reply = post({"state": "away", "duration": 15})
+    assert reply["override_until"] == store.config["override_until"]
+    assert get_json(url + "/config")["override_until"] == reply["override_until"]
+
+    for bad in ("soon", "inf", 1e12):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            post({"state": "away", "duration": bad})
+        assert error.value.code == 400
+    assert store.config["override_until"] == reply["override_until"]
+
+    assert post({"state": None})["override_until"] is None
+    assert store.config["manual_override"] is None
+
+def test_connection_bound_answers_503_without_blocking_streams(server, monkeypatch, make_store):
+    monkeypatch.setattr(settings_server, "MAX_WORKERS", 2)
+    monkeypatch.setattr(settings_server, "MAX_EVENT_STREAMS", 1)
+    monkeypatch.setattr(settings_server, "SATURATED_WAIT_SECONDS", 0.2)
+    monkeypatch.setattr(settings_server.SettingsHandler, "timeout", 1)
+    url = settings_server.start_server(make_store())
+
+    # An /events stream doesn't take a request worker
+    stream = urllib.request.urlopen(url + "/events", timeout=2)
+    assert stream.readline().startswith(b"data: ")
+    # ...but streams have their own cap
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(url + "/events", timeout=2)
+    assert error.value.code == 503
+
+    # MAX_WORKERS idle keep-alive connections hold every worker...
+    idle = [socket.create_connection(("localhost", server)) for _ in range(2)]
+    time.sleep(0.1)
+    # ...so the next one is turned away quickly instead of queueing
+    start = time.time()
+    with pytest.raises(urllib.error.HTTPError) as error:
+        get_json(url + "/config")
+    assert error.value.code == 503
+    assert time.time() - start < 1
+
+    # Idle connections time out and free their workers
+    time.sleep(1.2)
+    assert "rules" in get_json(url + "/config")
+    for sock in idle:
+        sock.close()
+    stream.close()
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+def read_event(stream, predicate):
+    """Reads data: frames until one satisfies predicate."""
+    while True:
+        line = stream.readline()
+        assert line, "stream ended"
+        if line.startswith(b"data: "):
+            event = json.loads(line[len(b"data: "):])
+            if predicate(event):
+                return event
+
+def test_events_stream_pushes_changes(server, make_store):
+    store = make_store()
+    store.config["save_debounce_seconds"] = 0
+    url = settings_server.start_server(store)
+
+    stream = urllib.request.urlopen(url + "/events", timeout=3)
+    assert stream.headers["Content-Type"] == "text/event-stream"
+    assert read_event(stream, lambda e: True)["manual_override"] is None
+
+    # A config change wakes the stream right away
+    store.set("manual_override", "away")
+    read_event(stream, lambda e: e["manual_override"] == "away")
+
+    # So does a device status change
+    store.set("device_status", {"code": "connected", "message": "1 light"})
+    read_event(stream, lambda e: isinstance(e["device_status_obj"], dict) and e["device_status_obj"]["code"] == "connected")
+
+    # Closing the tab drops the subscriber
+    assert settings_server.httpd.streams == 1
+    stream.close()
+    assert wait_for(lambda: settings_server.httpd.streams == 0)
+
+def test_config_etag_revalidation(server, make_store):
+    import http.client
+    store = make_store()
+    store.config["save_debounce_seconds"] = 0
+    settings_server.start_server(store)
+    conn = http.client.HTTPConnection("localhost", server, timeout=2)
+
+    def get_config(if_none_match=None):
+        conn.request("GET", "/config", headers={"If-None-Match": if_none_match} if if_none_match else {})
+        response = conn.getresponse()
+        return response, response.read()
+
+    # One keep-alive connection: every response must carry its length
+    response, body = get_config()
+    assert response.status == 200
+    assert int(response.headers["Content-Length"]) == len(body)
+    etag = response.headers["ETag"]
+
+    for tag in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response, body = get_config(tag)
+        assert (response.status, body) == (304, b"")
+        assert response.headers["ETag"] == etag
+
+    response, body = get_config('"stale"')
+    assert response.status == 200 and json.loads(body)["config_version"] == store.version
+
+    # A change gives a new tag, so the old one no longer matches
+    store.set("default_state", "off")
+    response, body = get_config(etag)
+    assert response.status == 200
+    assert response.headers["ETag"] != etag
+    conn.close()
+
+def test_static_files_are_limited_to_web_ui(server, make_store):
+    cwd = os.getcwd()
+    url = settings_server.start_server(make_store())
+    with urllib.request.urlopen(url + "/index.html", timeout=2) as response:
+        assert b"<html" in response.read().lower()
+    for path in ("/settings_server.py", "/requirements.txt", "/../config_store.py"):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + path, timeout=2)
+        assert error.value.code == 404
+    # Serving doesn't move the whole process's working directory
+    assert os.getcwd() == cwd
+
+def test_trace_is_fetched_from_the_engine_without_files(home, monkeypatch):
+    trace = {"traceEvents": [{"name": "update_light", "ph": "X", "ts": 0, "dur": 1}], "displayTimeUnit": "ms"}
+    monkeypatch.setattr(settings_server, "serving_engine_store", False)
+    monkeypatch.setattr(settings_server.command_channel, "send_command",
+                        lambda command, timeout=2: {"ok": True, "trace": trace})
+    for _ in range(3):
+        assert json.loads(settings_server.get_trace_body()) == trace
+    assert not list(home.rglob("trace*.json"))
+
+def test_standalone_metrics_have_no_duplicate_families(home, monkeypatch):
+    # The engine process also registered the request metrics (in-process dashboard)
+    engine_text = settings_server.metrics.REGISTRY.render(exclude=settings_server.metrics.HTTP_PREFIX)
+    monkeypatch.setattr(settings_server, "serving_engine_store", False)
+    monkeypatch.setattr(settings_server.command_channel, "send_command",
+                        lambda command, timeout=2: {"ok": True, "text": engine_text})
+    type_lines = [line for line in settings_server.render_metrics().splitlines() if line.startswith("# TYPE")]
+    assert len(type_lines) == len(set(type_lines))
+    assert "# TYPE blynclight_http_requests_total counter" in type_lines
+
+def test_timeline_cache_survives_concurrent_requests(make_store):
+    import threading
+    from datetime import datetime, timedelta
+    store = make_store()
+    store.stop_watching()
+    settings_server.use_config_store(store)
+    errors = []
+
+    def worker(offset):
+        start = datetime(2026, 2, 2) + timedelta(days=offset)
+        for i in range(200):
+            try:
+                settings_server.get_timeline_body(start, start + timedelta(hours=1 + i % 20))
+            except Exception as e:
+                errors.append(e)
+            # Another request's config change invalidates the cache mid-iteration
+            store.version += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
@@ -0,0 +1,55 @@
+import json
+import threading
+import tracing
+from tracing import Tracer, NULL_SPAN
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(enabled=False)
+    with tracer.span("work") as span:
+        pass
+    assert span is NULL_SPAN
+    assert not tracer.events
+
+def test_spans_export_as_chrome_trace(tmp_path):
+    tracer = Tracer(enabled=True)
+    with tracer.span("update_light"):
+        with tracer.span("schedule.evaluate", state="open"):
+            pass
+    worker = threading.Thread(target=lambda: tracer.span("device.connect").__enter__().__exit__(None, None, None), name="light-reconnect")
+    worker.start()
+    worker.join()
+
+    trace = tracer.export()
+    spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    # Inner spans finish first
+    assert [e["name"] for e in spans] == ["schedule.evaluate", "update_light", "device.connect"]
+    outer, inner = spans[1], spans[0]
+    assert outer["ts"] <= inner["ts"] and inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    assert inner["args"] == {"state": "open"}
+    assert len({e["tid"] for e in spans}) == 2
+
+    path = tmp_path / "trace.json"
+    assert tracer.dump(path) == 3
+    assert json.loads(path.read_text())["traceEvents"]
+
+def test_ring_buffer_keeps_newest_spans():
+    tracer = Tracer(enabled=True, buffer_size=10)
+    for i in range(25):
+        with tracer.span(f"span-{i}"):
+            pass
+    names = [e["name"] for e in tracer.export()["traceEvents"] if e["ph"] == "X"]
+    assert names == [f"span-{i}" for i in range(15, 25)]
+
+def test_engine_modules_record_into_global_tracer(monkeypatch):
+    import device_controller
+    from device_controller import DeviceManager
+    # No hardware backends: connect falls through to simulation
+    monkeypatch.setattr(device_controller, "hid", None)
+    monkeypatch.setattr(device_controller, "_blynclight_loaded", True)
+    monkeypatch.setattr(device_controller, "BlynclightLib", None)
+    monkeypatch.setattr(tracing.TRACER, "enabled", True)
+    tracing.TRACER.clear()
+    DeviceManager(None).connect(prefer_hid=True)
+    names = [event[0] for event in tracing.TRACER.events]
+    assert "device.connect" in names and "device.discover" in names
+    tracing.TRACER.clear()
@@ -0,0 +1,93 @@
+import collections
+import json
+import os
+import threading
+import time
+
+# Set BLYNCLIGHT_TRACE=1 (or pass --trace to main.py) to record spans.
+# Only the newest BUFFER_SIZE spans are kept, so it is safe to leave on.
+ENV_VAR = "BLYNCLIGHT_TRACE"
+BUFFER_SIZE = 20000
+
+class _NullSpan:
+    """Shared no-op span returned while tracing is disabled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        # deque.append is atomic, so recording needs no lock
+        self.tracer.events.append((self.name, self.start, end - self.start, threading.get_ident(), self.args))
+        return False
+
+class Tracer:
+    """
+    Records timed spans into a ring buffer and exports them in the Chrome
+    trace-event format (load the JSON in chrome://tracing or Perfetto).
+    """
+    def __init__(self, enabled=False, buffer_size=BUFFER_SIZE):
+        self.enabled = enabled
+        self.events = collections.deque(maxlen=buffer_size)
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, args or None)
+
+    def clear(self):
+        self.events.clear()
+
+    def export(self):
+        """Returns the buffered spans as a Chrome trace-event dict."""
+        events = list(self.events)
+        threads = {t.ident: t.name for t in threading.enumerate()}
+        pid = os.getpid()
+
+        trace_events = []
+        for ident in sorted({event[3] for event in events}):
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": ident,
+                                 "args": {"name": threads.get(ident, f"thread-{ident}")}})
+        for name, start, duration, ident, args in events:
+            event = {"name": name, "ph": "X", "pid": pid, "tid": ident,
+                     "ts": start / 1000, "dur": duration / 1000}
+            if args:
+                event["args"] = {key: str(value) for key, value in args.items()}
+            trace_events.append(event)
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def dump(self, path):
+        """Writes the buffered spans to path as Chrome trace JSON; returns the number of spans."""
+        return write_trace(self.export(), path)
+
+def write_trace(trace, path):
+    """Writes an exported trace to path (replacing it); returns the number of spans."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(trace, f)
+    return sum(1 for event in trace["traceEvents"] if event["ph"] == "X")
+
+# Process-wide tracer used by the app's modules
+TRACER = Tracer(enabled=os.environ.get(ENV_VAR, "") not in ("", "0"))
+span = TRACER.span
+
+def enable():
+    TRACER.enabled = True
+
+def is_enabled():
+    return TRACER.enabled
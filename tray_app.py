@@ -1,14 +1,31 @@
 import threading
 import time
 import logging
+from datetime import datetime
 import platform
 import subprocess
 import os
 import sys
-from PIL import Image, ImageDraw
 import pystray
 from pystray import MenuItem as item
 from schedule_engine import ScheduleEngine
+from expiry_scheduler import ExpiryScheduler
+import icon_renderer
+import metrics
+import tracing
+
+UPDATE_LIGHT_SECONDS = metrics.histogram("blynclight_update_light_seconds", "Duration of one main loop update (reload, evaluate, push)")
+
+# "Force For" choices in the tray menu, stored as the override_duration setting
+OVERRIDE_DURATIONS = [
+    ("Until Resumed", None),
+    ("30 Minutes", 30),
+    ("1 Hour", 60),
+    ("2 Hours", 120),
+    ("Until Next Schedule Change", "next"),
+]
+# Key of the manual override's deadline in the expiry heap
+OVERRIDE_EXPIRY = "manual_override"
 
 class TrayApp:
     def __init__(self, config_store, device_manager):
@@ -23,79 +40,35 @@ class TrayApp:
         self.first_run = True
         self.startup_time = time.time()
 
+        # Wakes the main loop early on config or device changes
+        self.wake_event = threading.Event()
+        self.config_store.add_listener(self.wake_event.set)
+        self.device_manager.on_status_change = self.wake_event.set
+        # Deadlines of timed overrides; the main loop sleeps until the earliest
+        self.expiries = ExpiryScheduler()
+
     def create_image(self, color="gray"):
-        # Super-sampled size for high-fidelity rendering
-        canvas_size = 256
+        # Rendered (or cut from the pre-baked atlas) once per state and size
         target_size = 32 if self.is_mac else 64
-        
-        # Base colors (modern SaaS palette)
-        colors = {
-            "open": (16, 185, 129),    # Emerald
-            "focused": (239, 68, 68),  # Rose
-            "away": (59, 130, 246),    # Azure
-            "off": (148, 163, 184),    # Slate
-            "gray": (148, 163, 184)
-        }
-        
-        base_rgb = colors.get(color.lower(), colors["gray"])
-        
-        # Create 1.5x brighter center for the "glow"
-        center_rgb = tuple(min(255, int(c * 1.5)) for c in base_rgb)
-        
-        # Create high-res canvas with transparency
-        image = Image.new('RGBA', (canvas_size, canvas_size), (0, 0, 0, 0))
-        dc = ImageDraw.Draw(image)
-        
-        center_xy = canvas_size // 2
-        max_radius = (canvas_size // 2) - 8
-        
-        # DRAW RADIAL GRADIENT
-        # We iterate from outer to inner to create a smooth transition
-        # working at 256px resolution ensures no visible banding
-        for r in range(max_radius, 0, -2):
-            # Calculate interpolation factor (0 at center, 1 at edge)
-            # Use quadratic curve for a "stronger in middle" appearance
-            t = (r / max_radius) ** 1.8
-            
-            curr_color = tuple(
-                int(center_rgb[i] + (base_rgb[i] - center_rgb[i]) * t)
-                for i in range(3)
-            )
-            
-            bbox = [center_xy - r, center_xy - r, center_xy + r, center_xy + r]
-            dc.ellipse(bbox, fill=curr_color)
-
-        # Subtle translucent border for depth
-        dc.ellipse([center_xy - max_radius, center_xy - max_radius, 
-                   center_xy + max_radius, center_xy + max_radius], 
-                   outline=(0, 0, 0, 40), width=4)
-
-        # Downscale using high-quality Lanczos filter
-        # Handle different PIL versions for Resampling constant
-        resampling_filter = getattr(Image, 'Resampling', Image).LANCZOS if hasattr(Image, 'Resampling') else getattr(Image, 'ANTIALIAS', 1)
-        
-        return image.resize((target_size, target_size), resample=resampling_filter)
+        # User-defined states get an icon in their configured color
+        custom_rgb = self.device_manager.state_registry.get_rgb(color)
+        return icon_renderer.get_state_icon(color.lower(), target_size, custom_rgb)
 
     def is_override_active(self, item):
         """Callback for pystray to determine if 'Resume Schedule' should be shown."""
-        # Mapping labels to internal states
-        cmap = {
-            "red": "focused", 
-            "green": "open", 
-            "blue": "away",
-            "open window": "open",
-            "closed window": "focused"
-        }
-        ov = self.config_store.config.get("manual_override")
-        processed_ov = str(ov).lower() if ov is not None else "none"
-
-        # Apply mapping if the override value is one of the keys in cmap
-        if processed_ov in cmap:
-            processed_ov = cmap[processed_ov]
-            
-        # An override is active if it's not "none" or "null" after processing
-        active = processed_ov not in ["none", "null"]
-        return active
+        return self.schedule_engine.get_active_override() is not None
+
+    def get_resume_label(self, item):
+        until = self.schedule_engine.get_override_until()
+        if until is None:
+            return 'Resume Schedule'
+        return f'Resume Schedule (ends {until:%H:%M})'
+
+    def duration_action(self, duration):
+        return lambda: self.config_store.set("override_duration", duration)
+
+    def duration_checked(self, duration):
+        return lambda item: self.config_store.config.get("override_duration") == duration
 
     def setup_tray(self):
         self.icon = pystray.Icon("blynclight_scheduler", self.create_image(), "Blynclight Scheduler", menu=self.get_menu())
@@ -103,18 +76,25 @@ class TrayApp:
     def get_menu(self):
         return pystray.Menu(
             item('Blynclight Settings', self.show_settings, default=True),
-            item('Resume Schedule', self.resume_schedule, visible=self.is_override_active),
+            item(self.get_resume_label, self.resume_schedule, visible=self.is_override_active),
             pystray.Menu.SEPARATOR,
-            item('● Force Open Window', lambda: self.set_override('open')),
-            item('● Force Closed Window', lambda: self.set_override('focused')),
-            item('● Force Away', lambda: self.set_override('away')),
-            item('○ Force Off', lambda: self.set_override('off')),
+            item('● Force Open Window', lambda: self.force_state('open')),
+            item('● Force Closed Window', lambda: self.force_state('focused')),
+            item('● Force Away', lambda: self.force_state('away')),
+            item('○ Force Off', lambda: self.force_state('off')),
+            item('Force For', pystray.Menu(*[
+                item(label, self.duration_action(duration), checked=self.duration_checked(duration), radio=True)
+                for label, duration in OVERRIDE_DURATIONS
+            ])),
             pystray.Menu.SEPARATOR,
             item('Exit', self.on_exit),
         )
 
     def show_settings(self, icon=None, item=None):
-        """Launches the settings UI in a separate process."""
+        """Opens the settings UI: served from this process, or launched as a separate one."""
+        if self.config_store.config.get("settings_in_process", False):
+            self.show_settings_in_process()
+            return
         try:
             # Determine the command to run
             if getattr(sys, 'frozen', False):
@@ -129,16 +109,91 @@ class TrayApp:
         except Exception as e:
             logging.error(f"Failed to launch settings UI: {e}")
 
-    def set_override(self, status):
-        self.config_store.set("manual_override", status)
+    def show_settings_in_process(self):
+        """Serves the dashboard from the engine's own ConfigStore and device state."""
+        try:
+            import settings_server
+            import webbrowser
+            if settings_server.httpd is None:
+                # Device status changes reach /events streams right away
+                def on_status_change():
+                    self.wake_event.set()
+                    settings_server.event_hub.notify()
+                self.device_manager.on_status_change = on_status_change
+            url = settings_server.start_server(self.config_store)
+            # pywebview needs the main thread, which pystray owns here
+            webbrowser.open(url)
+        except Exception as e:
+            logging.error(f"Failed to open in-process settings: {e}")
+
+    def force_state(self, status):
+        """Tray menu force: lasts for the duration picked under "Force For"."""
+        try:
+            self.set_override(status, self.config_store.config.get("override_duration"))
+        except ValueError as e:
+            logging.error(f"Can't apply override_duration, forcing until resumed: {e}")
+            self.set_override(status)
+
+    def set_override(self, status, duration=None):
+        until = self.schedule_engine.set_override(status, duration)
         self.update_light()
+        self.wake_event.set()
+        return until
 
     def resume_schedule(self):
-        self.config_store.set("manual_override", None)
+        self.schedule_engine.set_override(None)
         self.update_light()
+        self.wake_event.set()
+
+    def sync_expiries(self):
+        """Mirrors the override's expiry (which any process may change) into the heap."""
+        until = self.schedule_engine.get_override_until()
+        if until != self.expiries.deadline(OVERRIDE_EXPIRY):
+            if until is None:
+                self.expiries.cancel(OVERRIDE_EXPIRY)
+            else:
+                self.expiries.schedule(OVERRIDE_EXPIRY, until)
+
+    def expire_overrides(self, now=None):
+        """Clears timed overrides whose deadline has passed."""
+        for key, until in self.expiries.pop_due(now or datetime.now()):
+            if key == OVERRIDE_EXPIRY and self.schedule_engine.clear_expired_override(until):
+                logging.info(f"Override expired at {until:%H:%M:%S}, resuming schedule")
+
+    def handle_command(self, name, args):
+        """Runs a command handed off by a second launch (see command_channel)."""
+        if name == "open-settings":
+            self.show_settings()
+        elif name == "force":
+            state = args[0].lower()
+            if self.device_manager.state_registry.get_rgb(state) is None:
+                raise ValueError(f"unknown state: {state}")
+            until = self.set_override(state, args[1] if len(args) > 1 else None)
+            return {"override_until": until.isoformat() if until else None}
+        elif name == "resume":
+            self.resume_schedule()
+        elif name == "status":
+            return {
+                "state": self.schedule_engine.get_desired_status(),
+                "manual_override": self.config_store.config.get("manual_override"),
+                "override_until": self.config_store.config.get("override_until"),
+                "device_status": self.device_manager.connection_status
+            }
+        elif name == "metrics":
+            # A standalone dashboard adds its own request metrics; an earlier
+            # in-process one would otherwise duplicate those families
+            return {"text": metrics.REGISTRY.render(exclude=metrics.HTTP_PREFIX)}
+        elif name == "trace-dump":
+            if not tracing.is_enabled():
+                raise ValueError("tracing is off; start with --trace or BLYNCLIGHT_TRACE=1")
+            # Sent back whole, so repeated dumps (every GET /trace) leave no files behind
+            return {"trace": tracing.TRACER.export()}
 
     def on_exit(self, icon=None, item=None):
         self.running = False
+        self.wake_event.set()
+        if "settings_server" in sys.modules:
+            sys.modules["settings_server"].stop_server()
         if self.config_store.get("turn_off_on_exit"):
             self.device_manager.turn_off()
         if self.icon:
@@ -146,25 +201,31 @@ class TrayApp:
 
     def update_light(self):
         # 0. Ensure we have latest (smart reload handles efficiency)
-        self.config_store.reload()
+        with tracing.span("config.reload"):
+            self.config_store.reload()
         cfg = self.config_store.config
+        self.sync_expiries()
         
-        # 1. Update in-memory device status ONLY
-        dev_status = self.device_manager.get_connection_status()
-        self.config_store.set("device_status", dev_status)
+        # 1. Check device health (DeviceManager publishes status changes itself)
+        with tracing.span("device.health"):
+            self.device_manager.get_connection_status()
 
         # 2. Determine desired state
-        current_override = str(cfg.get("manual_override", "none")).lower()
-        desired_status = self.schedule_engine.get_desired_status()
+        # (the expiry is part of it, since the menu shows when the override ends)
+        current_override = f'{str(cfg.get("manual_override", "none")).lower()}|{cfg.get("override_until")}'
+        with tracing.span("schedule.evaluate"):
+            desired_status = self.schedule_engine.get_desired_status()
         
         # 3. Update hardware and icons ONLY on actual transition
         # (Force update on first run or if hardware just reconnected to ensure sync)
         if desired_status != self.last_status or self.first_run or getattr(self.device_manager, 'needs_sync', False):
             logging.info(f"Syncing State: {self.last_status} -> {desired_status} (Sync Reason: {'Transition' if desired_status != self.last_status else 'Initial/Reconnect'})")
-            self.device_manager.set_status_color(desired_status)
+            with tracing.span("device.set_status_color", state=desired_status):
+                self.device_manager.set_status_color(desired_status)
             self.last_status = desired_status
             if self.icon:
-                self.icon.icon = self.create_image(desired_status)
+                with tracing.span("tray.render_icon", state=desired_status):
+                    self.icon.icon = self.create_image(desired_status)
             self.first_run = False
             
             # Reset sync flag after push
@@ -176,24 +237,77 @@ class TrayApp:
             logging.debug(f"Override Mode -> {current_override}. Refreshing menu.")
             self.last_override = current_override
             if self.icon:
-                self.icon.menu = self.get_menu()
+                with tracing.span("tray.menu"):
+                    self.icon.menu = self.get_menu()
+
+    def get_sleep_seconds(self):
+        """How long the main loop may sleep before the next update_light."""
+        cfg = self.config_store.config
+        now = datetime.now()
+        if not cfg.get("sleep_until_change", True):
+            timeout = 1
+        else:
+            # Still wake periodically to pick up changes no event reports
+            timeout = cfg.get("max_sleep_seconds", 900)
+            next_change = self.schedule_engine.next_transition(now)
+            if next_change is not None:
+                # Small margin so we never wake just before the minute flips
+                timeout = min(timeout, max(0, (next_change - now).total_seconds()) + 0.05)
+
+        # Wake exactly when the earliest timed override runs out
+        deadline = self.expiries.next_deadline()
+        if deadline is not None:
+            timeout = min(timeout, max(0, (deadline - now).total_seconds()))
+        return timeout
 
     def main_loop(self):
         logging.info("Starting optimized schedule main loop")
-        self.device_manager.connect()
+        if self.config_store.config.get("hotplug_monitor", True):
+            self.device_manager.start_hotplug()
+        # main.py may already have connected to push the first color early
+        if not self.device_manager.lights:
+            self.device_manager.connect()
         while self.running:
+            # Clear before updating so events arriving mid-update are not lost
+            self.wake_event.clear()
             try:
-                self.update_light()
+                self.expire_overrides()
+                with UPDATE_LIGHT_SECONDS.time(), tracing.span("update_light"):
+                    self.update_light()
+                timeout = self.get_sleep_seconds()
             except Exception as e:
                 logging.error(f"Error in main loop: {e}")
-            time.sleep(1)
+                timeout = 1
+            self.wait(timeout)
 
-    def run(self):
+    def wait(self, timeout):
+        """
+        Sleeps up to timeout seconds or until woken. Without a config watcher
+        nothing reports edits from the settings process, so config.json is
+        stat'ed every poll_seconds; a change notifies the store's listeners,
+        which wakes us.
+        """
+        if self.config_store.watcher:
+            self.wake_event.wait(timeout)
+            return
+        deadline = time.monotonic() + timeout
+        poll_seconds = max(0.5, self.config_store.config.get("poll_seconds") or 2)
+        while not self.wake_event.wait(min(poll_seconds, max(0, deadline - time.monotonic()))):
+            if time.monotonic() >= deadline:
+                return
+            self.config_store.reload()
+
+    def run(self, on_ready=None):
         self.setup_tray()
         
         # Run main loop in a background thread
         thread = threading.Thread(target=self.main_loop, daemon=True)
         thread.start()
         
+        def setup(icon):
+            icon.visible = True
+            if on_ready:
+                on_ready()
+
         # Run the tray icon (this is blocking)
-        self.icon.run()
+        self.icon.run(setup=setup)